@@ -0,0 +1,324 @@
+"""
+常驻分析守护进程：数据集只加载一次，分析请求走 Unix socket
+
+每个分析脚本单独运行时都要重新打开 Compustat / CCM / 成分股 / CRSP 面板缓存，
+还要用 csv.DictReader 重新解析 compustat_annual.csv 等原始 CSV、重建查找表。
+守护进程启动时把这些数据集加载进内存（data_cache.set_resident），之后各脚本里的
+load_compustat / load_link_index / load_membership / load_panel / read_csv_rows
+以及公司、行业分析的 Compustat 查找表都直接复用内存里的对象，一次分析只剩计算本身。
+
+增量重载：每次取数据集时比较源文件的 size + mtime，只有变化的那个数据集重新加载
+（依赖它的查找表下次请求时随之重建）；后台线程每 --poll 秒检查一次，把变化的数据集提前载好。
+分析脚本本身（ANALYSES 里的模块）改动后下次请求自动 importlib.reload；
+被它们 import 的公共模块（加载器等）改动需要重启守护进程。
+
+协议：一行 JSON 请求 → 一行 JSON 响应
+  {"op": "run", "analysis": "decomposition", "kwargs": {"workers": 2}}
+    → {"ok", "output"（分析的 stdout/stderr）, "error", "seconds", "reloaded"}
+  {"op": "status"} / {"op": "reload"}（丢弃全部数据集重新加载）/ {"op": "stop"}
+请求串行处理；常驻对象只读，分析代码不要修改加载到的行字典 / 查找表。
+
+python code/analysis_daemon.py serve [--poll 2]
+python code/analysis_daemon.py run decomposition [workers=2 compression=gzip]
+python code/analysis_daemon.py status | reload | stop
+"""
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+import traceback
+
+import data_cache
+from data_cache import DATA_DIR
+
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+SOCKET_PATH = os.path.join(os.path.abspath(DATA_DIR), '.cache', 'analysis_daemon.sock')
+POLL_SECONDS = 2.0
+
+# 分析名 → (模块, 入口函数)；kwargs 原样传给入口函数
+ANALYSES = {
+    'decomposition': ('sp500_decomposition', 'main'),
+    'industry': ('sp500_industry_analysis', 'analyze'),
+    'company': ('sp500_company_analysis', 'analyze'),
+    'real_returns': ('sp500_real_returns', 'main'),
+    'compare_mktcap': ('compare_mktcap', 'main'),
+    'explore': ('explore_crsp_compustat', 'main'),
+}
+
+CSV_FILES = ('compustat_annual.csv', 'ccm_link_table.csv', 'sp500_constituents.csv')
+
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+class ResidentStore:
+    """(kind, 源文件) → 已加载对象；源文件 size / mtime 变了才重新加载"""
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.RLock()
+        self.reloaded = []
+
+    def get(self, kind, source_path, load):
+        key = (kind, os.path.abspath(source_path))
+        with self.lock:
+            stamp = _stamp(key[1])
+            entry = self.entries.get(key)
+            if entry is not None and entry['stamp'] == stamp:
+                entry['hits'] += 1
+                return entry['value']
+            t0 = time.perf_counter()
+            value = load()
+            seconds = time.perf_counter() - t0
+            self.entries[key] = {'value': value, 'stamp': stamp, 'seconds': seconds,
+                                 'loaded_at': time.time(), 'hits': 0}
+            self.reloaded.append({'kind': kind, 'file': os.path.basename(key[1]), 'seconds': round(seconds, 3)})
+            return value
+
+    def evict_stale(self):
+        """丢弃源文件已变化（或已删除）的数据集 → 被丢弃的 [(kind, 文件名)]"""
+        with self.lock:
+            stale = [key for key, entry in self.entries.items() if entry['stamp'] != _stamp(key[1])]
+            for key in stale:
+                del self.entries[key]
+            return [(kind, os.path.basename(path)) for kind, path in stale]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def status(self):
+        with self.lock:
+            now = time.time()
+            return [{'kind': kind, 'file': os.path.basename(path), 'load_s': round(e['seconds'], 3),
+                     'age_s': round(now - e['loaded_at'], 1), 'hits': e['hits'],
+                     'stale': e['stamp'] != _stamp(path)}
+                    for (kind, path), e in self.entries.items()]
+
+
+def preload():
+    """加载各分析共用的数据集（源文件不存在的跳过）"""
+    from ccm_links import load_link_index
+    from compustat_cache import load_compustat
+    from crsp_panel import load_panel
+    from sp500_membership import load_membership
+
+    for loader, filename in ((load_compustat, 'compustat_annual.csv'),
+                             (load_link_index, 'ccm_link_table.csv'),
+                             (load_membership, 'sp500_constituents.csv'),
+                             (load_panel, 'crsp_monthly.csv')):
+        path = os.path.join(DATA_DIR, filename)
+        if os.path.exists(path):
+            loader(path)
+    for filename in CSV_FILES:
+        path = os.path.join(DATA_DIR, filename)
+        if os.path.exists(path):
+            data_cache.read_csv_rows(path)
+
+
+class AnalysisDaemon:
+    def __init__(self):
+        self.store = ResidentStore()
+        self.modules = {}
+        self.started = time.time()
+        self.requests = 0
+        self.stopping = threading.Event()
+        self.server = None
+
+    def load(self):
+        with self.store.lock:
+            self.store.reloaded = []
+            preload()
+            return self.store.reloaded
+
+    def refresh(self):
+        """源文件变化的数据集重新加载 → 本次加载的数据集列表"""
+        with self.store.lock:
+            if not self.store.evict_stale():
+                return []
+            return self.load()
+
+    def watch(self, interval):
+        while not self.stopping.wait(interval):
+            # 持锁打印：请求运行时 stdout 被重定向到响应里
+            with self.store.lock:
+                try:
+                    for r in self.refresh():
+                        print(f"  重新加载 {r['kind']} ({r['file']}): {r['seconds']:.2f}s", flush=True)
+                except Exception:
+                    traceback.print_exc()
+
+    def _entry(self, name):
+        if name not in ANALYSES:
+            raise KeyError(f"未知的分析: {name}（可选: {', '.join(ANALYSES)}）")
+        module_name, func = ANALYSES[name]
+        mtime = os.stat(os.path.join(CODE_DIR, module_name + '.py')).st_mtime_ns
+        module = sys.modules.get(module_name)
+        if module is None:
+            module = importlib.import_module(module_name)
+        elif self.modules.get(module_name) != mtime:
+            module = importlib.reload(module)
+        self.modules[module_name] = mtime
+        return getattr(module, func)
+
+    def run(self, name, kwargs):
+        with self.store.lock:
+            self.store.reloaded = []
+            out = io.StringIO()
+            error = None
+            t0 = time.perf_counter()
+            try:
+                func = self._entry(name)
+                with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+                    func(**kwargs)
+            except (Exception, SystemExit):
+                error = traceback.format_exc()
+            return {'ok': error is None, 'output': out.getvalue(), 'error': error,
+                    'seconds': round(time.perf_counter() - t0, 3), 'reloaded': self.store.reloaded}
+
+    def handle(self, request):
+        self.requests += 1
+        op = request.get('op')
+        if op == 'run':
+            return self.run(request.get('analysis'), request.get('kwargs') or {})
+        if op == 'status':
+            return {'ok': True, 'pid': os.getpid(), 'uptime_s': round(time.time() - self.started, 1),
+                    'requests': self.requests, 'datasets': self.store.status(), 'analyses': list(ANALYSES)}
+        if op == 'reload':
+            with self.store.lock:
+                self.store.clear()
+                return {'ok': True, 'reloaded': self.load()}
+        if op == 'stop':
+            self.stopping.set()
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+            return {'ok': True}
+        return {'ok': False, 'error': f"未知的请求: {op}"}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            response = self.server.daemon.handle(json.loads(self.rfile.readline()))
+        except Exception:
+            response = {'ok': False, 'error': traceback.format_exc()}
+        self.wfile.write((json.dumps(response, ensure_ascii=False, default=str) + '\n').encode())
+
+
+def _socket_alive(path):
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.connect(path)
+        return True
+    except OSError:
+        return False
+
+
+def serve(socket_path=SOCKET_PATH, poll=POLL_SECONDS):
+    if os.path.exists(socket_path):
+        if _socket_alive(socket_path):
+            raise SystemExit(f"守护进程已在运行: {socket_path}")
+        os.remove(socket_path)
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+
+    daemon = AnalysisDaemon()
+    data_cache.set_resident(daemon.store)
+    print("加载数据集...", flush=True)
+    t0 = time.perf_counter()
+    for r in daemon.load():
+        print(f"  {r['kind']} ({r['file']}): {r['seconds']:.2f}s")
+    print(f"  完成: {time.perf_counter() - t0:.1f}s", flush=True)
+
+    with socketserver.UnixStreamServer(socket_path, _Handler) as server:
+        server.daemon = daemon
+        daemon.server = server
+        if poll > 0:
+            threading.Thread(target=daemon.watch, args=(poll,), daemon=True).start()
+        print(f"监听 {socket_path}（pid {os.getpid()}）", flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            daemon.stopping.set()
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(socket_path)
+    print("守护进程已退出")
+
+
+def request(payload, socket_path=SOCKET_PATH):
+    """发一个请求给守护进程 → 响应 dict"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(socket_path)
+        s.sendall((json.dumps(payload) + '\n').encode())
+        with s.makefile('rb') as f:
+            return json.loads(f.readline())
+
+
+def _parse_kwargs(items):
+    """['workers=2', 'compression=gzip'] → {'workers': 2, 'compression': 'gzip'}（值按 JSON 解析，失败时当字符串）"""
+    kwargs = {}
+    for item in items:
+        key, sep, value = item.partition('=')
+        if not sep:
+            raise SystemExit(f"参数格式应为 key=value: {item}")
+        try:
+            kwargs[key] = json.loads(value)
+        except ValueError:
+            kwargs[key] = value
+    return kwargs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="常驻分析守护进程（Unix socket）")
+    parser.add_argument('--socket', default=SOCKET_PATH, help="Unix socket 路径")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('serve', help="启动守护进程（前台运行）")
+    p.add_argument('--poll', type=float, default=POLL_SECONDS, help="检查源文件变化的间隔秒数（0 = 只在请求时检查）")
+    p = sub.add_parser('run', help="让守护进程运行一个分析")
+    p.add_argument('analysis', choices=sorted(ANALYSES))
+    p.add_argument('kwargs', nargs='*', metavar='key=value', help="传给分析入口函数的参数")
+    sub.add_parser('status', help="已加载的数据集")
+    sub.add_parser('reload', help="丢弃全部数据集重新加载")
+    sub.add_parser('stop', help="停止守护进程")
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args.socket, args.poll)
+        sys.exit(0)
+    try:
+        if args.command == 'run':
+            response = request({'op': 'run', 'analysis': args.analysis, 'kwargs': _parse_kwargs(args.kwargs)},
+                               args.socket)
+        else:
+            response = request({'op': args.command}, args.socket)
+    except (FileNotFoundError, ConnectionRefusedError):
+        sys.exit(f"守护进程未运行（{args.socket}）；先运行: python code/analysis_daemon.py serve")
+
+    if args.command == 'run':
+        sys.stdout.write(response.get('output', ''))
+        reloaded = ', '.join(f"{r['kind']}({r['file']})" for r in response.get('reloaded', [])) or '无'
+        print(f"\n[守护进程] {response.get('seconds', 0):.2f}s，重新加载: {reloaded}", file=sys.stderr)
+    elif args.command == 'status' and response.get('ok'):
+        print(f"pid {response['pid']}，运行 {response['uptime_s']}s，请求 {response['requests']} 次")
+        for d in response['datasets']:
+            flag = '（已变化）' if d['stale'] else ''
+            print(f"  {d['kind']:<28} {d['file']:<26} 加载 {d['load_s']:>7.3f}s  "
+                  f"{d['age_s']:>8.1f}s 前  命中 {d['hits']}{flag}")
+    elif args.command == 'reload' and response.get('ok'):
+        for r in response['reloaded']:
+            print(f"  {r['kind']} ({r['file']}): {r['seconds']:.2f}s")
+    if not response.get('ok'):
+        print(response.get('error') or '请求失败', file=sys.stderr)
+        sys.exit(1)
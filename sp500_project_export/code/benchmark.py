@@ -0,0 +1,329 @@
+"""
+流水线分阶段基准测试：按合成数据规模扫描，记录耗时 / 吞吐 / 峰值内存，并与基线对比
+
+每个阶段在独立子进程里运行（前置数据在子进程内准备，不计时），峰值 RSS 由子进程自己报告：
+  crsp_csv_load     crsp_monthly.csv → 列式缓存（crsp_cache.build_cache）
+  compustat_load    compustat_annual.csv → 列式缓存（compustat_cache.build_compustat_cache）
+  link_map          CCM 链接区间索引 + S&P 500 成员位图（build_link_index / build_membership）
+  company_records   sp500_decomposition.build_company_records
+  aggregation       rollup_companies + aggregate_to_sectors + aggregate_to_total
+  compute_rolling   sp500_decomposition.compute_rolling（输入只有几十年，重复多次取均值）
+  shiller_rolling   shiller_complete.rolling_decomposition（与数据规模无关，只跑一次）
+  rebuild_report    rebuild_report.py 生成 HTML（在临时目录里运行，不覆盖 report/；与规模无关；
+                    输入固定为 REPORT_INPUTS 的副本，不读 data/ 下另外生成的三层分解等文件）
+合成数据由 synthetic_data.generate 按规模生成并缓存在 --work 目录下，同一 (scale, seed) 只生成一次。
+
+结果 JSON：{metadata, results: {阶段: {规模: {seconds, rows, unit, rows_per_s, peak_rss_mb}}}}。
+与基线对比时，耗时或峰值内存超过基线 (1 + tolerance) 倍的记为回归（耗时另需多出 NOISE_FLOOR_S），
+进程以退出码 1 结束。处理的行数（rebuild_report 为输出字节数）与基线不同时说明输入不同，该项不比较。
+
+python code/benchmark.py [--scales 0.1,0.5,1] [--stages ...] [--save-baseline]
+"""
+import argparse
+import contextlib
+import csv
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_DIR = os.path.normpath(os.path.join(CODE_DIR, '..', 'benchmarks'))
+BASELINE_PATH = os.path.join(BENCH_DIR, 'baseline.json')
+RESULTS_PATH = os.path.join(BENCH_DIR, 'results.json')
+WORK_DIR = os.path.join(tempfile.gettempdir(), 'sp500_benchmark')
+DATA_DIR = os.path.normpath(os.path.join(CODE_DIR, '..', 'data'))
+
+DEFAULT_SCALES = (0.1, 0.5, 1.0)
+TOLERANCE = 0.25
+NOISE_FLOOR_S = 0.02   # 耗时差小于此值不算回归（毫秒级阶段的计时抖动）
+FIXED = 'fixed'   # 与规模无关的阶段的结果键
+# rebuild_report 阶段的固定输入（data/ 下受版本管理的文件）；三层分解缺失时报告里该部分为空
+REPORT_INPUTS = ('sp500_analysis.json', 'sp500_cagr_triangle.bin', 'turnover_data.json',
+                 'duration_dist.json', 'shiller_complete.json')
+
+
+# ── 阶段 ──────────────────────────────────────────────
+# 每个阶段: setup(data_dir) → 输入（不计时），run(输入) → 处理的行数
+
+def _decomposition_inputs(data_dir):
+    from ccm_links import load_link_index
+    from compustat_cache import load_compustat
+    from sp500_decomposition import END_YEAR, START_YEAR
+    from sp500_membership import load_membership
+    link_index = load_link_index(os.path.join(data_dir, 'ccm_link_table.csv'))
+    membership = load_membership(os.path.join(data_dir, 'sp500_constituents.csv'))
+    compustat = load_compustat(os.path.join(data_dir, 'compustat_annual.csv'))
+    with open(os.path.join(data_dir, 'ccm_link_table.csv'), 'r') as f:
+        gvkey_to_name = {r['gvkey']: r['conm'] for r in csv.DictReader(f)}
+    return membership.by_year(START_YEAR - 1, END_YEAR), link_index, compustat, gvkey_to_name
+
+
+def _company_records(data_dir):
+    from sp500_decomposition import build_company_records
+    return build_company_records(*_decomposition_inputs(data_dir))
+
+
+def _agg_data(data_dir):
+    from sp500_decomposition import aggregate_to_sectors, aggregate_to_total, rollup_companies
+    rollup = rollup_companies(_company_records(data_dir))
+    aggregate_to_sectors(rollup)
+    return aggregate_to_total(rollup)
+
+
+def _run_crsp_csv_load(path):
+    from crsp_cache import build_cache, load_crsp_columns
+    build_cache(path)
+    return len(load_crsp_columns(['PERMNO'], csv_path=path)['PERMNO'])
+
+
+def _run_compustat_load(path):
+    from compustat_cache import CompustatAnnual, build_compustat_cache
+    return len(CompustatAnnual(build_compustat_cache(path)))
+
+
+def _run_link_map(data_dir):
+    from ccm_links import build_link_index
+    from sp500_membership import build_membership
+    build_link_index(os.path.join(data_dir, 'ccm_link_table.csv'))
+    build_membership(os.path.join(data_dir, 'sp500_constituents.csv'))
+    rows = 0
+    for name in ('ccm_link_table.csv', 'sp500_constituents.csv'):
+        with open(os.path.join(data_dir, name), 'rb') as f:
+            rows += sum(1 for _ in f) - 1
+    return rows
+
+
+def _run_company_records(inputs):
+    from sp500_decomposition import build_company_records
+    return len(build_company_records(*inputs))
+
+
+def _run_aggregation(records):
+    from sp500_decomposition import aggregate_to_sectors, aggregate_to_total, rollup_companies
+    rollup = rollup_companies(records)
+    aggregate_to_sectors(rollup)
+    aggregate_to_total(rollup)
+    return len(records)
+
+
+def _run_compute_rolling(agg_data):
+    from sp500_decomposition import compute_rolling
+    compute_rolling(agg_data)
+    return len(agg_data)
+
+
+def _shiller_decomp(_data_dir):
+    from shiller_complete import build_shiller_annual, compute_decomposition
+    return compute_decomposition(build_shiller_annual())
+
+
+def _run_shiller_rolling(decomp):
+    from shiller_complete import rolling_decomposition
+    rolling_decomposition(decomp)
+    return len(decomp)
+
+
+def _report_sandbox(_data_dir):
+    """临时目录：code/rebuild_report.py 副本 + 只含 REPORT_INPUTS 副本的 data/ + 空 report/"""
+    root = tempfile.mkdtemp(prefix='rebuild_report_')
+    for sub in ('code', 'data', 'report'):
+        os.makedirs(os.path.join(root, sub))
+    shutil.copy(os.path.join(CODE_DIR, 'rebuild_report.py'), os.path.join(root, 'code'))
+    for name in REPORT_INPUTS:
+        shutil.copy(os.path.join(DATA_DIR, name), os.path.join(root, 'data'))
+    return root
+
+
+def _run_rebuild_report(root):
+    import runpy
+    script = os.path.join(root, 'code', 'rebuild_report.py')
+    argv = sys.argv
+    try:
+        sys.argv = [script]   # 单文件模式；不把基准脚本自己的参数传给它的 argparse
+        runpy.run_path(script, run_name='__main__')
+        return os.path.getsize(os.path.join(root, 'report', 'sp500_mean_reversion.html'))
+    finally:
+        sys.argv = argv
+        shutil.rmtree(root, ignore_errors=True)
+
+
+# 名称: (setup, run, 单位, 重复次数, 是否随规模变化)
+STAGES = {
+    'crsp_csv_load': (lambda d: os.path.join(d, 'crsp_monthly.csv'), _run_crsp_csv_load, 'rows', 1, True),
+    'compustat_load': (lambda d: os.path.join(d, 'compustat_annual.csv'), _run_compustat_load, 'rows', 1, True),
+    'link_map': (lambda d: d, _run_link_map, 'rows', 1, True),
+    'company_records': (_decomposition_inputs, _run_company_records, 'records', 1, True),
+    'aggregation': (_company_records, _run_aggregation, 'records', 1, True),
+    'compute_rolling': (_agg_data, _run_compute_rolling, 'years', 200, True),
+    'shiller_rolling': (_shiller_decomp, _run_shiller_rolling, 'years', 50, False),
+    'rebuild_report': (_report_sandbox, _run_rebuild_report, 'bytes', 1, False),
+}
+
+
+def peak_rss_mb():
+    """本进程峰值 RSS（MB）：Linux 读 /proc/self/status 的 VmHWM（exec 后重新计数，
+    不含父进程 fork 前的内存），其他平台用 ru_maxrss（macOS 为字节，其余为 KB）"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1 << 20) if sys.platform == 'darwin' else rss / 1024
+
+
+def run_stage(name, data_dir):
+    """子进程入口：准备输入 → 计时运行 → 结果 JSON 打印到 stdout 最后一行"""
+    setup, run, unit, repeat, _ = STAGES[name]
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        inputs = setup(data_dir)
+        if repeat > 1:
+            run(inputs)   # 预热一次，不计时
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            rows = run(inputs)
+        seconds = (time.perf_counter() - t0) / repeat
+    print(json.dumps({'seconds': seconds, 'rows': rows, 'unit': unit, 'peak_rss_mb': round(peak_rss_mb(), 1)}))
+
+
+def measure(name, data_dir):
+    """在子进程里跑一个阶段 → {seconds, rows, unit, rows_per_s, peak_rss_mb}"""
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-stage', name, '--data', data_dir],
+                          cwd=CODE_DIR, stdout=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise RuntimeError(f"阶段 {name} 失败（退出码 {proc.returncode}）")
+    result = json.loads(proc.stdout.decode().strip().splitlines()[-1])
+    result['rows_per_s'] = result['rows'] / result['seconds'] if result['seconds'] > 0 else None
+    return result
+
+
+def synthetic_dir(scale, seed, work_dir=WORK_DIR):
+    """按 (scale, seed) 生成一次合成数据并复用"""
+    from synthetic_data import generate
+    out = os.path.join(work_dir, f'scale_{scale:g}_seed_{seed}')
+    done = os.path.join(out, '.complete')
+    if not os.path.exists(done):
+        shutil.rmtree(out, ignore_errors=True)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            generate(out, scale, seed)
+        open(done, 'w').close()
+    return out
+
+
+def run_suite(scales, stages, seed=1, work_dir=WORK_DIR):
+    results = {name: {} for name in stages}
+    fixed_done = set()
+    for scale in scales:
+        t0 = time.time()
+        data_dir = synthetic_dir(scale, seed, work_dir)
+        print(f"\n规模 {scale:g}（合成数据 {time.time() - t0:.1f}s）: {data_dir}")
+        for name in stages:
+            scaled = STAGES[name][4]
+            if not scaled and name in fixed_done:
+                continue
+            r = measure(name, data_dir)
+            key = f'{scale:g}' if scaled else FIXED
+            results[name][key] = r
+            fixed_done.add(name)
+            rate = f"{r['rows_per_s']:>14,.0f} {r['unit']}/s" if r['rows_per_s'] else ''
+            print(f"  {name:<16} {r['seconds'] * 1000:>10.1f} ms {r['rows']:>12,} {r['unit']:<8} "
+                  f"{rate:<24} 峰值 {r['peak_rss_mb']:>7.1f} MB")
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """→ 回归列表 [(阶段, 规模, 指标, 基线, 当前, 比值)]"""
+    regressions = []
+    print(f"\n与基线对比（容差 {tolerance:.0%}）:")
+    for name, by_scale in results.items():
+        for key, r in by_scale.items():
+            b = baseline.get('results', {}).get(name, {}).get(key)
+            if b is None:
+                continue
+            if b.get('rows') != r['rows']:
+                print(f"  {name:<16} {key:>6} 输入与基线不同（{b.get('rows')} → {r['rows']} {r['unit']}），不比较")
+                continue
+            for metric in ('seconds', 'peak_rss_mb'):
+                if not b.get(metric):
+                    continue
+                ratio = r[metric] / b[metric]
+                flag = ratio > 1 + tolerance
+                if metric == 'seconds' and r[metric] - b[metric] < NOISE_FLOOR_S:
+                    flag = False
+                if flag:
+                    regressions.append((name, key, metric, b[metric], r[metric], ratio))
+                print(f"  {name:<16} {key:>6} {metric:<12} {b[metric]:>10.4g} → {r[metric]:>10.4g} "
+                      f"({ratio:>5.2f}x){'  ← 回归' if flag else ''}")
+    return regressions
+
+
+def metadata(scales, seed):
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'scales': [f'{s:g}' for s in scales],
+        'seed': seed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流水线分阶段基准测试")
+    parser.add_argument('--scales', default=','.join(f'{s:g}' for s in DEFAULT_SCALES), help="逗号分隔的合成数据规模")
+    parser.add_argument('--stages', default=','.join(STAGES), help="逗号分隔的阶段名")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--work', default=WORK_DIR, help="合成数据缓存目录")
+    parser.add_argument('--output', default=RESULTS_PATH)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--save-baseline', action='store_true', help="把本次结果写为基线")
+    parser.add_argument('--run-stage', help=argparse.SUPPRESS)
+    parser.add_argument('--data', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_stage:
+        run_stage(args.run_stage, args.data)
+        return
+
+    scales = [float(s) for s in args.scales.split(',') if s]
+    stages = [s for s in args.stages.split(',') if s]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        parser.error(f"未知阶段: {unknown}，可选: {list(STAGES)}")
+
+    output = {'metadata': metadata(scales, args.seed), 'results': run_suite(scales, stages, args.seed, args.work)}
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2)
+    print(f"\n结果已保存到: {args.output}")
+
+    if args.save_baseline:
+        shutil.copy(args.output, args.baseline)
+        print(f"已写为基线: {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print("没有基线（用 --save-baseline 生成）")
+        return
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+    regressions = compare(output['results'], baseline, args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} 项回归")
+        sys.exit(1)
+    print("\n无回归")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,15 @@
 """
 均值回归分析：计算所有滚动年化收益率数据，输出为 JSON 供 HTML 可视化使用
 """
+import argparse
 import json
 import math
 from sp500_data import SP500_TOTAL_RETURNS, CPI_INFLATION
+from rolling_returns import CumulativeGrowth, range_stats
+import profiling
+
+parser = argparse.ArgumentParser(description="滚动收益分析 → sp500_analysis.json + sp500_cagr_triangle.bin（写到当前目录）")
+profiling.configure(profiling.add_arguments(parser).parse_args())
 
 years = sorted(SP500_TOTAL_RETURNS.keys())
 n = len(years)
@@ -28,43 +34,51 @@ for y in years:
     cumulative_real.append({"year": y, "value": round(val_real, 2)})
 
 # ========== 3. 滚动年化收益率（不同窗口） ==========
-def calc_rolling_cagr(returns_dict, window):
-    """计算滚动N年年化复合收益率"""
-    results = []
-    for i in range(window, n):
-        end_year = years[i]
-        start_year = years[i - window]
-        # 计算复合增长
-        product = 1.0
-        for j in range(i - window + 1, i + 1):
-            product *= (1 + returns_dict[years[j]] / 100)
-        cagr = (product ** (1.0 / window) - 1) * 100
-        results.append({"year": end_year, "cagr": round(cagr, 2), "start": start_year})
-    return results
+# 累计对数增长前缀和：任意 (起, 止) 年化收益 O(1)，整列向量化
+growth_nominal = CumulativeGrowth([SP500_TOTAL_RETURNS[y] for y in years])
+growth_real = CumulativeGrowth([real_returns[y] for y in years])
+
+def calc_rolling_cagr(growth, window):
+    """计算滚动N年年化复合收益率（窗口为第 i-window+1 .. i 年，i >= window）"""
+    cagrs = growth.rolling(window)[1:]
+    return [{"year": years[i], "cagr": round(c, 2), "start": years[i - window]}
+            for i, c in zip(range(window, n), cagrs.tolist())]
 
 windows = [1, 3, 5, 10, 15, 20, 30]
 rolling_nominal = {}
 rolling_real = {}
-for w in windows:
-    rolling_nominal[w] = calc_rolling_cagr(SP500_TOTAL_RETURNS, w)
-    rolling_real[w] = calc_rolling_cagr(real_returns, w)
+with profiling.stage("滚动年化收益"):
+    for w in windows:
+        rolling_nominal[w] = calc_rolling_cagr(growth_nominal, w)
+        rolling_real[w] = calc_rolling_cagr(growth_real, w)
 
 # ========== 4. 从任意年份开始持有到2024的CAGR ==========
 hold_to_end = []
-end_year_idx = n - 1
-for i in range(n - 1):
-    start_y = years[i]
-    holding_period = end_year_idx - i
-    product = 1.0
-    for j in range(i, n):
-        product *= (1 + real_returns[years[j]] / 100)
-    cagr = (product ** (1.0 / (n - i)) - 1) * 100
+for i, cagr in enumerate(growth_real.hold_to_end()[:n - 1].tolist()):
     hold_to_end.append({
-        "start_year": start_y,
+        "start_year": years[i],
         "holding_years": n - i,
         "cagr_real": round(cagr, 2)
     })
 
+# ========== 4b. 全部 (起, 止) 区间的 CAGR 三角表 ==========
+# 二进制旁路文件：实际、名义两块 float32（小端），各为上三角按行压缩；布局写进 JSON 的 cagr_triangle
+TRIANGLE_FILE = "sp500_cagr_triangle.bin"
+triangle_blocks = ["real", "nominal"]
+with profiling.stage("CAGR 三角表"), open(TRIANGLE_FILE, "wb") as f:
+    for growth in (growth_real, growth_nominal):
+        growth.cagr_triangle().astype("<f4").tofile(f)
+cagr_triangle = {
+    "file": TRIANGLE_FILE,
+    "dtype": "float32-le",
+    "layout": "upper-triangular, row-major packed: row i = start index, j = i..n-1 = end index (inclusive); "
+              "offset = i*(2n-i+1)/2 + (j-i); value = annualized return % over years[i]..years[j]",
+    "years": years,
+    "n": n,
+    "blocks": triangle_blocks,
+    "block_size": n * (n + 1) // 2,
+}
+
 # ========== 5. 不同持有期的收益率分布（范围） ==========
 range_by_window = {}
 for w in windows:
@@ -72,14 +86,9 @@ for w in windows:
         vals = [real_returns[y] for y in years]
     else:
         vals = [r["cagr"] for r in rolling_real[w]]
-    if vals:
-        range_by_window[w] = {
-            "min": round(min(vals), 2),
-            "max": round(max(vals), 2),
-            "mean": round(sum(vals) / len(vals), 2),
-            "median": round(sorted(vals)[len(vals)//2], 2),
-            "count": len(vals)
-        }
+    stats = range_stats(vals)
+    if stats:
+        range_by_window[w] = {k: (round(v, 2) if k != "count" else v) for k, v in stats.items()}
 
 # ========== 6. 年度数据表 ==========
 yearly_table = []
@@ -125,9 +134,10 @@ output = {
     "rolling_real": {str(k): v for k, v in rolling_real.items()},
     "hold_to_end": hold_to_end,
     "range_by_window": {str(k): v for k, v in range_by_window.items()},
+    "cagr_triangle": cagr_triangle,
 }
 
-with open("sp500_analysis.json", "w") as f:
+with profiling.stage("写 JSON"), open("sp500_analysis.json", "w") as f:
     json.dump(output, f)
 
 print("=== 汇总统计 ===")
@@ -141,4 +151,4 @@ for w in windows:
     r = range_by_window[w]
     print(f"{w:>4}年 | {r['min']:>7.2f}% | {r['max']:>7.2f}% | {r['mean']:>7.2f}% | {r['median']:>7.2f}%")
 print()
-print(f"✅ 数据输出到 sp500_analysis.json")
+print(f"✅ 数据输出到 sp500_analysis.json（区间 CAGR 三角表: {TRIANGLE_FILE}）")
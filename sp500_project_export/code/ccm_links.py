@@ -0,0 +1,190 @@
+"""
+CCM 链接解析索引：PERMNO + 日期 → GVKEY
+
+语义与原 get_gvkey 完全一致：
+  - 同一 PERMNO 的链接按 LINKPRIM 优先级 P > C > J > N > 其他 排序（同级保持文件顺序）
+  - 查询日期落在 [LINKDT, LINKENDDT] 内的第一条链接胜出（LINKENDDT = 'E' 视为 2099-12-31）
+  - 都不覆盖时退回优先级最高的那条
+构建时把每个 PERMNO 的链接展开成互不重叠的整数日期区段（区段起点 + GVKEY），
+任意日期用 bisect 做 as-of 查询；另外预先算好 permno × 年（年中 06-30）的稠密 GVKEY 表，
+一整年成分股的解析就是一次数组 gather。
+索引以 ccm_link_table.csv 的指纹为键持久化在 .cache/ccm_links/，所有脚本共用。
+"""
+import csv
+import os
+from bisect import bisect_right
+
+import numpy as np
+
+from data_cache import (DATA_DIR, cache_dir_for, file_fingerprint, is_fresh, replace_dir, resident,
+                        write_manifest)
+import profiling
+
+CCM_PATH = os.path.join(DATA_DIR, 'ccm_link_table.csv')
+
+CACHE_NAME = 'ccm_links'
+CACHE_VERSION = 1
+
+LINKPRIM_PRIORITY = {'P': 0, 'C': 1, 'J': 2, 'N': 3}
+OPEN_END = 20991231
+DENSE_YEARS = (1925, 2030)   # 稠密表覆盖的年份，范围外走 bisect
+NO_LINK = -1
+
+
+def date_to_int(s):
+    """'YYYY-MM-DD' → YYYYMMDD；空串为 0（与字符串比较时空串最小的行为一致）"""
+    s = s.strip()
+    return int(s.replace('-', '')) if s else 0
+
+
+def _resolve_segments(links):
+    """
+    一个 PERMNO 的链接（已按优先级排序）→ 互不重叠的区段 [(起点, gvkey_id), ...]
+    每个区段内查询结果不变；区段边界取所有 LINKDT 和 LINKENDDT + 1
+    """
+    fallback = links[0][2]
+    points = {0}
+    for start, end, _ in links:
+        points.add(start)
+        points.add(end + 1)
+    segments = []
+    for p in sorted(points):
+        gid = fallback
+        for start, end, g in links:
+            if start <= p <= end:
+                gid = g
+                break
+        if not segments or segments[-1][1] != gid:
+            segments.append((p, gid))
+    return segments
+
+
+def build_link_index(csv_path=CCM_PATH):
+    gvkeys = []
+    gvkey_id = {}
+    links = {}  # permno -> [(priority, start, end, gvkey_id)]
+    with open(csv_path, 'r') as f:
+        for r in csv.DictReader(f):
+            try:
+                permno = int(r['LPERMNO'])
+            except ValueError:
+                continue
+            gvkey = r['gvkey']
+            if gvkey not in gvkey_id:
+                gvkey_id[gvkey] = len(gvkeys)
+                gvkeys.append(gvkey)
+            end = OPEN_END if r['LINKENDDT'] == 'E' else date_to_int(r['LINKENDDT'])
+            priority = LINKPRIM_PRIORITY.get(r['LINKPRIM'], 4)
+            links.setdefault(permno, []).append((priority, date_to_int(r['LINKDT']), end, gvkey_id[gvkey]))
+
+    permnos = np.array(sorted(links), dtype=np.int32)
+    seg_offsets = [0]
+    seg_start = []
+    seg_gvkey = []
+    y0, y1 = DENSE_YEARS
+    mid_year = np.arange(y0, y1 + 1) * 10000 + 630
+    dense = np.full((len(permnos), len(mid_year)), NO_LINK, dtype=np.int32)
+    for i, permno in enumerate(permnos.tolist()):
+        ordered = [(s, e, g) for _, s, e, g in sorted(links[permno], key=lambda x: x[0])]
+        segments = _resolve_segments(ordered)
+        starts = np.array([p for p, _ in segments], dtype=np.int64)
+        ids = np.array([g for _, g in segments], dtype=np.int32)
+        dense[i] = ids[np.searchsorted(starts, mid_year, side='right') - 1]
+        seg_start.extend(starts.tolist())
+        seg_gvkey.extend(ids.tolist())
+        seg_offsets.append(len(seg_start))
+
+    cache_dir = cache_dir_for(csv_path, CACHE_NAME)
+    tmp_dir = cache_dir + '.tmp'
+    os.makedirs(tmp_dir, exist_ok=True)
+    np.savez(os.path.join(tmp_dir, 'index.npz'),
+             permnos=permnos,
+             seg_offsets=np.array(seg_offsets, dtype=np.int64),
+             seg_start=np.array(seg_start, dtype=np.int64),
+             seg_gvkey=np.array(seg_gvkey, dtype=np.int32),
+             dense=dense,
+             gvkeys=np.array(gvkeys, dtype=str))
+    write_manifest(tmp_dir, {'version': CACHE_VERSION, 'source': file_fingerprint(csv_path),
+                             'dense_years': list(DENSE_YEARS)})
+    replace_dir(tmp_dir, cache_dir)
+    return cache_dir
+
+
+def _permno(value):
+    """PERMNO（字符串或整数）→ int；无法解析时为 None，与原 get_gvkey 查不到时一样当作无链接"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class LinkIndex:
+    def __init__(self, cache_dir):
+        with np.load(os.path.join(cache_dir, 'index.npz')) as z:
+            self.permnos = z['permnos']
+            self.seg_offsets = z['seg_offsets']
+            self.seg_start = z['seg_start']
+            self.seg_gvkey = z['seg_gvkey']
+            self.dense = z['dense']
+            self.gvkeys = z['gvkeys'].tolist()
+        self._row = dict(zip(self.permnos.tolist(), range(len(self.permnos))))
+
+    def rows_for(self, permnos):
+        """PERMNO 数组 → 索引行号数组（没有链接的为 -1）"""
+        permnos = np.asarray(permnos, dtype=np.int64)
+        if len(self.permnos) == 0:
+            return np.full(len(permnos), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.permnos, permnos), len(self.permnos) - 1)
+        return np.where(self.permnos[pos] == permnos, pos, -1)
+
+    def _asof_id(self, row, yyyymmdd):
+        lo, hi = int(self.seg_offsets[row]), int(self.seg_offsets[row + 1])
+        k = bisect_right(self.seg_start[lo:hi].tolist(), yyyymmdd) - 1
+        return int(self.seg_gvkey[lo + k])
+
+    def gvkey_asof(self, permno, yyyymmdd):
+        """任意日期的 as-of 查询（bisect）"""
+        i = self._row.get(_permno(permno))
+        if i is None:
+            return None
+        return self.gvkeys[self._asof_id(i, yyyymmdd)]
+
+    def gvkey(self, permno, year):
+        """等价于原 get_gvkey(mapping, permno, year)：按 year-06-30 解析"""
+        i = self._row.get(_permno(permno))
+        if i is None:
+            return None
+        y0, y1 = DENSE_YEARS
+        if not y0 <= year <= y1:
+            return self.gvkeys[self._asof_id(i, year * 10000 + 630)]
+        return self.gvkeys[int(self.dense[i, year - y0])]
+
+    def gvkey_ids_for_year(self, permnos, year):
+        """一整年成分股的向量化解析 → gvkey id 数组（NO_LINK = 无链接）"""
+        rows = self.rows_for(permnos)
+        y0, y1 = DENSE_YEARS
+        if not y0 <= year <= y1:
+            return np.array([NO_LINK if r < 0 else self._asof_id(r, year * 10000 + 630)
+                             for r in rows.tolist()], dtype=np.int32)
+        ids = self.dense[np.maximum(rows, 0), year - y0]
+        return np.where(rows >= 0, ids, NO_LINK).astype(np.int32)
+
+    def gvkeys_for_year(self, permnos, year):
+        """同上，返回 GVKEY 字符串列表（无链接或 PERMNO 不是整数为 None），顺序与输入一致"""
+        rows = [_permno(p) for p in permnos]
+        ids = self.gvkey_ids_for_year(np.array([-1 if p is None else p for p in rows], dtype=np.int64), year)
+        return [self.gvkeys[g] if g >= 0 else None for g in ids.tolist()]
+
+
+@profiling.profiled("加载 CCM 链接")
+def load_link_index(csv_path=CCM_PATH):
+    def load():
+        cache_dir = cache_dir_for(csv_path, CACHE_NAME)
+        if not is_fresh(cache_dir, csv_path, CACHE_VERSION):
+            build_link_index(csv_path)
+        return LinkIndex(cache_dir)
+    return resident(CACHE_NAME, csv_path, load)
+
+
+if __name__ == "__main__":
+    build_link_index()
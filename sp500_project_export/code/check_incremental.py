@@ -0,0 +1,147 @@
+"""
+增量三层分解的回归检查：--incremental 的结果必须与全量重算逐字节相同
+
+对每个要检查的财年 FY，在临时目录里放一份 code/ 副本和输入数据：
+  1. compustat_annual.csv 去掉 FY 的行，全量运行 sp500_decomposition.py（留下增量状态）
+  2. 把 FY 的行追加回文件末尾，运行 --incremental，确认走的是增量路径
+  3. 删掉 .cache/ 全量重算，data/sp500_3level_decomposition/ 与第 2 步的结果逐文件比较
+FY 在分析窗口之外时第 2 步应报告"新增行在窗口之外"，结果同样要与全量一致。
+
+输入默认取 data/crsp_compustat/ 下的 CSV；--synthetic SCALE 改用合成数据（synthetic_data.generate）。
+任何一年不一致时以退出码 1 结束。
+
+python code/check_incremental.py [--years 2024,1990] [--synthetic 0.1]
+"""
+import argparse
+import contextlib
+import csv
+import filecmp
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from compustat_cache import fiscal_year
+from sp500_decomposition import END_YEAR, START_YEAR
+
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.normpath(os.path.join(CODE_DIR, '..', 'data', 'crsp_compustat'))
+INPUTS = ('compustat_annual.csv', 'ccm_link_table.csv', 'sp500_constituents.csv')
+DEFAULT_YEARS = (END_YEAR, (START_YEAR + END_YEAR) // 2, END_YEAR + 1)
+
+
+def _fiscal(datadate):
+    """YYYY-MM-DD → 财年；空值 / 无法解析时返回 None"""
+    try:
+        return int(fiscal_year(int(datadate[:4] + datadate[5:7] + datadate[8:10])))
+    except ValueError:
+        return None
+
+
+def split_compustat(path, fy):
+    """compustat_annual.csv → (表头 + 去掉 fy 的行, fy 的行)，保留原始行文本"""
+    with open(path, newline='') as f:
+        lines = f.readlines()
+    col = next(csv.reader([lines[0]])).index('datadate')
+    kept, moved = [lines[0]], []
+    for line in lines[1:]:
+        row = next(csv.reader([line]))
+        (moved if len(row) > col and _fiscal(row[col]) == fy else kept).append(line)
+    return ''.join(kept), ''.join(moved)
+
+
+def _run(root, *args):
+    proc = subprocess.run([sys.executable, os.path.join(root, 'code', 'sp500_decomposition.py'), *args],
+                          cwd=os.path.join(root, 'code'), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = proc.stdout.decode()
+    if proc.returncode != 0:
+        raise RuntimeError(f"sp500_decomposition.py {' '.join(args)} 失败:\n{output[-2000:]}")
+    return output
+
+
+def _diff_dirs(a, b):
+    """两个目录（递归）中不同 / 只在一边的文件 → [相对路径]"""
+    cmp = filecmp.dircmp(a, b)
+    diffs = cmp.left_only + cmp.right_only + cmp.funny_files
+    _, mismatch, errors = filecmp.cmpfiles(a, b, cmp.common_files, shallow=False)
+    diffs += mismatch + errors
+    for sub in cmp.common_dirs:
+        diffs += [os.path.join(sub, d) for d in _diff_dirs(os.path.join(a, sub), os.path.join(b, sub))]
+    return sorted(diffs)
+
+
+def check_year(fy, data_dir):
+    """→ (是否一致, 说明)"""
+    root = tempfile.mkdtemp(prefix='check_incremental_')
+    try:
+        inputs = os.path.join(root, 'data', 'crsp_compustat')
+        os.makedirs(inputs)
+        os.makedirs(os.path.join(root, 'code'))
+        for name in os.listdir(CODE_DIR):
+            if name.endswith('.py'):
+                shutil.copy(os.path.join(CODE_DIR, name), os.path.join(root, 'code'))
+        for name in INPUTS[1:]:
+            shutil.copy(os.path.join(data_dir, name), inputs)
+        base, tail = split_compustat(os.path.join(data_dir, 'compustat_annual.csv'), fy)
+        if not tail:
+            return True, "没有该财年的行，跳过"
+        compustat = os.path.join(inputs, 'compustat_annual.csv')
+        with open(compustat, 'w', newline='') as f:
+            f.write(base)
+        _run(root)
+
+        with open(compustat, 'a', newline='') as f:
+            f.write(tail)
+        output = _run(root, '--incremental')
+        if '增量更新' not in output:
+            return False, "--incremental 没有走增量路径（全量重算了）"
+        store = os.path.join(root, 'data', 'sp500_3level_decomposition')
+        incremental_store = os.path.join(root, 'incremental_store')
+        os.replace(store, incremental_store)
+
+        shutil.rmtree(os.path.join(inputs, '.cache'))
+        _run(root)
+        diffs = _diff_dirs(incremental_store, store)
+        if diffs:
+            return False, f"与全量结果不同: {', '.join(diffs)}"
+        note = next(line.strip() for line in output.splitlines() if '增量更新' in line)
+        return True, f"追加 {tail.count(chr(10))} 行，{note}"
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查增量三层分解与全量重算逐字节一致")
+    parser.add_argument('--years', default=','.join(str(y) for y in DEFAULT_YEARS),
+                        help="逗号分隔的财年：每个财年的行移到文件末尾做一次追加")
+    parser.add_argument('--data', default=DATA_DIR, help="输入 CSV 所在目录")
+    parser.add_argument('--synthetic', type=float, default=None, metavar='SCALE', help="改用该规模的合成数据")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    data_dir, synthetic = args.data, None
+    if args.synthetic is not None:
+        from synthetic_data import generate
+        synthetic = tempfile.mkdtemp(prefix='check_incremental_data_')
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            generate(synthetic, args.synthetic, args.seed)
+        data_dir = synthetic
+
+    failed = 0
+    try:
+        for fy in [int(y) for y in args.years.split(',') if y]:
+            ok, message = check_year(fy, data_dir)
+            failed += not ok
+            print(f"  {'✓' if ok else '✗'} FY {fy}: {message}")
+    finally:
+        if synthetic:
+            shutil.rmtree(synthetic, ignore_errors=True)
+    if failed:
+        print(f"\n{failed} 个财年不一致")
+        sys.exit(1)
+    print("\n增量结果与全量一致")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Compustat 年度财务列式缓存
+
+compustat_annual.csv 只解析一次，数值字段存成 float64 列（缺失 = NaN），
+gvkey 字典编码成整数 id，gind 只保留 2 位 GICS sector（int16，缺失 = -1）。
+另外预先算好 (gvkey, 财年) → 行号 的排序键表，语义与各脚本的 build_compustat_lookup 一致：
+  - 财年 = datadate 年份（1-5 月结束的归入上一年）
+  - 同一 (gvkey, 财年) 有多行时取 datadate 最晚的，同日取文件中靠前的
+  - datadate 为空的行不参与
+任意 (gvkey id 数组, 财年) 的查询是一次 searchsorted，当年 / 上年记录都能按下标整列 gather。
+缓存以 compustat_annual.csv 的指纹为键放在 .cache/compustat_annual/。
+文件只在末尾追加了行时只解析新增行（append_compustat_cache），旧行的行号不变。
+"""
+import csv
+import io
+import os
+import time
+
+import numpy as np
+
+from data_cache import (DATA_DIR, appended_to, cache_dir_for, file_fingerprint, is_fresh, read_manifest,
+                        replace_dir, resident, write_manifest)
+import profiling
+
+COMPUSTAT_PATH = os.path.join(DATA_DIR, 'compustat_annual.csv')
+
+CACHE_NAME = 'compustat_annual'
+CACHE_VERSION = 2
+
+FLOAT_FIELDS = ('ni', 'csho', 'prcc_f', 'epspx', 'epsfx', 'dvpsx_f', 'revt', 'seq', 'at', 'bkvlps')
+KEY_STRIDE = 10000   # 查找键 = gvkey id * KEY_STRIDE + 财年
+
+
+def parse_float(val):
+    """与脚本里的 safe_float 相同：空串或无法解析为 NaN"""
+    try:
+        return float(val) if val and val.strip() else np.nan
+    except ValueError:
+        return np.nan
+
+
+def fiscal_year(datadate):
+    """YYYYMMDD（数组）→ 财年"""
+    datadate = np.asarray(datadate, dtype=np.int64)
+    year = datadate // 10000
+    return np.where(datadate // 100 % 100 >= 6, year, year - 1)
+
+
+def _datadate(value):
+    """'YYYY-MM-DD' → YYYYMMDD；空值或无法解析时为 0（缺失），不中断整个文件的解析"""
+    digits = value[:4] + value[5:7] + value[8:10]
+    return int(digits) if len(digits) == 8 and digits.isdigit() else 0
+
+
+def _parse_rows(rows, col, gvkeys, gvkey_index):
+    """csv.reader 行 → (gvkey_id, datadate, gsector, {字段: 值列表})；新出现的 gvkey 追加到 gvkeys / gvkey_index"""
+    gvkey_id, datadate, gsector = [], [], []
+    values = {f: [] for f in FLOAT_FIELDS}
+    fields = [(name, col[name]) for name in FLOAT_FIELDS if name in col]
+    i_gind = col.get('gind')
+    for row in rows:
+        gvkey = row[col['gvkey']]
+        if gvkey not in gvkey_index:
+            gvkey_index[gvkey] = len(gvkeys)
+            gvkeys.append(gvkey)
+        gvkey_id.append(gvkey_index[gvkey])
+        datadate.append(_datadate(row[col['datadate']]))
+        for name, i in fields:
+            values[name].append(parse_float(row[i]))
+        gind = row[i_gind].strip() if i_gind is not None else ''
+        gsector.append(int(gind[:2]) if len(gind) >= 2 and gind[:2].isdigit() else -1)
+    n = len(gvkey_id)
+    arrays = {f: np.array(v, dtype=np.float64) if v else np.full(n, np.nan) for f, v in values.items()}
+    return (np.array(gvkey_id, dtype=np.int32), np.array(datadate, dtype=np.int32),
+            np.array(gsector, dtype=np.int16), arrays)
+
+
+def _save_cache(csv_path, source, gvkeys, gvkey_id, datadate, gsector, arrays, appended_rows=None):
+    """列 + (gvkey, 财年) 查找表写到缓存目录（临时目录整体替换）"""
+    # (gvkey, 财年) 去重：datadate 最晚者胜出，同日取文件中靠前的
+    dated = np.flatnonzero(datadate > 0)
+    keys = gvkey_id[dated].astype(np.int64) * KEY_STRIDE + fiscal_year(datadate[dated])
+    order = np.lexsort((-dated, datadate[dated], keys))
+    keys, rows = keys[order], dated[order]
+    last = np.r_[keys[1:] != keys[:-1], True] if len(keys) else np.zeros(0, dtype=bool)
+
+    cache_dir = cache_dir_for(csv_path, CACHE_NAME)
+    tmp_dir = cache_dir + '.tmp'
+    os.makedirs(tmp_dir, exist_ok=True)
+    np.savez(os.path.join(tmp_dir, 'compustat.npz'),
+             gvkeys=np.array(gvkeys, dtype=str), gvkey_id=gvkey_id, datadate=datadate,
+             gsector=gsector, lookup_keys=keys[last], lookup_rows=rows[last].astype(np.int64),
+             **arrays)
+    manifest = {'version': CACHE_VERSION, 'source': source, 'rows': len(gvkey_id)}
+    if appended_rows is not None:
+        manifest['appended_rows'] = appended_rows
+    write_manifest(tmp_dir, manifest)
+    replace_dir(tmp_dir, cache_dir)
+    return cache_dir
+
+
+def build_compustat_cache(csv_path=COMPUSTAT_PATH):
+    t0 = time.time()
+    source = file_fingerprint(csv_path)
+    gvkeys, gvkey_index = [], {}
+    with open(csv_path, 'r') as f:
+        reader = csv.reader(f)
+        col = {name: i for i, name in enumerate(next(reader))}
+        gvkey_id, datadate, gsector, arrays = _parse_rows(reader, col, gvkeys, gvkey_index)
+    cache_dir = _save_cache(csv_path, source, gvkeys, gvkey_id, datadate, gsector, arrays)
+    print(f"  Compustat 列式缓存: {len(gvkey_id):,} 行, {time.time() - t0:.1f}s")
+    return cache_dir
+
+
+def append_compustat_cache(csv_path=COMPUSTAT_PATH):
+    """
+    compustat_annual.csv 只在末尾追加了整行（新财年 / 补录）时，只解析新增行，
+    与已缓存的列拼接后重算查找表 → 缓存目录；不是追加时返回 None。
+    新增行排在旧行之后，行号不变，manifest 的 appended_rows 记录新增行数。
+    """
+    cache_dir = cache_dir_for(csv_path, CACHE_NAME)
+    manifest = read_manifest(cache_dir)
+    if manifest is None or manifest.get('version') != CACHE_VERSION or not appended_to(manifest['source'], csv_path):
+        return None
+    t0 = time.time()
+    source = file_fingerprint(csv_path)
+    old = CompustatAnnual(cache_dir)
+    with open(csv_path, 'r') as f:
+        col = {name: i for i, name in enumerate(next(csv.reader(f)))}
+    with open(csv_path, 'rb') as f:
+        f.seek(manifest['source']['size'])
+        text = f.read(source['size'] - manifest['source']['size']).decode()
+    gvkeys = list(old.gvkeys)
+    gvkey_index = dict(old._gvkey_index)
+    gvkey_id, datadate, gsector, arrays = _parse_rows(csv.reader(io.StringIO(text)), col, gvkeys, gvkey_index)
+    added = len(gvkey_id)
+    cache_dir = _save_cache(
+        csv_path, source, gvkeys,
+        np.concatenate([old.gvkey_id, gvkey_id]), np.concatenate([old.datadate, datadate]),
+        np.concatenate([old.gsector, gsector]),
+        {f: np.concatenate([old.columns[f], arrays[f]]) for f in FLOAT_FIELDS}, appended_rows=added)
+    print(f"  Compustat 列式缓存追加: {added:,} 行（共 {len(old) + added:,} 行）, {time.time() - t0:.1f}s")
+    return cache_dir
+
+
+class CompustatAnnual:
+    def __init__(self, cache_dir):
+        with np.load(os.path.join(cache_dir, 'compustat.npz')) as z:
+            self.gvkeys = z['gvkeys'].tolist()
+            self.gvkey_id = z['gvkey_id']
+            self.datadate = z['datadate']
+            self.gsector = z['gsector']
+            self.lookup_keys = z['lookup_keys']
+            self.lookup_rows = z['lookup_rows']
+            self.columns = {f: z[f] for f in FLOAT_FIELDS}
+        self._gvkey_index = {g: i for i, g in enumerate(self.gvkeys)}
+
+    def __len__(self):
+        return len(self.gvkey_id)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def gvkey_ids(self, gvkeys):
+        """GVKEY 字符串 → id 数组（Compustat 中没有的为 -1）"""
+        return np.array([self._gvkey_index.get(g, -1) for g in gvkeys], dtype=np.int64)
+
+    def rows_for(self, gvkey_ids, fiscal_year):
+        """(gvkey id 数组, 财年 标量或数组) → 行号数组（无记录为 -1）"""
+        gvkey_ids = np.asarray(gvkey_ids, dtype=np.int64)
+        keys = gvkey_ids * KEY_STRIDE + np.asarray(fiscal_year, dtype=np.int64)
+        if len(self.lookup_keys) == 0:
+            return np.full(keys.shape, -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.lookup_keys, keys), len(self.lookup_keys) - 1)
+        found = (self.lookup_keys[pos] == keys) & (gvkey_ids >= 0)
+        return np.where(found, self.lookup_rows[pos], -1)
+
+
+@profiling.profiled("加载 Compustat")
+def load_compustat(csv_path=COMPUSTAT_PATH):
+    def load():
+        cache_dir = cache_dir_for(csv_path, CACHE_NAME)
+        if not is_fresh(cache_dir, csv_path, CACHE_VERSION) and append_compustat_cache(csv_path) is None:
+            build_compustat_cache(csv_path)
+        return CompustatAnnual(cache_dir)
+    return resident(CACHE_NAME, csv_path, load)
+
+
+if __name__ == "__main__":
+    build_compustat_cache()
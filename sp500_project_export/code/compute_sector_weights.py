@@ -2,19 +2,28 @@
 """
 Compute annual S&P 500 industry sector weights using CRSP monthly data.
 For each December, finds S&P 500 constituents, computes market cap weights by sector.
-Uses csv reader for memory efficiency (crsp_monthly.csv is ~369MB).
+Reads crsp_monthly.csv (~369MB) through the shared CRSP scanner (crsp_scan.py).
 """
 
-import csv
+import argparse
 import json
+import os
 import sys
 import time
 from collections import defaultdict
 
+import numpy as np
+
+from crsp_cache import MISSING_INT, MISSING_SIC
+from crsp_scan import CrspConsumer, CrspScanner
+import profiling
+from sp500_membership import load_membership
+
 # Paths
-CRSP_PATH = "/Users/bozhu/.openclaw/workspace-us-mean-reversion/sp500_project_export/data/crsp_compustat/crsp_monthly.csv"
-CONSTITUENTS_PATH = "/Users/bozhu/.openclaw/workspace-us-mean-reversion/sp500_project_export/data/crsp_compustat/sp500_constituents.csv"
-OUTPUT_PATH = "/Users/bozhu/.openclaw/workspace-us-mean-reversion/sp500_project_export/data/sp500_sector_weights.json"
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
+CRSP_PATH = os.path.join(DATA_DIR, "crsp_compustat", "crsp_monthly.csv")
+CONSTITUENTS_PATH = os.path.join(DATA_DIR, "crsp_compustat", "sp500_constituents.csv")
+OUTPUT_PATH = os.path.join(DATA_DIR, "sp500_sector_weights.json")
 
 
 def classify_sic(sic_code):
@@ -76,155 +85,98 @@ def classify_sic(sic_code):
     return "Other"
 
 
-def load_sp500_constituents():
-    """
-    Load S&P 500 membership as list of (permno, start_yyyymm, end_yyyymm).
-    We convert dates to YYYYMM integers for fast comparison.
-    """
-    members = []
-    with open(CONSTITUENTS_PATH, "r") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            permno = int(row["permno"])
-            # start date: YYYY-MM-DD -> YYYYMM
-            start_parts = row["start"].split("-")
-            start_ym = int(start_parts[0]) * 100 + int(start_parts[1])
-            # end date
-            end_str = row["ending"].strip()
-            if end_str == "" or end_str.lower() == "na":
-                end_ym = 209912  # still active, far future
-            else:
-                end_parts = end_str.split("-")
-                end_ym = int(end_parts[0]) * 100 + int(end_parts[1])
-            members.append((permno, start_ym, end_ym))
-    return members
-
-
-def build_membership_lookup(members):
-    """
-    Build a dict: permno -> list of (start_ym, end_ym) intervals.
-    """
-    lookup = defaultdict(list)
-    for permno, start_ym, end_ym in members:
-        lookup[permno].append((start_ym, end_ym))
-    return dict(lookup)
-
-
-def is_sp500_member(lookup, permno, yyyymm):
-    """Check if permno was in S&P 500 during given YYYYMM."""
-    intervals = lookup.get(permno)
-    if intervals is None:
-        return False
-    for start_ym, end_ym in intervals:
-        if start_ym <= yyyymm <= end_ym:
-            return True
-    return False
-
+def _float_dict():
+    return defaultdict(float)
 
-def main():
-    t0 = time.time()
 
-    # Step 1: Load S&P 500 constituents
-    print("Loading S&P 500 constituents...")
-    members = load_sp500_constituents()
-    membership = build_membership_lookup(members)
-    print(f"  Loaded {len(members)} membership records for {len(membership)} unique PERMNOs")
-
-    # Step 2: Scan CRSP monthly, filter December rows for S&P 500 members
-    # Accumulate: year -> sector -> total_mktcap
-    sector_mktcap = defaultdict(lambda: defaultdict(float))
-    # Also track counts for diagnostics
-    year_counts = defaultdict(int)
-
-    print("Scanning CRSP monthly data (December rows only)...")
-    row_count = 0
-    matched = 0
-    skipped_no_price = 0
-    skipped_no_sic = 0
-    skipped_not_sp500 = 0
-
-    with open(CRSP_PATH, "r") as f:
-        reader = csv.reader(f)
-        header = next(reader)
-        # Build column index map
-        col = {name: i for i, name in enumerate(header)}
-        idx_permno = col["PERMNO"]
-        idx_date = col["date"]
-        idx_siccd = col["SICCD"]
-        idx_prc = col["PRC"]
-        idx_shrout = col["SHROUT"]
-
-        for row in reader:
-            row_count += 1
-            if row_count % 1_000_000 == 0:
-                elapsed = time.time() - t0
-                print(f"  Processed {row_count:,} rows ({elapsed:.1f}s), {matched:,} matched so far")
-
-            # Quick filter: only December dates (date field is YYYY-MM-DD, check month part)
-            date_str = row[idx_date]
-            if len(date_str) < 7:
-                continue
-            # Month is characters 5-6 (0-indexed)
-            if date_str[5:7] != "12":
+class SectorMktcapConsumer(CrspConsumer):
+    """
+    CRSP scan consumer: December market cap of S&P 500 members, by year and sector.
+    map_chunk filters/classifies (runs in a worker in parallel mode); reduce adds
+    the matched market caps in file order, so serial and parallel sums are bit-identical.
+    """
+    name = "sector_mktcap"
+    columns = ("PERMNO", "date", "PRC", "SHROUT", "SICCD")
+    months = (12,)
+
+    def __init__(self, membership):
+        self.membership = membership  # sp500_membership.Membership bitmap
+        self.sector_mktcap = defaultdict(_float_dict)
+        self.year_counts = defaultdict(int)
+        self.row_count = 0
+        self.matched = 0
+        self.skipped_no_price = 0
+        self.skipped_no_sic = 0
+        self.skipped_not_sp500 = 0
+
+    def map_chunk(self, chunk):
+        partial = {"rows": len(chunk["date"]), "not_sp500": 0, "no_price": 0, "no_sic": 0, "hits": []}
+
+        # Quick filter: only December rows with a valid PERMNO
+        dec_idx = np.nonzero((chunk["date"] % 100 == 12) & (chunk["PERMNO"] != MISSING_INT))[0]
+        # S&P 500 membership for the whole chunk in one bitmap gather
+        member = self.membership.mask(chunk["PERMNO"][dec_idx], chunk["date"][dec_idx])
+        partial["not_sp500"] = int(len(dec_idx) - member.sum())
+        dec_idx = dec_idx[member]
+        dec_year = (chunk["date"][dec_idx] // 100).tolist()
+        dec_prc = np.abs(chunk["PRC"][dec_idx]).tolist()
+        dec_shrout = chunk["SHROUT"][dec_idx].tolist()
+        dec_sic = chunk["SICCD"][dec_idx].tolist()
+
+        for year, prc, shrout, sic_code in zip(dec_year, dec_prc, dec_shrout, dec_sic):
+            # PRC and SHROUT (NaN = missing)
+            if not (prc > 0 and shrout > 0):
+                partial["no_price"] += 1
                 continue
 
-            # Parse year
-            year = int(date_str[:4])
-
-            # Parse PERMNO
-            try:
-                permno = int(row[idx_permno])
-            except (ValueError, IndexError):
+            if sic_code == MISSING_SIC:
+                partial["no_sic"] += 1
                 continue
 
-            # Check S&P 500 membership
-            yyyymm = year * 100 + 12
-            if not is_sp500_member(membership, permno, yyyymm):
-                skipped_not_sp500 += 1
-                continue
+            # Market cap (in thousands of dollars), classified by sector
+            partial["hits"].append((year, classify_sic(sic_code), prc * shrout))
+        return partial
 
-            # Parse PRC and SHROUT
-            prc_str = row[idx_prc].strip()
-            shrout_str = row[idx_shrout].strip()
-            if prc_str == "" or shrout_str == "":
-                skipped_no_price += 1
-                continue
+    def reduce(self, partial):
+        self.row_count += partial["rows"]
+        self.skipped_not_sp500 += partial["not_sp500"]
+        self.skipped_no_price += partial["no_price"]
+        self.skipped_no_sic += partial["no_sic"]
+        for year, sector, mktcap in partial["hits"]:
+            self.sector_mktcap[year][sector] += mktcap
+            self.year_counts[year] += 1
+            self.matched += 1
 
-            try:
-                prc = abs(float(prc_str))
-                shrout = float(shrout_str)
-            except ValueError:
-                skipped_no_price += 1
-                continue
+    def finish(self):
+        return self
 
-            if prc <= 0 or shrout <= 0:
-                skipped_no_price += 1
-                continue
 
-            # Parse SIC code
-            sic_str = row[idx_siccd].strip()
-            if sic_str == "":
-                skipped_no_sic += 1
-                continue
-            try:
-                sic_code = int(sic_str)
-            except ValueError:
-                skipped_no_sic += 1
-                continue
+def main(scan_result=None, workers=1):
+    """
+    scan_result: a finished SectorMktcapConsumer from a shared CRSP scan (crsp_scan.refresh_all).
+    workers: >1 parses the CSV in a process pool when the columnar cache has to be rebuilt.
+    """
+    t0 = time.time()
 
-            # Compute market cap (in thousands of dollars)
-            mktcap = prc * shrout
+    if scan_result is None:
+        # Step 1: Load S&P 500 constituents
+        print("Loading S&P 500 constituents...")
+        membership = load_membership(CONSTITUENTS_PATH)
+        print(f"  Loaded membership bitmap for {len(membership)} unique PERMNOs")
 
-            # Classify sector
-            sector = classify_sic(sic_code)
+        # Step 2: Scan CRSP monthly, filter December rows for S&P 500 members
+        scanner = CrspScanner(CRSP_PATH, workers=workers)
+        scanner.register(SectorMktcapConsumer(membership))
+        scan_result = scanner.scan()[SectorMktcapConsumer.name]
 
-            sector_mktcap[year][sector] += mktcap
-            year_counts[year] += 1
-            matched += 1
+    # Accumulated: year -> sector -> total_mktcap, plus counts for diagnostics
+    sector_mktcap = scan_result.sector_mktcap
+    year_counts = scan_result.year_counts
 
     elapsed = time.time() - t0
-    print(f"  Done scanning. {row_count:,} total rows, {matched:,} matched.")
-    print(f"  Skipped: {skipped_not_sp500:,} not S&P 500, {skipped_no_price:,} no price/shares, {skipped_no_sic:,} no SIC")
+    print(f"  Done scanning. {scan_result.row_count:,} rows scanned, {scan_result.matched:,} matched.")
+    print(f"  Skipped: {scan_result.skipped_not_sp500:,} not S&P 500, {scan_result.skipped_no_price:,} no price/shares, "
+          f"{scan_result.skipped_no_sic:,} no SIC")
     print(f"  Time: {elapsed:.1f}s")
 
     # Step 3: Compute percentage weights
@@ -252,4 +204,9 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="S&P 500 sector weights from CRSP monthly")
+    parser.add_argument("--workers", type=int, default=1, help="processes for parallel CSV ingest")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.configure(args)
+    main(workers=args.workers)
@@ -0,0 +1,301 @@
+"""
+crsp_monthly.csv 列式二进制缓存
+
+第一次使用时把 ~369MB / 515万行的 CSV 解析一遍，每列写成一个定长二进制文件：
+  PERMNO  int32
+  date    int32    打包成 YYYYMM
+  PRC / RET / SHROUT / DLRET  float64，缺失（含 'C'/'B' 等代码）为 NaN
+  SICCD   int16    缺失为 -1
+之后各脚本用 np.memmap 只打开需要的列，毫秒级加载。
+缓存以源文件 size/mtime/hash 为键，数据更新后自动重建；
+源文件只在末尾追加了新行（新月份）时只解析追加部分，接到列文件末尾（append_cache）。
+"""
+import csv
+import io
+import os
+import shutil
+import time
+
+import numpy as np
+
+from data_cache import (DATA_DIR, HashingReader, appended_to, cache_dir_for, file_fingerprint, is_fresh,
+                        read_manifest, replace_dir, source_hasher, write_manifest)
+
+CRSP_PATH = os.path.join(DATA_DIR, 'crsp_monthly.csv')
+
+CACHE_NAME = 'crsp_monthly'
+CACHE_VERSION = 1
+
+COLUMNS = {
+    'PERMNO': np.int32,
+    'date': np.int32,
+    'PRC': np.float64,
+    'RET': np.float64,
+    'SHROUT': np.float64,
+    'DLRET': np.float64,
+    'SICCD': np.int16,
+}
+
+MISSING_INT = 0     # PERMNO / date 缺失
+MISSING_SIC = -1
+
+CHUNK_ROWS = 500_000
+
+
+# ── 解析 ──────────────────────────────────────────────────
+
+def parse_yyyymm(s):
+    """'YYYY-MM-DD' 或 'YYYYMMDD' → YYYYMM；无法解析返回 0"""
+    try:
+        if '-' in s:
+            return int(s[:4]) * 100 + int(s[5:7])
+        return int(s[:6]) if len(s) >= 6 else MISSING_INT
+    except ValueError:
+        return MISSING_INT
+
+
+def _to_float(s):
+    try:
+        return float(s)
+    except ValueError:
+        return np.nan
+
+
+def _to_int(s, missing):
+    try:
+        return int(s)
+    except ValueError:
+        return missing
+
+
+def parse_rows(rows, col_index):
+    """把一批 csv.reader 行解析成 {列名: ndarray}"""
+    out = {}
+    for name, dtype in COLUMNS.items():
+        i = col_index[name]
+        values = [r[i].strip() if i < len(r) else '' for r in rows]
+        if name == 'date':
+            parsed = [parse_yyyymm(v) for v in values]
+        elif name == 'PERMNO':
+            parsed = [_to_int(v, MISSING_INT) for v in values]
+        elif name == 'SICCD':
+            parsed = [_to_int(v, MISSING_SIC) for v in values]
+        else:
+            parsed = [_to_float(v) for v in values]
+        out[name] = np.array(parsed, dtype=dtype)
+    return out
+
+
+def header_index(header):
+    col = {name: i for i, name in enumerate(header)}
+    missing = [name for name in COLUMNS if name not in col]
+    if missing:
+        raise ValueError(f"crsp_monthly.csv 缺少列: {missing}")
+    return {name: col[name] for name in COLUMNS}
+
+
+def iter_csv_chunks(csv_path=CRSP_PATH, chunk_rows=CHUNK_ROWS, hasher=None):
+    """顺序读取 CSV，每次产出一个已解析的列块；给了 hasher 时读到的字节同时喂给它"""
+    with open(csv_path, 'rb') as raw:
+        f = io.TextIOWrapper(io.BufferedReader(HashingReader(raw, hasher)) if hasher else raw, newline='')
+        reader = csv.reader(f)
+        col_index = header_index(next(reader))
+        batch = []
+        for row in reader:
+            batch.append(row)
+            if len(batch) >= chunk_rows:
+                yield parse_rows(batch, col_index)
+                batch = []
+        if batch:
+            yield parse_rows(batch, col_index)
+
+
+def split_byte_ranges(csv_path, n_ranges):
+    """
+    把数据区（表头之后）切成 n_ranges 段按行对齐的字节区间 [(start, end), ...]
+    每段起点都在行首，可独立解析（CRSP 导出的字段不含换行）
+    """
+    with open(csv_path, 'rb') as f:
+        f.readline()
+        data_start = f.tell()
+        size = os.fstat(f.fileno()).st_size
+        bounds = [data_start]
+        step = max(1, (size - data_start) // max(1, n_ranges))
+        for k in range(1, n_ranges):
+            target = data_start + k * step
+            if target <= bounds[-1]:
+                continue
+            f.seek(target - 1)
+            f.readline()  # 跳到下一个行首
+            pos = f.tell()
+            if bounds[-1] < pos < size:
+                bounds.append(pos)
+        bounds.append(size)
+    return [(a, b) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+def read_header_index(csv_path):
+    with open(csv_path, 'r', newline='') as f:
+        return header_index(next(csv.reader(f)))
+
+
+def iter_range_chunks(csv_path, start, end, col_index, chunk_rows=CHUNK_ROWS):
+    """解析字节区间 [start, end) 内的行（不含表头），按块产出"""
+    with open(csv_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return iter_bytes_chunks(data, col_index, chunk_rows)
+
+
+def iter_bytes_chunks(data, col_index, chunk_rows=CHUNK_ROWS):
+    """解析一段按行对齐的原始字节（不含表头），按块产出"""
+    reader = csv.reader(io.StringIO(data.decode(), newline=''))
+    batch = []
+    for row in reader:
+        batch.append(row)
+        if len(batch) >= chunk_rows:
+            yield parse_rows(batch, col_index)
+            batch = []
+    if batch:
+        yield parse_rows(batch, col_index)
+
+
+# ── 缓存读写 ──────────────────────────────────────────────
+
+def _column_file(cache_dir, name):
+    return os.path.join(cache_dir, f"{name}.bin")
+
+
+class CacheWriter:
+    """
+    逐块追加写列文件，commit() 时写 manifest 并替换旧缓存。
+    源文件的 hash 不单独读文件计算：调用方把读到的原始字节喂给 self.hasher
+    （iter_csv_chunks(hasher=...) 或 feed()），size / mtime 在开始读之前取。
+    """
+
+    def __init__(self, csv_path=CRSP_PATH):
+        self.cache_dir = cache_dir_for(csv_path, CACHE_NAME)
+        self.tmp_dir = self.cache_dir + '.tmp'
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        st = os.stat(csv_path)
+        self.source = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+        self.hasher = source_hasher()
+        self.files = {name: open(_column_file(self.tmp_dir, name), 'wb') for name in COLUMNS}
+        self.rows = 0
+
+    def feed(self, data):
+        """按文件顺序喂入源文件的原始字节"""
+        self.hasher.update(data)
+
+    def write(self, chunk):
+        for name in COLUMNS:
+            np.asarray(chunk[name], dtype=COLUMNS[name]).tofile(self.files[name])
+        self.rows += len(chunk['PERMNO'])
+
+    def append_part(self, part_prefix, rows):
+        """追加一个并行 worker 写好的列分片（<prefix>.<列名>.bin），随后删除分片"""
+        for name in COLUMNS:
+            part = f"{part_prefix}.{name}.bin"
+            with open(part, 'rb') as src:
+                shutil.copyfileobj(src, self.files[name])
+            os.remove(part)
+        self.rows += rows
+
+    def _close(self):
+        for fh in self.files.values():
+            fh.close()
+
+    def commit(self):
+        self._close()
+        write_manifest(self.tmp_dir, {
+            'version': CACHE_VERSION,
+            'source': dict(self.source, hash=self.hasher.hexdigest()),
+            'rows': self.rows,
+            'columns': {name: np.dtype(dtype).str for name, dtype in COLUMNS.items()},
+        })
+        replace_dir(self.tmp_dir, self.cache_dir)
+        return self.cache_dir
+
+    def abort(self):
+        self._close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+def build_cache(csv_path=CRSP_PATH):
+    """解析整个 CSV，写出列文件和 manifest"""
+    t0 = time.time()
+    writer = CacheWriter(csv_path)
+    print(f"构建 CRSP 列式缓存: {writer.cache_dir}")
+    try:
+        for chunk in iter_csv_chunks(csv_path, hasher=writer.hasher):
+            writer.write(chunk)
+            print(f"  已解析 {writer.rows:,} 行 ({time.time() - t0:.1f}s)")
+    except BaseException:
+        writer.abort()
+        raise
+    writer.commit()
+    print(f"  完成: {writer.rows:,} 行, {time.time() - t0:.1f}s")
+    return writer.cache_dir
+
+
+def append_cache(csv_path=CRSP_PATH):
+    """
+    源文件相对缓存只在末尾追加了整行时，只解析新增的字节区间并接到各列文件末尾 → 缓存目录；
+    不是追加（或缓存不存在）时返回 None，由调用方整体重建。
+    manifest 最后写：中途中断时 rows 仍是旧值，读者只看到旧行，下次追加前先截掉半截数据。
+    """
+    cache_dir = cache_dir_for(csv_path, CACHE_NAME)
+    manifest = read_manifest(cache_dir)
+    if manifest is None or manifest.get('version') != CACHE_VERSION or not appended_to(manifest['source'], csv_path):
+        return None
+    t0 = time.time()
+    source = file_fingerprint(csv_path)
+    rows = manifest['rows']
+    for name, dtype in COLUMNS.items():
+        os.truncate(_column_file(cache_dir, name), rows * np.dtype(dtype).itemsize)
+
+    added = 0
+    files = {name: open(_column_file(cache_dir, name), 'ab') for name in COLUMNS}
+    try:
+        for chunk in iter_range_chunks(csv_path, manifest['source']['size'], source['size'],
+                                       read_header_index(csv_path)):
+            for name in COLUMNS:
+                np.asarray(chunk[name], dtype=COLUMNS[name]).tofile(files[name])
+            added += len(chunk['PERMNO'])
+    finally:
+        for fh in files.values():
+            fh.close()
+
+    manifest.update({'source': source, 'rows': rows + added, 'appended_rows': added})
+    write_manifest(cache_dir, manifest)
+    print(f"CRSP 列式缓存追加: {added:,} 行（共 {rows + added:,} 行）, {time.time() - t0:.1f}s")
+    return cache_dir
+
+
+def ensure_cache(csv_path=CRSP_PATH):
+    cache_dir = cache_dir_for(csv_path, CACHE_NAME)
+    if not is_fresh(cache_dir, csv_path, CACHE_VERSION) and append_cache(csv_path) is None:
+        build_cache(csv_path)
+    return cache_dir
+
+
+def load_crsp_columns(columns=None, csv_path=CRSP_PATH):
+    """
+    返回 {列名: 只读 np.memmap}，只打开请求的列。
+    缓存不存在或源文件已变化时先重建。
+    """
+    cache_dir = ensure_cache(csv_path)
+    manifest = read_manifest(cache_dir)
+    rows = manifest['rows']
+    out = {}
+    for name in (columns or COLUMNS):
+        dtype = np.dtype(manifest['columns'][name])
+        if rows == 0:
+            out[name] = np.empty(0, dtype=dtype)
+        else:
+            out[name] = np.memmap(_column_file(cache_dir, name), dtype=dtype, mode='r', shape=(rows,))
+    return out
+
+
+if __name__ == "__main__":
+    build_cache()
@@ -0,0 +1,101 @@
+"""
+CRSP 面板存储：按 (PERMNO, date) 排序的内存映射列 + PERMNO 偏移索引
+
+由 crsp_cache 的列式缓存派生（稳定排序，同一 PERMNO/月份保留原文件顺序），
+写到 .cache/crsp_panel/。每个 PERMNO 的全部历史是连续的一段行，
+panel.history(permno) 以 O(1) 查表得到行区间，返回 memmap 切片（零拷贝），
+哪些页留在内存由操作系统的页缓存决定。
+"""
+import os
+import time
+
+import numpy as np
+
+from crsp_cache import COLUMNS, CRSP_PATH, load_crsp_columns
+from data_cache import (cache_dir_for, file_fingerprint, is_fresh, read_manifest,
+                        replace_dir, resident, write_manifest)
+import profiling
+
+CACHE_NAME = 'crsp_panel'
+CACHE_VERSION = 1
+
+
+def _column_file(cache_dir, name):
+    return os.path.join(cache_dir, f"{name}.bin")
+
+
+def build_panel(csv_path=CRSP_PATH):
+    t0 = time.time()
+    cols = load_crsp_columns(csv_path=csv_path)
+    cache_dir = cache_dir_for(csv_path, CACHE_NAME)
+    tmp_dir = cache_dir + '.tmp'
+    os.makedirs(tmp_dir, exist_ok=True)
+    print(f"构建 CRSP 面板存储: {cache_dir}")
+
+    order = np.lexsort((cols['date'], cols['PERMNO']))
+    for name in COLUMNS:
+        np.ascontiguousarray(cols[name][order]).tofile(_column_file(tmp_dir, name))
+
+    permno_sorted = cols['PERMNO'][order]
+    permnos, starts = np.unique(permno_sorted, return_index=True)
+    offsets = np.append(starts, len(permno_sorted)).astype(np.int64)
+    permnos.astype(np.int32).tofile(os.path.join(tmp_dir, 'permnos.bin'))
+    offsets.tofile(os.path.join(tmp_dir, 'offsets.bin'))
+
+    write_manifest(tmp_dir, {
+        'version': CACHE_VERSION,
+        'source': file_fingerprint(csv_path),
+        'rows': int(len(order)),
+        'permnos': int(len(permnos)),
+        'columns': {name: np.dtype(dtype).str for name, dtype in COLUMNS.items()},
+    })
+    replace_dir(tmp_dir, cache_dir)
+    print(f"  完成: {len(order):,} 行, {len(permnos):,} 个 PERMNO, {time.time() - t0:.1f}s")
+    return cache_dir
+
+
+class CrspPanel:
+    """按 PERMNO 连续存放的 CRSP 月度面板（只读 memmap）"""
+
+    def __init__(self, cache_dir):
+        manifest = read_manifest(cache_dir)
+        self.rows = manifest['rows']
+        self.columns = {}
+        for name, dtype in manifest['columns'].items():
+            if self.rows == 0:
+                self.columns[name] = np.empty(0, dtype=np.dtype(dtype))
+            else:
+                self.columns[name] = np.memmap(_column_file(cache_dir, name), dtype=np.dtype(dtype),
+                                               mode='r', shape=(self.rows,))
+        self.permnos = np.fromfile(os.path.join(cache_dir, 'permnos.bin'), dtype=np.int32)
+        self.offsets = np.fromfile(os.path.join(cache_dir, 'offsets.bin'), dtype=np.int64)
+        self._pos = dict(zip(self.permnos.tolist(), range(len(self.permnos))))
+
+    def __contains__(self, permno):
+        return int(permno) in self._pos
+
+    def row_range(self, permno):
+        """PERMNO → (start, end) 行区间；不存在时为空区间"""
+        i = self._pos.get(int(permno))
+        if i is None:
+            return 0, 0
+        return int(self.offsets[i]), int(self.offsets[i + 1])
+
+    def history(self, permno, columns=None):
+        """一家公司的完整月度历史，{列名: memmap 切片}，按日期升序"""
+        start, end = self.row_range(permno)
+        return {name: self.columns[name][start:end] for name in (columns or self.columns)}
+
+
+@profiling.profiled("加载 CRSP 面板")
+def load_panel(csv_path=CRSP_PATH):
+    def load():
+        cache_dir = cache_dir_for(csv_path, CACHE_NAME)
+        if not is_fresh(cache_dir, csv_path, CACHE_VERSION):
+            build_panel(csv_path)
+        return CrspPanel(cache_dir)
+    return resident(CACHE_NAME, csv_path, load)
+
+
+if __name__ == "__main__":
+    build_panel()
@@ -0,0 +1,108 @@
+"""
+CRSP 按月分区存储 + 谓词下推
+
+由列式缓存派生，按 (月份, 日期) 稳定排序写到 .cache/crsp_by_month/，
+month_offsets 记录每个日历月的行区间。同一 (月份, 年份) 内保持原文件顺序，
+所以只看 12 月的分析（compute_sector_weights、compare_mktcap）累加顺序不变、结果逐位相同，
+但只需读 1/12 的数据。
+
+查询示例（12 月、1985-2024、指定 PERMNO）：
+    load_month(12, years=(1985, 2024), permnos=sp500_permnos, columns=['PERMNO', 'PRC', 'SHROUT'])
+月份和年份范围只切 memmap（零拷贝），permnos 过滤只作用在切出来的行上。
+"""
+import os
+import time
+
+import numpy as np
+
+from crsp_cache import COLUMNS, CRSP_PATH, load_crsp_columns
+from data_cache import (cache_dir_for, file_fingerprint, is_fresh, read_manifest,
+                        replace_dir, write_manifest)
+
+CACHE_NAME = 'crsp_by_month'
+CACHE_VERSION = 1
+
+
+def _column_file(cache_dir, name):
+    return os.path.join(cache_dir, f"{name}.bin")
+
+
+def build_partitions(csv_path=CRSP_PATH):
+    t0 = time.time()
+    cols = load_crsp_columns(csv_path=csv_path)
+    cache_dir = cache_dir_for(csv_path, CACHE_NAME)
+    tmp_dir = cache_dir + '.tmp'
+    os.makedirs(tmp_dir, exist_ok=True)
+    print(f"构建 CRSP 按月分区: {cache_dir}")
+
+    dates = np.asarray(cols['date'])
+    months = dates % 100
+    order = np.lexsort((dates, months))  # 稳定：同一月份同一日期保持文件顺序
+    for name in COLUMNS:
+        np.ascontiguousarray(cols[name][order]).tofile(_column_file(tmp_dir, name))
+    # month_offsets[m] .. month_offsets[m + 1] 是 m 月的行（m = 0 为缺失日期）
+    month_offsets = np.searchsorted(months[order], np.arange(14)).astype(np.int64)
+    month_offsets.tofile(os.path.join(tmp_dir, 'month_offsets.bin'))
+
+    write_manifest(tmp_dir, {
+        'version': CACHE_VERSION,
+        'source': file_fingerprint(csv_path),
+        'rows': int(len(order)),
+        'columns': {name: np.dtype(dtype).str for name, dtype in COLUMNS.items()},
+    })
+    replace_dir(tmp_dir, cache_dir)
+    print(f"  完成: {len(order):,} 行, {time.time() - t0:.1f}s")
+    return cache_dir
+
+
+class MonthPartitions:
+    def __init__(self, cache_dir):
+        manifest = read_manifest(cache_dir)
+        self.rows = manifest['rows']
+        self.dtypes = {name: np.dtype(dtype) for name, dtype in manifest['columns'].items()}
+        self.cache_dir = cache_dir
+        self.month_offsets = np.fromfile(os.path.join(cache_dir, 'month_offsets.bin'), dtype=np.int64)
+        self._columns = {}
+
+    def column(self, name):
+        if name not in self._columns:
+            if self.rows == 0:
+                self._columns[name] = np.empty(0, dtype=self.dtypes[name])
+            else:
+                self._columns[name] = np.memmap(_column_file(self.cache_dir, name), dtype=self.dtypes[name],
+                                                mode='r', shape=(self.rows,))
+        return self._columns[name]
+
+    def row_range(self, month, years=None):
+        """month（1-12）在 years=(first, last) 范围内的行区间"""
+        start, end = int(self.month_offsets[month]), int(self.month_offsets[month + 1])
+        if years is not None:
+            dates = self.column('date')[start:end]
+            lo = np.searchsorted(dates, years[0] * 100 + month, side='left')
+            hi = np.searchsorted(dates, years[1] * 100 + month, side='right')
+            start, end = start + int(lo), start + int(hi)
+        return start, end
+
+    def select(self, month, years=None, permnos=None, columns=None):
+        """{列名: ndarray}；不带 permnos 时是 memmap 切片（零拷贝）"""
+        start, end = self.row_range(month, years)
+        out = {name: self.column(name)[start:end] for name in (columns or COLUMNS)}
+        if permnos is not None:
+            keep = np.isin(self.column('PERMNO')[start:end], np.asarray(sorted(permnos), dtype=np.int32))
+            out = {name: arr[keep] for name, arr in out.items()}
+        return out
+
+
+def load_partitions(csv_path=CRSP_PATH):
+    cache_dir = cache_dir_for(csv_path, CACHE_NAME)
+    if not is_fresh(cache_dir, csv_path, CACHE_VERSION):
+        build_partitions(csv_path)
+    return MonthPartitions(cache_dir)
+
+
+def load_month(month, years=None, permnos=None, columns=None, csv_path=CRSP_PATH):
+    return load_partitions(csv_path).select(month, years, permnos, columns)
+
+
+if __name__ == "__main__":
+    build_partitions()
@@ -0,0 +1,256 @@
+"""
+CRSP 单遍多消费者扫描引擎
+
+多个分析（行业 12 月市值、月度回报、12 月市值对比）注册为消费者，
+一次顺序扫描 crsp_monthly 同时喂给所有消费者：
+  - 列式缓存有效时直接按块切 memmap；
+  - 缓存过期时读一遍 CSV，同一遍里顺带重建缓存。
+消费者可以实现向量化的 on_chunk(chunk)，也可以只实现逐行的 on_row(row)。
+
+谓词下推：消费者声明 months=(12,) 之类时，若所有消费者都只要部分月份且缓存有效，
+只读 crsp_partitions 里对应月份的分区（同一月同一年内仍是文件顺序）。
+
+并行模式（workers > 1，只用于读 CSV）：
+  把文件切成按行对齐的字节区间，在 ProcessPoolExecutor 里解析；
+  消费者的 map_chunk 在 worker 里把块变成部分结果，父进程按文件顺序 reduce，
+  所以合并顺序与串行完全一致，结果逐位相同。
+  扫描结束后 MonthlyReturnsConsumer 的逐公司汇总也按 workers 走共享内存进程池（shared_arrays）。
+
+夜间全量刷新：python code/crsp_scan.py [--workers N]
+"""
+import argparse
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from crsp_cache import (CACHE_NAME, CACHE_VERSION, CHUNK_ROWS, COLUMNS, CRSP_PATH, CacheWriter,
+                        append_cache, iter_bytes_chunks, iter_csv_chunks, load_crsp_columns, read_header_index,
+                        split_byte_ranges)
+from crsp_partitions import load_partitions
+from data_cache import cache_dir_for, is_fresh
+import profiling
+
+
+class CrspConsumer:
+    """
+    扫描消费者基类
+    columns: 需要的列；on_chunk 收到 {列名: ndarray}，按文件顺序逐块调用
+    默认 on_chunk 把块拆成行元组（按 columns 顺序）交给 on_row
+
+    每块实际走 reduce(map_chunk(chunk))：
+      map_chunk  纯函数，并行模式下在 worker 进程里执行（消费者需可 pickle）
+      reduce     在父进程按文件顺序执行，负责累加
+    默认 map_chunk 原样返回块、reduce 转给 on_chunk；
+    CPU 重的消费者应把过滤/解析放进 map_chunk，只把紧凑的部分结果交给 reduce
+    """
+    name = None
+    columns = tuple(COLUMNS)
+    months = None   # 只需要的日历月份，如 (12,)；None = 全部
+
+    def map_chunk(self, chunk):
+        return {c: chunk[c] for c in self.columns}
+
+    def reduce(self, partial):
+        self.on_chunk(partial)
+
+    def on_chunk(self, chunk):
+        for row in zip(*(chunk[c].tolist() for c in self.columns)):
+            self.on_row(row)
+
+    def on_row(self, row):
+        raise NotImplementedError
+
+    def finish(self):
+        return None
+
+
+class RowCallback(CrspConsumer):
+    """把一个普通函数包装成逐行消费者"""
+
+    def __init__(self, name, fn, columns=tuple(COLUMNS)):
+        self.name = name
+        self.fn = fn
+        self.columns = tuple(columns)
+
+    def on_row(self, row):
+        self.fn(row)
+
+
+def _scan_range(data, col_index, chunk_rows, consumers, part_prefix):
+    """worker：解析一个字节区间的原始字节，写列分片，返回 (行数, [[每个消费者的部分结果] 按块])"""
+    rows = 0
+    partials = []
+    files = {name: open(f"{part_prefix}.{name}.bin", 'wb') for name in COLUMNS}
+    try:
+        for chunk in iter_bytes_chunks(data, col_index, chunk_rows):
+            for name in COLUMNS:
+                chunk[name].tofile(files[name])
+            rows += len(chunk['PERMNO'])
+            partials.append([c.map_chunk(chunk) for c in consumers])
+    finally:
+        for fh in files.values():
+            fh.close()
+    return rows, partials
+
+
+class CrspScanner:
+    def __init__(self, csv_path=CRSP_PATH, chunk_rows=CHUNK_ROWS, workers=1):
+        self.csv_path = csv_path
+        self.chunk_rows = chunk_rows
+        self.workers = workers
+        self.consumers = []
+
+    def register(self, consumer):
+        if consumer.name is None:
+            consumer.name = type(consumer).__name__
+        self.consumers.append(consumer)
+        return consumer
+
+    def _columns(self):
+        needed = set()
+        for c in self.consumers:
+            needed.update(c.columns)
+        return [name for name in COLUMNS if name in needed]
+
+    def _cache_chunks(self):
+        cols = load_crsp_columns(self._columns(), csv_path=self.csv_path)
+        rows = len(next(iter(cols.values()))) if cols else 0
+        for start in range(0, rows, self.chunk_rows):
+            yield {name: arr[start:start + self.chunk_rows] for name, arr in cols.items()}
+
+    def _pushdown_months(self):
+        """所有消费者都声明了 months 时返回它们的并集，否则 None（需要全表）"""
+        months = set()
+        for c in self.consumers:
+            if c.months is None:
+                return None
+            months.update(c.months)
+        return sorted(months)
+
+    def _partition_chunks(self, months):
+        parts = load_partitions(self.csv_path)
+        columns = self._columns()
+        for month in months:
+            start, end = parts.row_range(month)
+            for s in range(start, end, self.chunk_rows):
+                e = min(end, s + self.chunk_rows)
+                yield {name: parts.column(name)[s:e] for name in columns}
+
+    def _csv_chunks(self):
+        """读 CSV 的同时重建列式缓存，保证整个刷新只读一遍源文件"""
+        writer = CacheWriter(self.csv_path)
+        try:
+            for chunk in iter_csv_chunks(self.csv_path, self.chunk_rows, hasher=writer.hasher):
+                writer.write(chunk)
+                yield chunk
+        except BaseException:
+            writer.abort()
+            raise
+        writer.commit()
+
+    def _scan_serial(self, chunks):
+        rows = 0
+        for chunk in chunks:
+            for consumer in self.consumers:
+                consumer.reduce(consumer.map_chunk(chunk))
+            rows += len(chunk['PERMNO'])
+        return rows
+
+    def _scan_csv_parallel(self, t0):
+        """
+        多进程解析 CSV；按区间顺序合并部分结果和缓存分片。
+        父进程按顺序读各区间的字节（顺带算源文件 hash）交给 worker，文件只读一遍；
+        最多 2 × workers 个区间在途，内存不随文件大小增长。
+        """
+        col_index = read_header_index(self.csv_path)
+        ranges = split_byte_ranges(self.csv_path, self.workers * 4)
+        writer = CacheWriter(self.csv_path)
+        rows = 0
+        pending = deque()
+
+        def merge_next():
+            nonlocal rows
+            i, part_prefix, future = pending.popleft()
+            n, partials = future.result()
+            for chunk_partials in partials:
+                for consumer, partial in zip(self.consumers, chunk_partials):
+                    consumer.reduce(partial)
+            writer.append_part(part_prefix, n)
+            rows += n
+            print(f"  区间 {i + 1}/{len(ranges)} 合并完成, 累计 {rows:,} 行 ({time.time() - t0:.1f}s)")
+
+        try:
+            with open(self.csv_path, 'rb') as f, ProcessPoolExecutor(max_workers=self.workers) as pool:
+                writer.feed(f.readline())   # 表头
+                for i, (start, end) in enumerate(ranges):
+                    data = f.read(end - start)
+                    writer.feed(data)
+                    part_prefix = os.path.join(writer.tmp_dir, f"part{i:05d}")
+                    pending.append((i, part_prefix, pool.submit(
+                        _scan_range, data, col_index, self.chunk_rows, self.consumers, part_prefix)))
+                    if len(pending) >= 2 * self.workers:
+                        merge_next()
+                while pending:
+                    merge_next()
+        except BaseException:
+            writer.abort()
+            raise
+        writer.commit()
+        return rows
+
+    @profiling.profiled("CRSP 扫描")
+    def scan(self):
+        """扫描一遍，返回 {消费者名: finish() 结果}"""
+        t0 = time.time()
+        cache_dir = cache_dir_for(self.csv_path, CACHE_NAME)
+        # 源文件只追加了新月份时先把新增行接到缓存上，仍按缓存扫描
+        from_cache = is_fresh(cache_dir, self.csv_path, CACHE_VERSION) or append_cache(self.csv_path) is not None
+        names = ', '.join(c.name for c in self.consumers)
+        mode = '列式缓存' if from_cache else ('CSV' if self.workers <= 1 else f'CSV, {self.workers} 进程')
+        print(f"扫描 CRSP ({mode}) → {names}")
+
+        months = self._pushdown_months()
+        if from_cache and months is not None:
+            print(f"  谓词下推: 只读 {months} 月分区")
+            rows = self._scan_serial(self._partition_chunks(months))
+        elif from_cache:
+            rows = self._scan_serial(self._cache_chunks())
+        elif self.workers <= 1:
+            rows = self._scan_serial(self._csv_chunks())
+        else:
+            rows = self._scan_csv_parallel(t0)
+        print(f"  扫描完成: {rows:,} 行, {time.time() - t0:.1f}s")
+        return {c.name: c.finish() for c in self.consumers}
+
+
+def refresh_all(csv_path=CRSP_PATH, workers=1):
+    """夜间全量刷新：一次扫描同时完成三个 CRSP 分析"""
+    import compare_mktcap
+    import compute_sector_weights
+    import sp500_real_returns
+    from sp500_membership import load_membership
+
+    sector_consumer = compute_sector_weights.SectorMktcapConsumer(
+        load_membership(compute_sector_weights.CONSTITUENTS_PATH))
+    sp500_by_year = sp500_real_returns.load_sp500_constituents()
+    returns_consumer = sp500_real_returns.MonthlyReturnsConsumer(sp500_by_year, workers=workers)
+    dec_consumer = compare_mktcap.DecemberMktcapConsumer()
+
+    scanner = CrspScanner(csv_path, workers=workers)
+    for consumer in (sector_consumer, returns_consumer, dec_consumer):
+        scanner.register(consumer)
+    results = scanner.scan()
+
+    compute_sector_weights.main(scan_result=results[sector_consumer.name])
+    sp500_real_returns.main(company_years=results[returns_consumer.name])
+    compare_mktcap.main(crsp_mktcap=results[dec_consumer.name])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CRSP 夜间全量刷新（单遍扫描）")
+    parser.add_argument('--workers', type=int, default=1, help="并行解析 CSV / 逐公司汇总的进程数")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.configure(args)
+    refresh_all(workers=args.workers)
@@ -0,0 +1,167 @@
+"""
+派生数据缓存的公共工具：源文件指纹 + manifest
+
+所有从 data/crsp_compustat/*.csv 派生出的二进制缓存都放在源文件旁边的
+.cache/ 目录下，每个缓存目录带一个 manifest.json，记录源文件的
+size / mtime / blake2b 指纹。源文件变化时缓存自动失效重建。
+appended_to() 判断源文件是否只在末尾追加了整行（新月份 / 新财年），
+这时缓存可以只解析新增部分（crsp_cache.append_cache、compustat_cache.append_compustat_cache）。
+
+常驻模式（analysis_daemon）：set_resident(store) 之后，各 load_* 和 read_csv_rows
+通过 resident() 取对象，源文件没变时直接复用进程内已加载的对象（只读，调用方不要修改）。
+普通脚本运行时没有 store，resident() 直接调用加载函数，行为不变。
+"""
+import csv
+import hashlib
+import io
+import json
+import os
+import shutil
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'crsp_compustat')
+
+MANIFEST = 'manifest.json'
+HASH_BLOCK = 8 * 1024 * 1024
+
+_resident = None
+
+
+def cache_dir_for(source_path, name):
+    """源文件对应的缓存目录: <源文件目录>/.cache/<name>"""
+    return os.path.join(os.path.dirname(os.path.abspath(source_path)), '.cache', name)
+
+
+def source_hasher():
+    """file_hash 用的增量 hash 对象；边解析边 update，省掉单独读一遍源文件"""
+    return hashlib.blake2b(digest_size=16)
+
+
+def file_hash(path, limit=None):
+    """文件（或前 limit 字节）的 blake2b"""
+    h = source_hasher()
+    remaining = limit
+    with open(path, 'rb') as f:
+        while remaining is None or remaining > 0:
+            block = f.read(HASH_BLOCK if remaining is None else min(HASH_BLOCK, remaining))
+            if not block:
+                break
+            h.update(block)
+            if remaining is not None:
+                remaining -= len(block)
+    return h.hexdigest()
+
+
+def file_fingerprint(path):
+    st = os.stat(path)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'hash': file_hash(path)}
+
+
+class HashingReader(io.RawIOBase):
+    """包一层二进制文件，读出的每个字节同时喂给 hasher（source_hasher()）"""
+
+    def __init__(self, raw, hasher):
+        self.raw = raw
+        self.hasher = hasher
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self.raw.readinto(b)
+        if n:
+            self.hasher.update(memoryview(b)[:n])
+        return n
+
+
+def read_manifest(cache_dir):
+    path = os.path.join(cache_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(cache_dir, manifest):
+    path = os.path.join(cache_dir, MANIFEST)
+    tmp = f"{path}.{os.getpid()}.tmp"   # 按进程区分：几个进程可能同时刷新同一份 manifest 的 mtime
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, path)
+
+
+def is_fresh(cache_dir, source_path, version=None):
+    """
+    缓存是否仍对应当前源文件。
+    size + mtime 一致直接认为有效（不读文件）；mtime 变了但 size 相同时
+    再比较 hash，内容没变就只刷新 manifest 里的 mtime。
+    """
+    manifest = read_manifest(cache_dir)
+    if manifest is None or manifest.get('version') != version:
+        return False
+    src = manifest.get('source', {})
+    st = os.stat(source_path)
+    if src.get('size') != st.st_size:
+        return False
+    if src.get('mtime_ns') == st.st_mtime_ns:
+        return True
+    if src.get('hash') != file_hash(source_path):
+        return False
+    src['mtime_ns'] = st.st_mtime_ns
+    write_manifest(cache_dir, manifest)
+    return True
+
+
+def same_source(source, path):
+    """source（file_fingerprint 的结果）是否仍对应 path：size + mtime 一致直接认为是，否则比较 hash"""
+    st = os.stat(path)
+    if source.get('size') != st.st_size:
+        return False
+    return source.get('mtime_ns') == st.st_mtime_ns or source.get('hash') == file_hash(path)
+
+
+def appended_to(source, path):
+    """
+    path 是否是 source 指纹对应的文件在末尾追加了若干整行：
+    文件变大、前 size 字节的 hash 不变、原文件以换行结尾
+    """
+    size = source.get('size')
+    if not size or os.stat(path).st_size <= size:
+        return False
+    with open(path, 'rb') as f:
+        f.seek(size - 1)
+        if f.read(1) != b'\n':
+            return False
+    return file_hash(path, size) == source.get('hash')
+
+
+def replace_dir(tmp_dir, final_dir):
+    """用构建好的临时目录原子地替换旧缓存目录"""
+    if os.path.exists(final_dir):
+        old = final_dir + '.old'
+        shutil.rmtree(old, ignore_errors=True)
+        os.replace(final_dir, old)
+        os.replace(tmp_dir, final_dir)
+        shutil.rmtree(old, ignore_errors=True)
+    else:
+        os.replace(tmp_dir, final_dir)
+
+
+def set_resident(store):
+    """安装常驻数据集存储（需要 get(kind, source_path, load) 方法）；None 表示关闭"""
+    global _resident
+    _resident = store
+
+
+def resident(kind, source_path, load):
+    """kind + 源文件 → load() 的结果；常驻模式下源文件没变时复用内存里的对象"""
+    if _resident is None:
+        return load()
+    return _resident.get(kind, source_path, load)
+
+
+def read_csv_rows(path):
+    """CSV → [行字典]（csv.DictReader）；常驻模式下只解析一次"""
+    def load():
+        with open(path, 'r') as f:
+            return list(csv.DictReader(f))
+    return resident('csv_rows', path, load)
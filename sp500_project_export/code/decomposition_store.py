@@ -0,0 +1,244 @@
+"""
+三层分解结果的分段存储
+
+sp500_decomposition 的输出原来是一个缩进的大 JSON（几 MB，大部分是 companies），
+只想看总量的消费者（shiller_complete 交叉验证、报表）也得整个解析。
+现在每个顶层字段单独存一个紧凑 JSON 文件，加一个很小的 manifest：
+
+  data/sp500_3level_decomposition/
+    manifest.json        {format, version, metadata, sections: {名称: {file, bytes, records}}}
+    aggregate.json       年度总量
+    sectors.json         行业-年
+    companies.json       公司-年（最大的一段，列式编码，见 encode_companies）
+    verification.json    三层加总验证
+    rolling.json         滚动窗口
+    mean_reversion.json  均值回归统计
+    top_contributors.json
+
+读取：load_decomposition(['aggregate']) 只打开 manifest 和请求的段；不给 sections 时读全部，
+结果与旧的单文件 JSON 结构相同（metadata + 各段，顺序一致）。
+目录不存在时回退到旧的 sp500_3level_decomposition.json。
+写入先写临时目录再整体替换（data_cache.replace_dir），读者不会看到写了一半的结果。
+
+companies 段按列存：每个字段一个数组；公司名 / 行业代码 / 行业名字典编码（字典 + 下标），
+年份为整数，数值列按输出时的小数位存成定点整数（496.551 → 496551，scale=3），null 原样保留。
+定点整数 / 10**scale 与原来四舍五入后的浮点数逐位相同；某列有更多小数位时该列退回原始浮点。
+load_decomposition 默认解码回逐行字典（与旧结构相同），columnar=True 时直接返回列式对象（报表页面用）。
+各段可选 gzip / brotli 压缩（<段>.json.gz / .json.br，manifest 记录 compression）；brotli 需要 brotli 包。
+"""
+import gzip
+import json
+import os
+import shutil
+
+from data_cache import replace_dir
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+STORE_DIR = os.path.join(DATA_DIR, 'sp500_3level_decomposition')
+LEGACY_PATH = os.path.join(DATA_DIR, 'sp500_3level_decomposition.json')
+
+FORMAT = 'sp500-3level-sections'
+VERSION = 2
+READ_VERSIONS = (1, 2)
+MANIFEST = 'manifest.json'
+SECTIONS = ('aggregate', 'sectors', 'companies', 'verification', 'rolling', 'mean_reversion', 'top_contributors')
+COMPRESSIONS = {None: '', 'gzip': '.gz', 'br': '.br'}
+
+# companies 的列：(字段, 编码, 小数位)，字段顺序即解码后行字典的键顺序
+COMPANY_COLUMNS = (
+    ('y', 'int', None),       # 年份
+    ('p', 'intstr', None),    # PERMNO（字符串，存整数）
+    ('n', 'dict', None),      # 公司名
+    ('s', 'dict', None),      # GICS 行业代码
+    ('sn', 'dict', None),     # 行业名
+    ('ni', 'fixed', 3),
+    ('ni_p', 'fixed', 3),
+    ('mc', 'fixed', 1),
+    ('mc_p', 'fixed', 1),
+    ('div', 'fixed', 1),
+    ('pr', 'fixed', 4),
+    ('dy', 'fixed', 4),
+    ('pe', 'fixed', 2),
+    ('pe_p', 'fixed', 2),
+)
+
+
+def _dumps(obj):
+    return json.dumps(obj, separators=(',', ':'), default=str)
+
+
+def _encode_fixed(values, scale):
+    """浮点列 → 定点整数列；有任何值不能无损还原时返回 None"""
+    factor = 10 ** scale
+    out = []
+    for v in values:
+        if v is None:
+            out.append(None)
+            continue
+        k = round(v * factor)
+        if k / factor != v:
+            return None
+        out.append(k)
+    return out
+
+
+def encode_companies(rows):
+    """逐行字典（sp500_decomposition 的 companies 输出）→ 列式对象"""
+    columns = {}
+    for field, kind, scale in COMPANY_COLUMNS:
+        values = [r.get(field) for r in rows]
+        if kind == 'int':
+            columns[field] = {'type': 'int', 'values': values}
+        elif kind == 'intstr' and all(v is None or (isinstance(v, str) and v.isdigit() and str(int(v)) == v)
+                                    for v in values):
+            columns[field] = {'type': 'intstr', 'values': [None if v is None else int(v) for v in values]}
+        elif kind == 'dict':
+            index = {}
+            codes = [None if v is None else index.setdefault(v, len(index)) for v in values]
+            columns[field] = {'type': 'dict', 'dict': list(index), 'values': codes}
+        elif kind == 'fixed' and (fixed := _encode_fixed(values, scale)) is not None:
+            columns[field] = {'type': 'fixed', 'scale': scale, 'values': fixed}
+        else:
+            columns[field] = {'type': 'raw', 'values': values}
+    return {'encoding': 'columnar', 'count': len(rows), 'columns': columns}
+
+
+def decode_column(column):
+    """列式对象的一列 → 原始值列表"""
+    kind, values = column['type'], column['values']
+    if kind == 'dict':
+        lookup = column['dict']
+        return [None if v is None else lookup[v] for v in values]
+    if kind == 'intstr':
+        return [None if v is None else str(v) for v in values]
+    if kind == 'fixed':
+        factor = 10 ** column['scale']
+        return [None if v is None else v / factor for v in values]
+    return list(values)
+
+
+def decode_companies(columnar):
+    """列式对象 → 逐行字典（与旧单文件 JSON 的 companies 相同）"""
+    fields = list(columnar['columns'])
+    decoded = [decode_column(columnar['columns'][f]) for f in fields]
+    return [dict(zip(fields, row)) for row in zip(*decoded)]
+
+
+def _compress(data, compression):
+    if compression is None:
+        return data
+    if compression == 'gzip':
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    if brotli is None:
+        raise ValueError("brotli 压缩需要安装 brotli 包（pip install brotli）")
+    return brotli.compress(data, quality=11)
+
+
+def _decompress(data, compression):
+    if compression is None:
+        return data
+    if compression == 'gzip':
+        return gzip.decompress(data)
+    if brotli is None:
+        raise ValueError("读取 .br 分段需要安装 brotli 包（pip install brotli）")
+    return brotli.decompress(data)
+
+
+def write_decomposition(output, store_dir=STORE_DIR, compression=None):
+    """
+    output: {'metadata': ..., 段名: 数据, ...}（旧单文件 JSON 的结构，companies 为逐行字典）
+    compression: None / 'gzip' / 'br'
+    → manifest（dict）
+    """
+    unknown = set(output) - set(SECTIONS) - {'metadata'}
+    if unknown:
+        raise ValueError(f"未知的分段: {sorted(unknown)}")
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"compression 必须是 {list(COMPRESSIONS)} 之一: {compression}")
+    tmp_dir = store_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    manifest = {'format': FORMAT, 'version': VERSION, 'metadata': output.get('metadata', {}), 'sections': {}}
+    for name in SECTIONS:
+        if name not in output:
+            continue
+        payload = output[name]
+        encoding = 'json'
+        if name == 'companies':
+            payload, encoding = encode_companies(payload), 'columnar'
+        raw = _dumps(payload).encode()
+        data = _compress(raw, compression)
+        filename = f"{name}.json{COMPRESSIONS[compression]}"
+        with open(os.path.join(tmp_dir, filename), 'wb') as f:
+            f.write(data)
+        manifest['sections'][name] = {'file': filename, 'bytes': len(data), 'raw_bytes': len(raw),
+                                      'records': len(output[name]), 'encoding': encoding,
+                                      'compression': compression}
+
+    with open(os.path.join(tmp_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    replace_dir(tmp_dir, store_dir)
+    return manifest
+
+
+def read_manifest(store_dir=STORE_DIR):
+    """manifest；分段目录不存在时返回 None"""
+    path = os.path.join(store_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != FORMAT or manifest.get('version') not in READ_VERSIONS:
+        raise ValueError(f"不支持的分解结果格式: {manifest.get('format')} v{manifest.get('version')}")
+    return manifest
+
+
+def exists(store_dir=STORE_DIR, legacy_path=LEGACY_PATH):
+    return os.path.exists(os.path.join(store_dir, MANIFEST)) or os.path.exists(legacy_path)
+
+
+def load_section(name, store_dir=STORE_DIR, manifest=None, columnar=False):
+    """单个分段；manifest 里没有该段时抛 KeyError。columnar=True 时列式段不解码"""
+    manifest = manifest or read_manifest(store_dir)
+    if manifest is None:
+        raise FileNotFoundError(os.path.join(store_dir, MANIFEST))
+    entry = manifest['sections'][name]
+    with open(os.path.join(store_dir, entry['file']), 'rb') as f:
+        data = json.loads(_decompress(f.read(), entry.get('compression')))
+    if entry.get('encoding', 'json') == 'columnar' and not columnar:
+        return decode_companies(data)
+    return data
+
+
+def load_decomposition(sections=None, store_dir=STORE_DIR, legacy_path=LEGACY_PATH, columnar=False):
+    """
+    sections: 要读的段名（None = 全部）
+    columnar: True 时 companies 返回列式对象（encode_companies 的格式）而不是逐行字典
+    → {'metadata': ..., 段名: 数据}；分段目录和旧单文件都不存在时返回 None
+    """
+    if sections is not None:
+        unknown = set(sections) - set(SECTIONS)
+        if unknown:
+            raise ValueError(f"未知的分段: {sorted(unknown)}")
+    manifest = read_manifest(store_dir)
+    if manifest is None:
+        if not os.path.exists(legacy_path):
+            return None
+        with open(legacy_path) as f:
+            data = json.load(f)
+        result = {k: v for k, v in data.items() if k == 'metadata' or sections is None or k in sections}
+        if columnar and 'companies' in result:
+            result['companies'] = encode_companies(result['companies'])
+        return result
+
+    result = {'metadata': manifest['metadata']}
+    for name in SECTIONS:
+        if name in manifest['sections'] and (sections is None or name in sections):
+            result[name] = load_section(name, store_dir, manifest, columnar)
+    return result
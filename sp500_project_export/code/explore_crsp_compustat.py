@@ -1,17 +1,15 @@
 """
 探索 CRSP/Compustat 数据集：验证数据完整性、覆盖范围、合并可行性
 """
-import csv
 import os
 from collections import defaultdict, Counter
 
+from data_cache import read_csv_rows
+
 DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'crsp_compustat')
 
 def load_csv(filename):
-    path = os.path.join(DATA_DIR, filename)
-    with open(path, 'r') as f:
-        reader = csv.DictReader(f)
-        return list(reader)
+    return read_csv_rows(os.path.join(DATA_DIR, filename))
 
 def explore_sp500():
     print("=" * 70)
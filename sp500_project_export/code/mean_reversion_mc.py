@@ -0,0 +1,219 @@
+"""
+均值回归显著性：年度收益的自助法（bootstrap）蒙特卡洛
+
+compute_mean_reversion / range_by_window 只给出各持有期滚动 CAGR 的描述统计。
+这里把年度收益重抽样成大量“随机游走”路径，对每条路径重算同样的滚动窗口离散度
+（标准差、极差、最小值、最大值），得到零假设分布：
+  - p 值 = (1 + #{路径离散度 <= 实际离散度}) / (1 + 路径数)，单侧（离散度收窄）
+  - 置信带 = 零分布的 2.5% / 50% / 97.5% 分位
+  1 年窗口就是样本本身，重抽样的极差不会超过实际极差，其 p(极差) 恒为 1，只作对照
+重抽样方式：
+  - iid：逐年独立抽样（纯随机游走零假设）
+  - block：固定长度 block 的循环移动块自助法
+  - stationary：Politis-Romano 平稳自助法，块长服从均值为 block 的几何分布
+路径按 chunk 批量生成为 (chunk, n) 的 NumPy 数组，滚动 CAGR 由 rolling_returns.CumulativeGrowth
+沿最后一轴一次算出。随机种子按 chunk 从 SeedSequence(seed).spawn() 派生，
+结果只取决于 (seed, paths, chunk)，与进程数无关。
+每批在工作进程里就地归约，只回传 <= 实际值的计数、总和和一份定额样本：p 值与均值用全部路径，
+置信带取自样本（每批按配额取前若干条，合计至多 RESERVOIR_PATHS 条；路径数不超过它时就是全部路径）。
+主进程内存与路径数无关，100 万条路径也只保留 RESERVOIR_PATHS 条。
+
+python code/mean_reversion_mc.py [--paths 100000] [--method stationary] [--block 5] [--workers N]
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import profiling
+from rolling_returns import CumulativeGrowth
+from sp500_data import CPI_INFLATION, SP500_TOTAL_RETURNS
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+SHILLER_PATH = os.path.join(DATA_DIR, 'shiller_complete.json')
+OUTPUT_PATH = os.path.join(DATA_DIR, 'mean_reversion_bootstrap.json')
+
+SP500_WINDOWS = (1, 3, 5, 10, 15, 20, 30)      # 与 build_analysis.py 一致
+SHILLER_WINDOWS = (1, 5, 10, 20, 30, 50)       # 与 shiller_complete.rolling_decomposition 一致
+STATS = ('std', 'range', 'min', 'max')
+BAND_LEVELS = (2.5, 50, 97.5)
+METHODS = ('iid', 'block', 'stationary')
+CHUNK_PATHS = 10000
+RESERVOIR_PATHS = 100000   # 置信带所用样本的路径数上限
+
+
+def sp500_real_returns():
+    """sp500_data 的年度实际总回报（%），与 build_analysis.py 同一公式"""
+    years = sorted(SP500_TOTAL_RETURNS)
+    real = [((1 + SP500_TOTAL_RETURNS[y] / 100) / (1 + CPI_INFLATION[y] / 100) - 1) * 100 for y in years]
+    return years, np.array(real)
+
+
+def shiller_total_returns(path=SHILLER_PATH):
+    """Shiller 年度分解的名义总回报（价格 + 股息率，%）；文件不存在时返回 None"""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        decomp = json.load(f)['decomposition']
+    return [d['year'] for d in decomp], np.array([d['total_return'] * 100 for d in decomp])
+
+
+def resample_indices(rng, paths, n, method, block):
+    """(paths, n) 的重抽样下标"""
+    if method == 'iid' or block <= 1:
+        return rng.integers(0, n, size=(paths, n))
+    if method == 'block':
+        n_blocks = -(-n // block)
+        starts = rng.integers(0, n, size=(paths, n_blocks))
+        idx = (starts[:, :, None] + np.arange(block)) % n
+        return idx.reshape(paths, -1)[:, :n]
+    # stationary：每期以 1/block 的概率开新块，否则接着上一期的下一个位置
+    t = np.arange(n)
+    new = rng.random((paths, n)) < 1.0 / block
+    new[:, 0] = True
+    starts = rng.integers(0, n, size=(paths, n))
+    last = np.maximum.accumulate(np.where(new, t, 0), axis=1)
+    return (np.take_along_axis(starts, last, axis=1) + (t - last)) % n
+
+
+def window_dispersion(growth, windows):
+    """CumulativeGrowth（可批量）→ (..., 窗口数, 4) 的 std / range / min / max"""
+    out = np.empty(growth.log_growth.shape[:-1] + (len(windows), len(STATS)))
+    for k, w in enumerate(windows):
+        cagr = growth.rolling(w)
+        lo, hi = cagr.min(axis=-1), cagr.max(axis=-1)
+        out[..., k, 0] = cagr.std(axis=-1)
+        out[..., k, 1] = hi - lo
+        out[..., k, 2] = lo
+        out[..., k, 3] = hi
+    return out
+
+
+def _reservoir_quota(start, size, paths, reservoir):
+    """第 start..start+size 条路径所在的批应取进样本的条数；各批配额合计为 min(paths, reservoir)"""
+    if paths <= reservoir:
+        return size
+    return reservoir * (start + size) // paths - reservoir * start // paths
+
+
+def _simulate_chunk(returns, windows, method, block, paths, seed_seq, observed, keep):
+    """一批路径 → (<= 实际值的计数, 总和, 前 keep 条路径的离散度)，各为 (窗口数, 4)（样本前加一维）"""
+    rng = np.random.default_rng(seed_seq)
+    idx = resample_indices(rng, paths, len(returns), method, block)
+    null = window_dispersion(CumulativeGrowth(returns[idx]), windows).astype(np.float32)
+    below = (null <= observed).sum(axis=0)
+    return below, null.sum(axis=0, dtype=np.float64), null[:keep].copy()
+
+
+def bootstrap_dispersion(returns, windows, paths=100000, method='stationary', block=5,
+                         seed=20240101, chunk=CHUNK_PATHS, workers=1, reservoir=RESERVOIR_PATHS):
+    """
+    重抽样 paths 条路径，逐批归约 →
+    {windows: 实际用到的窗口, observed: 实际离散度, paths, below: #{模拟 <= 实际}, total: 模拟值总和, sample: 定额样本}
+    observed / below / total 为 (窗口数, 4)，sample 为 (<= reservoir, 窗口数, 4) 的 float32
+    """
+    if method not in METHODS:
+        raise ValueError(f"method 必须是 {METHODS} 之一: {method}")
+    returns = np.asarray(returns, dtype=np.float64)
+    windows = [w for w in windows if w <= len(returns)]
+    observed = window_dispersion(CumulativeGrowth(returns), windows)
+    observed32 = observed.astype(np.float32)   # 与零分布同精度比较，避免舍入造成的假“更小”
+    starts = list(range(0, paths, chunk))
+    sizes = [min(chunk, paths - start) for start in starts]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = [(returns, windows, method, block, size, ss, observed32, _reservoir_quota(start, size, paths, reservoir))
+            for start, size, ss in zip(starts, sizes, seeds)]
+
+    below = np.zeros(observed.shape, dtype=np.int64)
+    total = np.zeros(observed.shape)
+    samples = []
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        parts = pool.map(_simulate_chunk, *zip(*args)) if pool and args else (_simulate_chunk(*a) for a in args)
+        for part_below, part_total, part_sample in parts:
+            below += part_below
+            total += part_total
+            samples.append(part_sample)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    sample = np.concatenate(samples, axis=0) if samples else np.zeros((0,) + observed.shape, np.float32)
+    return {'windows': windows, 'observed': observed, 'paths': paths, 'below': below, 'total': total, 'sample': sample}
+
+
+def summarize(null):
+    """bootstrap_dispersion 的结果 → {窗口: {observed, null_mean, bands, p_value}}"""
+    observed, paths = null['observed'], null['paths']
+    bands = np.percentile(null['sample'], BAND_LEVELS, axis=0)
+    result = {}
+    for k, w in enumerate(null['windows']):
+        result[str(w)] = {
+            'observed': {s: round(float(observed[k, j]), 3) for j, s in enumerate(STATS)},
+            'null_mean': {s: round(float(null['total'][k, j] / paths), 3) for j, s in enumerate(STATS)},
+            'bands': {str(q): {s: round(float(bands[i, k, j]), 3) for j, s in enumerate(STATS)}
+                      for i, q in enumerate(BAND_LEVELS)},
+            # 离散度收窄才支持均值回归：取下尾
+            'p_value': {s: round((1 + int(null['below'][k, j])) / (1 + paths), 5)
+                        for j, s in enumerate(('std', 'range'))},
+        }
+    return result
+
+
+def print_summary(title, result):
+    print(f"\n{title}")
+    print(f"{'窗口':>6} {'实际std':>9} {'零分布std 95%带':>20} {'p(std)':>9} {'实际极差':>9} {'零分布极差 95%带':>20} {'p(极差)':>9}")
+    for w, r in result.items():
+        lo, hi = r['bands']['2.5'], r['bands']['97.5']
+        print(f"{w + '年':>6} {r['observed']['std']:>9.2f} {lo['std']:>9.2f} ~ {hi['std']:>8.2f} "
+              f"{r['p_value']['std']:>9.4f} {r['observed']['range']:>9.2f} "
+              f"{lo['range']:>9.2f} ~ {hi['range']:>8.2f} {r['p_value']['range']:>9.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="均值回归显著性：滚动 CAGR 离散度的自助法检验")
+    parser.add_argument('--paths', type=int, default=100000, help="模拟路径数（1万~100万）")
+    parser.add_argument('--method', choices=METHODS, default='stationary')
+    parser.add_argument('--block', type=int, default=5, help="块长（stationary 为平均块长）")
+    parser.add_argument('--seed', type=int, default=20240101)
+    parser.add_argument('--chunk', type=int, default=CHUNK_PATHS, help="每批路径数（控制内存）")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="进程数（默认 CPU 数；结果与进程数无关）")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.configure(args)
+
+    series = {'sp500_real': ('sp500_data 实际总回报', sp500_real_returns(), SP500_WINDOWS)}
+    shiller = shiller_total_returns()
+    if shiller is not None:
+        series['shiller_total'] = ('Shiller 名义总回报（价格 + 股息率）', shiller, SHILLER_WINDOWS)
+
+    output = {
+        'metadata': {
+            'method': args.method, 'block': args.block, 'paths': args.paths,
+            'seed': args.seed, 'chunk': args.chunk, 'band_levels': list(BAND_LEVELS),
+            'band_sample_paths': min(args.paths, RESERVOIR_PATHS),
+            'p_value': '单侧下尾：(1 + #{模拟 <= 实际}) / (1 + 路径数)',
+        },
+        'series': {},
+    }
+    for key, (label, (years, returns), windows) in series.items():
+        t0 = time.time()
+        with profiling.stage(f"bootstrap {key}"):
+            null = bootstrap_dispersion(returns, windows, paths=args.paths, method=args.method,
+                                        block=args.block, seed=args.seed, chunk=args.chunk,
+                                        workers=args.workers)
+        with profiling.stage(f"summarize {key}"):
+            result = summarize(null)
+        print_summary(f"{label} {years[0]}-{years[-1]}：{args.paths:,} 条路径, "
+                      f"{args.method}, {time.time() - t0:.1f}s", result)
+        output['series'][key] = {'source': label, 'period': f"{years[0]}-{years[-1]}", 'windows': result}
+
+    with open(OUTPUT_PATH, 'w') as f:
+        json.dump(output, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存到: {os.path.basename(OUTPUT_PATH)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+行业 PE 回归概率的置换检验
+
+sp500_industry_analysis 第 4 步的“回归概率”：PE 高于全期均值的年份中，下一年 PE 回落的比例。
+零假设：PE 序列没有时间结构（各年可交换）。把每个行业的 PE 历史随机打乱若干次，
+对每个排列重算同一统计量，经验 p 值 = (1 + #{排列 >= 实际}) / (1 + 排列数)（单侧：回落更频繁）。
+均值与顺序无关，所以整批排列可以一次向量化：(batch, n) 的矩阵比较相邻两列。
+
+排列按批流式生成，每批只回传计数与和，不保留排列本身，内存只与 batch × n 有关；
+(行业, 批) 任务分发到进程池，随机种子按 (行业, 批) 从 SeedSequence 派生，结果与进程数无关。
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+BATCH = 2000
+
+
+def reversion_pct(pes):
+    """
+    PE 序列（最后一轴为时间，可批量）→ 回归概率（%）
+    与 analyze() 第 4 步一致：pe[i] > 均值 的 i 中，pe[i+1] < pe[i] 的比例；没有高于均值的年份记 0
+    """
+    pes = np.asarray(pes, dtype=np.float64)
+    mean_pe = pes.sum(axis=-1, keepdims=True) / pes.shape[-1]
+    above = pes[..., :-1] > mean_pe
+    revert = above & (pes[..., 1:] < pes[..., :-1])
+    n_above = above.sum(axis=-1)
+    return np.where(n_above > 0, revert.sum(axis=-1) / np.maximum(n_above, 1) * 100, 0.0)
+
+
+def _permutation_batch(pes, observed, size, seed_seq):
+    """一批排列 → (>= 实际值的个数, 统计量之和)"""
+    rng = np.random.default_rng(seed_seq)
+    shuffled = rng.permuted(np.broadcast_to(pes, (size, len(pes))), axis=1)
+    stats = reversion_pct(shuffled)
+    return int((stats >= observed).sum()), float(stats.sum())
+
+
+def permutation_test(histories, permutations=10000, batch=BATCH, seed=20240101, workers=1):
+    """
+    histories: {行业代码: [PE, ...]}（按年份排序）
+    → {行业代码: {'revert_pct', 'null_mean', 'p_value', 'permutations'}}
+    """
+    codes = sorted(histories)
+    sizes = [min(batch, permutations - start) for start in range(0, permutations, batch)]
+    sector_seeds = np.random.SeedSequence(seed).spawn(len(codes))
+    pes = {code: np.asarray(histories[code], dtype=np.float64) for code in codes}
+    observed = {code: float(reversion_pct(pes[code])) for code in codes}
+
+    tasks = []
+    for code, ss in zip(codes, sector_seeds):
+        for size, batch_ss in zip(sizes, ss.spawn(len(sizes))):
+            tasks.append((code, (pes[code], observed[code], size, batch_ss)))
+
+    counts = {code: 0 for code in codes}
+    totals = {code: 0.0 for code in codes}
+    if workers <= 1:
+        results = (_permutation_batch(*args) for _, args in tasks)
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        results = pool.map(_permutation_batch, *zip(*(args for _, args in tasks)))
+    try:
+        for (code, _), (ge, total) in zip(tasks, results):
+            counts[code] += ge
+            totals[code] += total
+    finally:
+        if workers > 1:
+            pool.shutdown()
+
+    return {
+        code: {
+            'revert_pct': observed[code],
+            'null_mean': totals[code] / permutations if permutations else None,
+            'p_value': (1 + counts[code]) / (1 + permutations),
+            'permutations': permutations,
+        }
+        for code in codes
+    }
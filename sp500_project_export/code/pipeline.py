@@ -0,0 +1,386 @@
+"""
+声明式流水线：按依赖顺序重建全部派生数据和 HTML 报告，没变的阶段直接跳过
+
+各脚本之间的依赖原来是隐式的：sp500_decomposition 写 data/sp500_3level_decomposition/，
+shiller_complete 读它做交叉验证并写 shiller_complete.json，build_analysis 写
+sp500_analysis.json + sp500_cagr_triangle.bin，rebuild_report 读上面所有文件生成报告。
+STAGES 把每个阶段的脚本、输入、输出写明，阶段之间的边由"输出 → 输入"自动推出。
+
+阶段键 = blake2b(脚本及其 import 的同目录模块源码 + 参数 + 全部输入文件内容)；
+键与上次成功运行时相同且输出都在，就跳过这个阶段。上游重跑后输出逐字节不变时，
+下游的键也不变，照样跳过。输入文件的 hash 按 size + mtime 记在 manifest 里，没变不重读。
+
+就绪的阶段（上游都已完成）放进 ProcessPoolExecutor 并行运行，每个阶段是一个独立的
+子进程（python <脚本> <参数>），输出写到 data/.cache/pipeline/logs/<阶段>.log。
+互不依赖的分支（Shiller、build_analysis、行业权重、公司 / 行业分析……）同时跑，
+全量重建的耗时约等于最慢的那条分支。workers <= 1 时按拓扑顺序逐个运行。
+
+各脚本共用的列式缓存（.cache/ 下的 CRSP 列 / 按月分区 / 面板、Compustat、CCM、成分股）
+由第一个阶段 caches（pipeline.py --warm-caches）先建好，读这些缓存的阶段都依赖它：
+缓存构建器写固定的 <缓存>.tmp 目录再整体替换，冷缓存时几个阶段同时构建同一份缓存会互相踩掉。
+
+python code/pipeline.py                      # 重建所有过期阶段
+python code/pipeline.py report               # 只重建报告及其上游
+python code/pipeline.py --dry-run            # 只列出每个阶段是否需要重跑
+python code/pipeline.py --force shiller      # 忽略缓存重跑 shiller（上游仍按键判断）
+python code/pipeline.py --warm-caches        # 只建好 / 刷新共用缓存（caches 阶段本身）
+"""
+import argparse
+import ast
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from data_cache import cache_dir_for, file_hash, read_manifest, write_manifest
+
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(CODE_DIR)
+STATE_DIR = os.path.join(PROJECT_DIR, 'data', '.cache', 'pipeline')
+LOG_DIR = os.path.join(STATE_DIR, 'logs')
+STATE_VERSION = 1
+
+CRSP = 'data/crsp_compustat/'
+# caches 阶段写的清单（缓存名 → 版本 + 源文件 hash）；读共用缓存的阶段把它列为输入
+CACHES_FILE = 'data/.cache/pipeline/caches.json'
+# caches 阶段负责的缓存：缓存名 → 源文件（crsp_compustat/ 下）
+SHARED_CACHES = {
+    'crsp_monthly': 'crsp_monthly.csv',
+    'crsp_by_month': 'crsp_monthly.csv',
+    'crsp_panel': 'crsp_monthly.csv',
+    'compustat_annual': 'compustat_annual.csv',
+    'ccm_links': 'ccm_link_table.csv',
+    'sp500_membership': 'sp500_constituents.csv',
+}
+
+# 阶段名 → 脚本、参数、输入、输出（路径相对 sp500_project_export/，目录按其中全部文件计）
+# cwd 缺省为 code/；build_analysis 把结果写到当前目录，所以在 data/ 下运行
+STAGES = {
+    'caches': {
+        'script': 'pipeline.py',
+        'args': ['--warm-caches'],
+        'inputs': [CRSP + 'crsp_monthly.csv', CRSP + 'compustat_annual.csv', CRSP + 'ccm_link_table.csv',
+                   CRSP + 'sp500_constituents.csv'],
+        'outputs': [CACHES_FILE] + [f"{CRSP}.cache/{name}/manifest.json" for name in SHARED_CACHES],
+    },
+    'decomposition': {
+        'script': 'sp500_decomposition.py',
+        'args': ['--incremental'],
+        'inputs': [CRSP + 'compustat_annual.csv', CRSP + 'ccm_link_table.csv', CRSP + 'sp500_constituents.csv',
+                   CACHES_FILE],
+        'outputs': ['data/sp500_3level_decomposition'],
+    },
+    'shiller': {
+        'script': 'shiller_complete.py',
+        'inputs': ['data/sp500_3level_decomposition'],
+        'outputs': ['data/shiller_complete.json'],
+    },
+    'analysis': {
+        'script': 'build_analysis.py',
+        'cwd': 'data',
+        'inputs': [],
+        'outputs': ['data/sp500_analysis.json', 'data/sp500_cagr_triangle.bin'],
+    },
+    'sector_weights': {
+        'script': 'compute_sector_weights.py',
+        'inputs': [CRSP + 'crsp_monthly.csv', CRSP + 'sp500_constituents.csv', CACHES_FILE],
+        'outputs': ['data/sp500_sector_weights.json'],
+    },
+    'company': {
+        'script': 'sp500_company_analysis.py',
+        'inputs': [CRSP + 'compustat_annual.csv', CRSP + 'ccm_link_table.csv', CRSP + 'sp500_constituents.csv',
+                   CACHES_FILE],
+        'outputs': ['data/sp500_company_analysis.json'],
+    },
+    'industry': {
+        'script': 'sp500_industry_analysis.py',
+        'inputs': [CRSP + 'compustat_annual.csv', CRSP + 'ccm_link_table.csv', CRSP + 'sp500_constituents.csv',
+                   CACHES_FILE],
+        'outputs': ['data/sp500_industry_analysis.json'],
+    },
+    'real_returns': {
+        'script': 'sp500_real_returns.py',
+        'inputs': [CRSP + 'crsp_monthly.csv', CRSP + 'sp500_constituents.csv', 'data/sp500_company_analysis.json',
+                   CACHES_FILE],
+        'outputs': [],
+    },
+    'report': {
+        'script': 'rebuild_report.py',
+        'inputs': ['data/sp500_analysis.json', 'data/sp500_cagr_triangle.bin', 'data/turnover_data.json',
+                   'data/duration_dist.json', 'data/sp500_3level_decomposition', 'data/shiller_complete.json'],
+        'outputs': ['report/sp500_mean_reversion.html'],
+    },
+}
+
+
+def _abs(rel):
+    return os.path.join(PROJECT_DIR, rel)
+
+
+def upstream(name, stages=STAGES):
+    """直接依赖：输出里含有本阶段某个输入的阶段"""
+    inputs = set(stages[name]['inputs'])
+    return sorted(other for other, stage in stages.items()
+                  if other != name and inputs.intersection(stage['outputs']))
+
+
+def select(targets, stages=STAGES):
+    """targets 及其全部上游，按拓扑顺序；targets 为空时返回全部阶段"""
+    wanted, todo = set(), list(targets or stages)
+    while todo:
+        name = todo.pop()
+        if name not in stages:
+            raise KeyError(f"未知阶段: {name}（可选: {', '.join(stages)}）")
+        if name not in wanted:
+            wanted.add(name)
+            todo.extend(upstream(name, stages))
+    order, placed = [], set()
+    while len(order) < len(wanted):
+        ready = [n for n in stages if n in wanted and n not in placed
+                 and all(u in placed for u in upstream(n, stages))]
+        if not ready:
+            raise ValueError(f"阶段依赖有环: {sorted(wanted - placed)}")
+        order.extend(ready)
+        placed.update(ready)
+    return order
+
+
+def code_modules(script):
+    """脚本 + 它（递归）import 的 code/ 下同目录模块 → [模块文件名]"""
+    seen, todo = set(), [script]
+    while todo:
+        filename = todo.pop()
+        if filename in seen:
+            continue
+        seen.add(filename)
+        with open(os.path.join(CODE_DIR, filename)) as f:
+            tree = ast.parse(f.read(), filename)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                path = name.split('.')[0] + '.py'
+                if os.path.exists(os.path.join(CODE_DIR, path)):
+                    todo.append(path)
+    return sorted(seen)
+
+
+class HashMemo:
+    """文件路径 → blake2b；size + mtime 与上次相同时沿用记下的 hash"""
+
+    def __init__(self, files=None):
+        self.files = files or {}
+
+    def file(self, path):
+        st = os.stat(path)
+        entry = self.files.get(path)
+        if entry is None or entry['size'] != st.st_size or entry['mtime_ns'] != st.st_mtime_ns:
+            entry = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'hash': file_hash(path)}
+            self.files[path] = entry
+        return entry['hash']
+
+    def path(self, rel):
+        """文件或目录（其中全部文件，跳过 . 开头的）→ {相对路径: hash}"""
+        full = _abs(rel)
+        if not os.path.isdir(full):
+            return {rel: self.file(full)}
+        hashes = {}
+        for root, dirs, files in os.walk(full):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+            for filename in sorted(files):
+                if not filename.startswith('.'):
+                    path = os.path.join(root, filename)
+                    hashes[os.path.relpath(path, PROJECT_DIR)] = self.file(path)
+        return hashes
+
+
+def stage_key(name, memo, stages=STAGES):
+    """阶段键；有输入文件不存在时抛 FileNotFoundError"""
+    stage = stages[name]
+    parts = {
+        'script': stage['script'],
+        'args': stage.get('args', []),
+        'code': {m: memo.file(os.path.join(CODE_DIR, m)) for m in code_modules(stage['script'])},
+        'inputs': {},
+    }
+    for rel in stage['inputs']:
+        if not os.path.exists(_abs(rel)):
+            raise FileNotFoundError(f"缺少输入 {rel}")
+        parts['inputs'].update(memo.path(rel))
+    blob = json.dumps(parts, sort_keys=True).encode()
+    return hashlib.blake2b(blob, digest_size=16).hexdigest()
+
+
+def outputs_present(name, stages=STAGES):
+    return all(os.path.exists(_abs(rel)) for rel in stages[name]['outputs'])
+
+
+def load_state():
+    state = read_manifest(STATE_DIR)
+    if state is None or state.get('version') != STATE_VERSION:
+        return {'version': STATE_VERSION, 'stages': {}, 'files': {}}
+    return state
+
+
+def save_state(state, memo):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    state['files'] = memo.files
+    write_manifest(STATE_DIR, state)
+
+
+def _run_stage(name, cmd, cwd, log_path):
+    """工作进程里跑一个阶段的子进程 → (阶段名, 返回码, 秒数)"""
+    t0 = time.time()
+    with open(log_path, 'w') as log:
+        proc = subprocess.run(cmd, cwd=cwd, stdout=log, stderr=subprocess.STDOUT)
+    return name, proc.returncode, time.time() - t0
+
+
+def _log_tail(log_path, lines=15):
+    with open(log_path, errors='replace') as f:
+        return ''.join(f.readlines()[-lines:])
+
+
+def run(targets=None, force=False, workers=1, dry_run=False, stages=STAGES):
+    """
+    按依赖顺序运行 targets 及其上游中过期的阶段。
+    force: targets（为空时全部阶段）忽略缓存重跑，上游照常按键判断；dry_run: 只打印计划（上游需要重跑时下游一律算作需要重跑）
+    返回 {阶段名: 'fresh' / 'ran' / 'stale' / 'failed' / 'blocked'}
+    """
+    order = select(targets, stages)
+    forced = set(targets or order) if force else set()
+    state = load_state()
+    memo = HashMemo(state.get('files'))
+    status, keys, seconds, running = {}, {}, {}, {}
+    os.makedirs(LOG_DIR, exist_ok=True)
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 and not dry_run else None
+    t0 = time.time()
+
+    def finish(name, returncode, elapsed):
+        seconds[name] = elapsed
+        log_path = os.path.join(LOG_DIR, f"{name}.log")
+        if returncode != 0 or not outputs_present(name, stages):
+            status[name] = 'failed'
+            reason = f"返回码 {returncode}" if returncode else "缺少输出"
+            print(f"  ✗ {name} 失败（{reason}，{elapsed:.1f}s），日志 {os.path.relpath(log_path, PROJECT_DIR)}:")
+            print('    ' + _log_tail(log_path).rstrip().replace('\n', '\n    '))
+            return
+        status[name] = 'ran'
+        state['stages'][name] = {'key': keys[name], 'seconds': round(elapsed, 2), 'finished': time.time()}
+        save_state(state, memo)
+        print(f"  ✓ {name} 完成 ({elapsed:.1f}s)")
+
+    try:
+        while len(status) < len(order):
+            for name in order:
+                if name in status or name in running:
+                    continue
+                deps = upstream(name, stages)
+                if any(d in order and d not in status for d in deps):
+                    continue
+                if any(status.get(d) in ('failed', 'blocked') for d in deps):
+                    status[name] = 'blocked'
+                    print(f"  - {name} 跳过（上游失败）")
+                    continue
+                if dry_run and any(status.get(d) == 'stale' for d in deps):
+                    status[name] = 'stale'
+                    print(f"  * {name} 需要重跑（上游需要重跑）")
+                    continue
+                try:
+                    keys[name] = stage_key(name, memo, stages)
+                except FileNotFoundError as e:
+                    status[name] = 'failed'
+                    print(f"  ✗ {name} 无法运行: {e}")
+                    continue
+                previous = state['stages'].get(name, {})
+                if name not in forced and previous.get('key') == keys[name] and outputs_present(name, stages):
+                    status[name] = 'fresh'
+                    print(f"  = {name} 已是最新")
+                    continue
+                if dry_run:
+                    status[name] = 'stale'
+                    print(f"  * {name} 需要重跑")
+                    continue
+                stage = stages[name]
+                cmd = [sys.executable, os.path.join(CODE_DIR, stage['script'])] + stage.get('args', [])
+                cwd = _abs(stage.get('cwd', 'code'))
+                log_path = os.path.join(LOG_DIR, f"{name}.log")
+                print(f"  > {name} 开始: {stage['script']} {' '.join(stage.get('args', []))}".rstrip())
+                if pool is None:
+                    finish(*_run_stage(name, cmd, cwd, log_path))
+                else:
+                    running[name] = pool.submit(_run_stage, name, cmd, cwd, log_path)
+            if running:
+                done, _ = wait(list(running.values()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, returncode, elapsed = future.result()
+                    del running[name]
+                    finish(name, returncode, elapsed)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        save_state(state, memo)
+
+    if seconds:
+        print(f"\n  运行 {len(seconds)} 个阶段: 合计 {sum(seconds.values()):.1f}s，"
+              f"实际耗时 {time.time() - t0:.1f}s")
+    return status
+
+
+def warm_caches():
+    """依次建好 / 刷新 SHARED_CACHES，写 CACHES_FILE（只记版本和源文件 hash，mtime 变化不影响下游）"""
+    from ccm_links import load_link_index
+    from compustat_cache import load_compustat
+    from crsp_cache import ensure_cache
+    from crsp_panel import load_panel
+    from crsp_partitions import load_partitions
+    from sp500_membership import load_membership
+
+    crsp_dir = _abs(CRSP)
+    ensure_cache(os.path.join(crsp_dir, 'crsp_monthly.csv'))
+    load_partitions(os.path.join(crsp_dir, 'crsp_monthly.csv'))
+    load_panel(os.path.join(crsp_dir, 'crsp_monthly.csv'))
+    load_compustat(os.path.join(crsp_dir, 'compustat_annual.csv'))
+    load_link_index(os.path.join(crsp_dir, 'ccm_link_table.csv'))
+    load_membership(os.path.join(crsp_dir, 'sp500_constituents.csv'))
+
+    caches = {}
+    for name, filename in SHARED_CACHES.items():
+        manifest = read_manifest(cache_dir_for(os.path.join(crsp_dir, filename), name))
+        caches[name] = {'version': manifest['version'], 'source': manifest['source']['hash']}
+        print(f"  {name}: v{manifest['version']} {manifest['source']['hash'][:12]}")
+    os.makedirs(os.path.dirname(_abs(CACHES_FILE)), exist_ok=True)
+    with open(_abs(CACHES_FILE), 'w') as f:
+        json.dump(caches, f, indent=2, sort_keys=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按依赖顺序重建派生数据和报告（没变的阶段跳过）")
+    parser.add_argument('targets', nargs='*', help=f"要重建的阶段（连同上游）；默认全部: {', '.join(STAGES)}")
+    parser.add_argument('--force', action='store_true', help="忽略缓存重跑所选阶段（未指定时全部阶段）")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="并行运行的阶段数（默认 CPU 数）")
+    parser.add_argument('--dry-run', action='store_true', help="只列出需要重跑的阶段")
+    parser.add_argument('--warm-caches', action='store_true', help="只建好 / 刷新各阶段共用的缓存（caches 阶段）")
+    args = parser.parse_args()
+
+    if args.warm_caches:
+        warm_caches()
+        return
+
+    print("=" * 80)
+    print("流水线" + ("（dry run）" if args.dry_run else ""))
+    print("=" * 80)
+    status = run(args.targets, force=args.force, workers=args.workers, dry_run=args.dry_run)
+    if any(s in ('failed', 'blocked') for s in status.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
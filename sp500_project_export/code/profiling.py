@@ -0,0 +1,304 @@
+"""
+流水线脚本的性能剖析 / 追踪钩子
+
+用法：把脚本里的各个阶段包起来
+    with profiling.stage("加载数据"):
+        ...
+    @profiling.profiled("计算年度回报")
+    def compute_annual_returns(...): ...
+开启方式（二选一，默认关闭）：
+  - 环境变量 SP500_PROFILE=1（或给输出目录 / 追踪文件路径），SP500_PROFILE_CPROFILE=1 额外导出 cProfile。
+    环境变量会被子进程（流水线阶段、benchmark）继承，所以文件名里总带进程号：
+    给目录时写 <目录>/<脚本名>-<时间>-<pid>.trace.json，给 .json 路径时写 <路径>.<pid>.trace.json
+  - 脚本命令行 --profile [追踪文件] / --cprofile（见 add_arguments / configure）
+关闭时 stage() 返回同一个空上下文、profiled() 的包装只多一次全局变量判断，开销可以忽略。
+
+开启后每个阶段记录：墙钟时间、CPU 时间、调用次数、tracemalloc 峰值（绝对值与相对进入时的增量）。
+阶段可以嵌套，子阶段的峰值会并入父阶段。进程退出时写追踪文件（Chrome trace event 格式，
+可直接拖进 chrome://tracing 或 Perfetto 查看时间线），并打印按阶段汇总的耗时表。
+cProfile 每个阶段一个 .prof（子阶段运行时父阶段的 profiler 暂停，所以 .prof 只含本阶段自身的代码），
+用 python -m pstats 或 snakeviz 打开。
+
+注意 tracemalloc 本身会让分配密集的代码慢 1.5~3 倍，剖析时的绝对耗时只用于比较阶段占比。
+"""
+import atexit
+import cProfile
+import functools
+import json
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+PROFILE_ENV = 'SP500_PROFILE'
+CPROFILE_ENV = 'SP500_PROFILE_CPROFILE'
+PROFILE_DIR = os.path.join(os.path.dirname(__file__), '..', 'profiles')
+
+_state = None
+
+
+class _NullStage:
+    """关闭时的空上下文：不计时、不分配"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _NullStage()
+
+
+class _Frame:
+    __slots__ = ('name', 't0', 'cpu0', 'mem0', 'peak', 'profiler')
+
+    def __init__(self, name):
+        self.name = name
+        self.t0 = self.cpu0 = 0.0
+        self.mem0 = self.peak = 0
+        self.profiler = None
+
+
+class _Stage:
+    __slots__ = ('state', 'frame')
+
+    def __init__(self, state, name):
+        self.state = state
+        self.frame = _Frame(name)
+
+    def __enter__(self):
+        self.state.push(self.frame)
+        return self
+
+    def __exit__(self, *exc):
+        self.state.pop(self.frame)
+        return False
+
+
+class _ProfileState:
+    def __init__(self, trace_path, cprofile):
+        self.trace_path = trace_path
+        self.cprofile = cprofile
+        self.pid = os.getpid()
+        self.origin = time.perf_counter()
+        self.stack = []
+        self.events = []
+        self.stages = {}
+        self.dumps = []
+
+    def push(self, frame):
+        if self.stack:
+            parent = self.stack[-1]
+            if parent.profiler is not None:
+                parent.profiler.disable()
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if self.stack:
+                self.stack[-1].peak = max(self.stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            frame.mem0 = frame.peak = current
+        self.stack.append(frame)
+        if self.cprofile:
+            frame.profiler = cProfile.Profile()
+            frame.profiler.enable()
+        frame.cpu0 = time.process_time()
+        frame.t0 = time.perf_counter()
+
+    def pop(self, frame):
+        t1 = time.perf_counter()
+        cpu = time.process_time() - frame.cpu0
+        if frame.profiler is not None:
+            frame.profiler.disable()
+        depth = len(self.stack) - 1
+        self.stack.pop()
+        parent = self.stack[-1] if self.stack else None
+
+        peak = current = None
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, frame.peak)
+            if parent is not None:
+                parent.peak = max(parent.peak, peak)
+            tracemalloc.reset_peak()
+
+        wall = t1 - frame.t0
+        args = {'cpu_s': round(cpu, 6), 'depth': depth}
+        if parent is not None:
+            args['parent'] = parent.name
+        if peak is not None:
+            args['peak_mb'] = round(peak / 2**20, 3)
+            args['peak_delta_mb'] = round((peak - frame.mem0) / 2**20, 3)
+            args['retained_mb'] = round((current - frame.mem0) / 2**20, 3)
+        if frame.profiler is not None:
+            args['cprofile'] = self.dump_profile(frame)
+        self.events.append({
+            'name': frame.name, 'ph': 'X', 'pid': self.pid, 'tid': 0,
+            'ts': round((frame.t0 - self.origin) * 1e6, 1), 'dur': round(wall * 1e6, 1),
+            'args': args,
+        })
+
+        s = self.stages.setdefault(frame.name, {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'max_s': 0.0})
+        s['calls'] += 1
+        s['wall_s'] += wall
+        s['cpu_s'] += cpu
+        s['max_s'] = max(s['max_s'], wall)
+        if peak is not None:
+            s['peak_mb'] = max(s.get('peak_mb', 0.0), args['peak_mb'])
+            s['peak_delta_mb'] = max(s.get('peak_delta_mb', 0.0), args['peak_delta_mb'])
+
+        if parent is not None and parent.profiler is not None:
+            parent.profiler.enable()
+
+    def dump_profile(self, frame):
+        base = os.path.splitext(self.trace_path)[0]
+        if base.endswith('.trace'):
+            base = base[:-len('.trace')]
+        safe = re.sub(r'[^\w.-]+', '_', frame.name).strip('_') or 'stage'
+        path = f"{base}.{len(self.dumps):03d}-{safe}.prof"
+        frame.profiler.dump_stats(path)
+        self.dumps.append(path)
+        return os.path.basename(path)
+
+    def summary(self):
+        out = {}
+        for name, s in self.stages.items():
+            rec = {k: (round(v, 6) if isinstance(v, float) else v) for k, v in s.items()}
+            rec['mean_s'] = round(s['wall_s'] / s['calls'], 6)
+            out[name] = rec
+        return out
+
+
+def _default_trace_path(directory=PROFILE_DIR):
+    script = os.path.splitext(os.path.basename(sys.argv[0] or 'python'))[0] or 'python'
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    return os.path.join(directory, f"{script}-{stamp}-{os.getpid()}.trace.json")
+
+
+def _env_trace_path(value):
+    """环境变量里的路径 → 本进程的追踪文件（带 pid，继承同一环境变量的子进程不会互相覆盖）"""
+    if not value.endswith('.json'):
+        return _default_trace_path(value)
+    base = value[:-len('.json')]
+    if base.endswith('.trace'):
+        base = base[:-len('.trace')]
+    return f"{base}.{os.getpid()}.trace.json"
+
+
+def enable(trace_path=None, cprofile=False, memory=True):
+    """开启剖析（重复调用只更新 cProfile 开关）；trace_path 为空时写到 profiles/<脚本名>-<时间>.trace.json"""
+    global _state
+    if _state is not None:
+        _state.cprofile = _state.cprofile or cprofile
+        return _state
+    trace_path = os.path.abspath(trace_path or _default_trace_path())
+    os.makedirs(os.path.dirname(trace_path), exist_ok=True)
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _state = _ProfileState(trace_path, cprofile)
+    atexit.register(_finish)
+    return _state
+
+
+def enabled():
+    return _state is not None
+
+
+def stage(name):
+    """阶段上下文管理器；未开启时返回共享的空上下文"""
+    if _state is None:
+        return _NULL
+    return _Stage(_state, name)
+
+
+def profiled(name=None):
+    """函数装饰器：每次调用作为一个阶段，名字默认取函数名。开关在调用时判断，所以 import 之后再开启也有效"""
+    def decorate(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _state is None:
+                return func(*args, **kwargs)
+            with _Stage(_state, label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def summary():
+    """{阶段名: {calls, wall_s, cpu_s, max_s, mean_s, peak_mb, peak_delta_mb}}；未开启时为 None"""
+    return _state.summary() if _state is not None else None
+
+
+def write_trace(path=None):
+    """写追踪文件，返回路径；未开启时返回 None"""
+    if _state is None:
+        return None
+    path = path or _state.trace_path
+    trace = {
+        'traceEvents': sorted(_state.events, key=lambda e: e['ts']),
+        'displayTimeUnit': 'ms',
+        'metadata': {
+            'script': os.path.basename(sys.argv[0] or ''),
+            'argv': sys.argv[1:],
+            'pid': _state.pid,
+            'tracemalloc': tracemalloc.is_tracing(),
+            'cprofile': _state.dumps,
+        },
+        'stages': _state.summary(),
+    }
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(trace, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+    return path
+
+
+def print_summary(file=None):
+    stages = summary()
+    if not stages:
+        return
+    file = file or sys.stderr
+    print(f"\n性能剖析（{len(stages)} 个阶段）", file=file)
+    print(f"  {'阶段':<24} {'次数':>6} {'墙钟(s)':>10} {'CPU(s)':>10} {'峰值(MB)':>10} {'增量(MB)':>10}", file=file)
+    for name, s in sorted(stages.items(), key=lambda kv: -kv[1]['wall_s']):
+        peak = f"{s['peak_mb']:>10.1f}" if 'peak_mb' in s else f"{'-':>10}"
+        delta = f"{s['peak_delta_mb']:>10.1f}" if 'peak_delta_mb' in s else f"{'-':>10}"
+        print(f"  {name:<24} {s['calls']:>6} {s['wall_s']:>10.3f} {s['cpu_s']:>10.3f} {peak} {delta}", file=file)
+
+
+def _finish():
+    # fork 出来的工作进程继承了状态，只由开启剖析的进程写文件
+    if _state is None or _state.pid != os.getpid() or not _state.events:
+        return
+    print_summary()
+    path = write_trace()
+    print(f"  追踪文件: {path}", file=sys.stderr)
+
+
+def add_arguments(parser):
+    """给脚本的 argparse 加 --profile [追踪文件] 与 --cprofile"""
+    parser.add_argument('--profile', nargs='?', const='', default=None, metavar='TRACE',
+                        help=f"开启阶段剖析，写追踪文件（默认 profiles/ 下；也可用环境变量 {PROFILE_ENV}）")
+    parser.add_argument('--cprofile', action='store_true', help="剖析时每个阶段额外导出 cProfile .prof")
+    return parser
+
+
+def configure(args):
+    """按 add_arguments 解析出的参数开启剖析"""
+    if args.profile is not None or args.cprofile:
+        enable(args.profile or None, cprofile=args.cprofile)
+
+
+def _from_env():
+    value = os.environ.get(PROFILE_ENV, '').strip()
+    if not value or value.lower() in ('0', 'false', 'no', 'off'):
+        return
+    path = None if value.lower() in ('1', 'true', 'yes', 'on') else _env_trace_path(value)
+    enable(path, cprofile=os.environ.get(CPROFILE_ENV, '').strip().lower() in ('1', 'true', 'yes', 'on'))
+
+
+_from_env()
@@ -1,46 +1,117 @@
 """
 重建完整 HTML 报告：加入左侧导航 + 公司级数据 + 三层回报分解
+
+两种输出：
+  - 默认单文件：所有数据以 JSON 字面量内嵌进 HTML，双击即可打开
+  - --lazy：数据按 section 拆成分块（report/sp500_mean_reversion_data/<块>.json，另附预压缩的 .json.gz），
+    页面只带图表代码；某个 section 滚入视口时才取它需要的块（有 DecompressionStream 时取 .gz）再画图。
+    三层分解只导出页面用到的段（不含 companies）。分块模式需通过 HTTP 打开（fetch 不能读 file://），
+    例如在 report/ 下 python -m http.server
 """
+import argparse
+import base64
+import gzip
 import json
 import os
+import shutil
 
-DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+from decomposition_store import load_decomposition
+import profiling
 
-# Load existing analysis data
-with open(os.path.join(DATA_DIR, "sp500_analysis.json")) as f:
-    analysis = json.load(f)
-
-# Load turnover data
-with open(os.path.join(DATA_DIR, "turnover_data.json")) as f:
-    turnover = json.load(f)
-
-# Load duration distribution
-with open(os.path.join(DATA_DIR, "duration_dist.json")) as f:
-    duration_dist = json.load(f)
-
-# Load 3-level decomposition data
-decomp_path = os.path.join(DATA_DIR, "sp500_3level_decomposition.json")
-if os.path.exists(decomp_path):
-    with open(decomp_path) as f:
-        decomposition = json.load(f)
-else:
-    decomposition = None
-
-# Load Shiller complete data (1871-2025)
-shiller_path = os.path.join(DATA_DIR, "shiller_complete.json")
-if os.path.exists(shiller_path):
-    with open(shiller_path) as f:
-        shiller_data = json.load(f)
-else:
-    shiller_data = None
-
-data_json = json.dumps(analysis)
-turnover_json = json.dumps(turnover)
-duration_json = json.dumps(duration_dist)
-decomp_json = json.dumps(decomposition) if decomposition else 'null'
-shiller_json = json.dumps(shiller_data) if shiller_data else 'null'
-
-html = f"""<!DOCTYPE html>
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+REPORT_DIR = os.path.join(os.path.dirname(__file__), '..', 'report')
+CHUNK_DIR_NAME = 'sp500_mean_reversion_data'
+# 页面用到的三层分解段；分块模式下每段一个数据块 decomp_<段>
+PAGE_DECOMP_SECTIONS = ('aggregate', 'sectors', 'verification', 'rolling', 'mean_reversion')
+
+parser = argparse.ArgumentParser(description="重建 HTML 报告")
+parser.add_argument('--lazy', action='store_true',
+                    help="数据写成预压缩的分块文件，section 滚入视口时再加载（需通过 HTTP 打开）")
+profiling.add_arguments(parser)
+args = parser.parse_args()
+profiling.configure(args)
+
+with profiling.stage("加载数据"):
+    # Load existing analysis data
+    with open(os.path.join(DATA_DIR, "sp500_analysis.json")) as f:
+        analysis = json.load(f)
+
+    # Load (start, end) CAGR triangle sidecar (build_analysis.py)
+    tri_meta = analysis.get("cagr_triangle")
+    tri_path = os.path.join(DATA_DIR, tri_meta["file"]) if tri_meta else None
+    if tri_path and os.path.exists(tri_path):
+        with open(tri_path, "rb") as f:
+            cagr_tri_json = json.dumps({"meta": tri_meta, "b64": base64.b64encode(f.read()).decode("ascii")})
+    else:
+        cagr_tri_json = 'null'
+
+    # Load turnover data
+    with open(os.path.join(DATA_DIR, "turnover_data.json")) as f:
+        turnover = json.load(f)
+
+    # Load duration distribution
+    with open(os.path.join(DATA_DIR, "duration_dist.json")) as f:
+        duration_dist = json.load(f)
+
+    # Load 3-level decomposition data
+    decomposition = load_decomposition(PAGE_DECOMP_SECTIONS if args.lazy else None,
+                                       store_dir=os.path.join(DATA_DIR, "sp500_3level_decomposition"),
+                                       legacy_path=os.path.join(DATA_DIR, "sp500_3level_decomposition.json"))
+
+    # Load Shiller complete data (1871-2025)
+    shiller_path = os.path.join(DATA_DIR, "shiller_complete.json")
+    if os.path.exists(shiller_path):
+        with open(shiller_path) as f:
+            shiller_data = json.load(f)
+    else:
+        shiller_data = None
+
+
+def write_chunks(chunks, chunk_dir):
+    """{块名: 数据} → <块名>.json + <块名>.json.gz；返回页面用的块清单"""
+    tmp_dir = chunk_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    index = {}
+    for name, value in chunks.items():
+        raw = json.dumps(value, separators=(',', ':')).encode()
+        packed = gzip.compress(raw, compresslevel=9, mtime=0)
+        for filename, data in ((f"{name}.json", raw), (f"{name}.json.gz", packed)):
+            with open(os.path.join(tmp_dir, filename), 'wb') as f:
+                f.write(data)
+        index[name] = {'file': f"{name}.json", 'gzip': f"{name}.json.gz",
+                       'bytes': len(raw), 'gzip_bytes': len(packed)}
+    shutil.rmtree(chunk_dir, ignore_errors=True)
+    os.replace(tmp_dir, chunk_dir)
+    return index
+
+
+with profiling.stage("序列化数据"):
+    if args.lazy:
+        chunks = {'analysis': analysis, 'turnover': turnover, 'duration': duration_dist}
+        if shiller_data:
+            chunks['shiller'] = shiller_data
+        if cagr_tri_json != 'null':
+            chunks['cagr_triangle'] = json.loads(cagr_tri_json)
+        if decomposition:
+            for name in PAGE_DECOMP_SECTIONS:
+                if name in decomposition:
+                    chunks[f'decomp_{name}'] = decomposition[name]
+        chunk_index = write_chunks(chunks, os.path.join(REPORT_DIR, CHUNK_DIR_NAME))
+        lazy_json = json.dumps({'base': CHUNK_DIR_NAME + '/', 'chunks': chunk_index})
+        data_json = turnover_json = duration_json = shiller_json = 'null'
+        cagr_tri_json = 'null'
+        decomp_json = '{}' if decomposition else 'null'   # 各段到达后填进 DECOMP
+    else:
+        lazy_json = 'null'
+        data_json = json.dumps(analysis)
+        turnover_json = json.dumps(turnover)
+        duration_json = json.dumps(duration_dist)
+        decomp_json = json.dumps(decomposition) if decomposition else 'null'
+        shiller_json = json.dumps(shiller_data) if shiller_data else 'null'
+
+with profiling.stage("生成 HTML"):
+    html = f"""<!DOCTYPE html>
 <html lang="zh-CN">
 <head>
 <meta charset="UTF-8">
@@ -167,6 +238,12 @@ html = f"""<!DOCTYPE html>
   }}
   .insight strong {{ color: #60a5fa; }}
 
+  .heatmap-tip {{
+    position: absolute; display: none; pointer-events: none;
+    background: rgba(15,20,30,0.92); border: 1px solid rgba(255,255,255,0.12);
+    border-radius: 6px; padding: 6px 10px; font-size: 0.78rem; color: #cbd5e1; white-space: nowrap;
+  }}
+
   .tabs {{ display: flex; gap: 6px; margin-bottom: 12px; flex-wrap: wrap; }}
   .tab-btn {{
     padding: 5px 14px;
@@ -286,6 +363,7 @@ html = f"""<!DOCTYPE html>
     <a class="nav-link" href="#s2"><span class="nav-icon">🔻</span>均值回归漏斗</a>
     <a class="nav-link" href="#s3"><span class="nav-icon">〰️</span>滚动年化收益率</a>
     <a class="nav-link" href="#s4"><span class="nav-icon">🎯</span>任意入场 → 2024</a>
+    <a class="nav-link" href="#s4b"><span class="nav-icon">🗺️</span>持有区间热力图</a>
     <a class="nav-link" href="#s5"><span class="nav-icon">💰</span>$100 累积增长</a>
   </div>
 
@@ -391,6 +469,13 @@ html = f"""<!DOCTYPE html>
     </div>
   </div>
 
+  <div class="section" id="s4b">
+    <h2>图四B：任意持有区间的年化收益热力图</h2>
+    <div class="desc">纵轴 = 买入年份，横轴 = 卖出年份；每一格是该区间的年化收益（预计算的区间三角表，悬停即查）</div>
+    <div class="tabs" id="heatmapTabs"></div>
+    <div class="chart-container tall" id="heatmapBox"><canvas id="cagrHeatmap"></canvas><div id="heatmapTip" class="heatmap-tip"></div></div>
+  </div>
+
   <div class="section" id="s5">
     <h2>图五：$100 的累积增长轨迹</h2>
     <div class="desc">名义增长 vs 实际购买力（对数刻度）</div>
@@ -606,16 +691,128 @@ html = f"""<!DOCTYPE html>
 // ============================================================
 // DATA
 // ============================================================
-const DATA = {data_json};
-const TURNOVER = {turnover_json};
-const DURATION = {duration_json};
-const DECOMP = {decomp_json};
-const SHILLER = {shiller_json};
+// 单文件模式下数据直接内嵌；分块模式（LAZY）下为 null，由 loadChunk 按需填入
+const LAZY = {lazy_json};
+let DATA = {data_json};
+let TURNOVER = {turnover_json};
+let DURATION = {duration_json};
+let DECOMP = {decomp_json};
+let SHILLER = {shiller_json};
+let CAGR_TRI = {cagr_tri_json};
 
 Chart.defaults.color = '#6b7a8d';
 Chart.defaults.borderColor = 'rgba(255,255,255,0.05)';
 Chart.defaults.font.family = "-apple-system, BlinkMacSystemFont, 'Segoe UI', 'PingFang SC', sans-serif";
 
+// ============================================================
+// SECTIONS: 每段初始化代码登记到所在的 section 和它需要的数据块
+// 图表 section 在接近视口时才构造 Chart（分块模式下先取数据块），离视口很远时销毁并还原模板，
+// 回来时重新构造；section 先锁住当前高度，销毁 / 重建不改变布局。
+// 只生成表格、列表等 DOM 的段标 {{ charts: false }}：单文件模式下立即执行，之后不销毁。
+// ============================================================
+const SECTION_INITS = [];
+function onSection(id, chunks, init, opts) {{
+  SECTION_INITS.push({{ id, chunks, init, charts: !(opts && opts.charts === false) }});
+}}
+
+// 记录每个 section 里活着的 Chart 实例（包括切换标签 / 下拉框时重建的）
+const sectionCharts = {{}};
+Chart.register({{
+  id: 'sectionTracker',
+  afterInit(chart) {{
+    const section = chart.canvas && chart.canvas.closest('.section');
+    if (!section) return;
+    chart.$section = section.id;
+    (sectionCharts[section.id] = sectionCharts[section.id] || new Set()).add(chart);
+  }},
+  afterDestroy(chart) {{
+    if (chart.$section) sectionCharts[chart.$section].delete(chart);
+  }},
+}});
+
+function applyChunk(name, value) {{
+  if (name === 'analysis') DATA = value;
+  else if (name === 'turnover') TURNOVER = value;
+  else if (name === 'duration') DURATION = value;
+  else if (name === 'shiller') SHILLER = value;
+  else if (name === 'cagr_triangle') CAGR_TRI = value;
+  else if (name.startsWith('decomp_')) DECOMP[name.slice(7)] = value;
+}}
+
+const chunkRequests = {{}};
+function loadChunk(name) {{
+  const c = LAZY.chunks[name];
+  if (!c) return Promise.resolve();   // 构建时没有这份数据（如缺 shiller_complete.json）
+  if (!chunkRequests[name]) {{
+    const gz = c.gzip && typeof DecompressionStream !== 'undefined';
+    chunkRequests[name] = fetch(LAZY.base + (gz ? c.gzip : c.file))
+      .then(resp => {{
+        if (!resp.ok) throw new Error(`${{name}}: HTTP ${{resp.status}}`);
+        return gz ? new Response(resp.body.pipeThrough(new DecompressionStream('gzip'))).json() : resp.json();
+      }})
+      .then(value => applyChunk(name, value));
+  }}
+  return chunkRequests[name];
+}}
+
+const NEAR_MARGIN = '50% 0px';    // 进入视口上下半屏内即构造
+const FAR_MARGIN = '300% 0px';    // 离开视口上下三屏外才销毁，来回滚动不反复重建
+
+function startSections() {{
+  const bySection = {{}};
+  SECTION_INITS.forEach(s => (bySection[s.id] = bySection[s.id] || []).push(s));
+  const templates = {{}};
+  const generation = {{}};    // 每次构造 / 销毁 +1，丢弃过期的数据块回调
+  const active = {{}};
+
+  function build(id) {{
+    const inits = bySection[id];
+    const gen = generation[id] = (generation[id] || 0) + 1;
+    active[id] = true;
+    const needed = LAZY ? [...new Set(inits.flatMap(s => s.chunks))] : [];
+    Promise.all(needed.map(loadChunk))
+      .then(() => {{ if (generation[id] === gen) inits.forEach(s => s.init()); }})
+      .catch(err => console.error('数据块加载失败', err));
+  }}
+
+  function teardown(id) {{
+    generation[id] = (generation[id] || 0) + 1;
+    active[id] = false;
+    const charts = sectionCharts[id];
+    if (!charts || !charts.size) return;    // 没有 Chart（如热力图）就保留原样
+    const el = document.getElementById(id);
+    el.style.minHeight = el.offsetHeight + 'px';
+    [...charts].forEach(c => c.destroy());
+    el.innerHTML = templates[id];
+  }}
+
+  const lazyIds = [];
+  Object.keys(bySection).forEach(id => {{
+    if (bySection[id].some(s => s.charts)) lazyIds.push(id);
+    else if (LAZY) lazyIds.push(id);              // 纯 DOM 段也要等数据块，但不销毁
+    else bySection[id].forEach(s => s.init());
+  }});
+
+  const near = new IntersectionObserver(entries => {{
+    entries.forEach(entry => {{
+      const id = entry.target.id;
+      if (entry.isIntersecting && !active[id]) build(id);
+    }});
+  }}, {{ rootMargin: NEAR_MARGIN }});
+  const far = new IntersectionObserver(entries => {{
+    entries.forEach(entry => {{
+      const id = entry.target.id;
+      if (!entry.isIntersecting && active[id] && bySection[id].some(s => s.charts)) teardown(id);
+    }});
+  }}, {{ rootMargin: FAR_MARGIN }});
+  lazyIds.forEach(id => {{
+    const el = document.getElementById(id);
+    templates[id] = el.innerHTML;
+    near.observe(el);
+    far.observe(el);
+  }});
+}}
+
 // ============================================================
 // SIDEBAR: Active link tracking
 // ============================================================
@@ -643,7 +840,7 @@ Chart.defaults.font.family = "-apple-system, BlinkMacSystemFont, 'Segoe UI', 'Pi
 // ============================================================
 // CHART 1: Annual Returns
 // ============================================================
-(function() {{
+onSection('s1', ['analysis'], function() {{
   const ctx = document.getElementById('annualChart').getContext('2d');
   const years = DATA.yearly_table.map(d => d.year);
   const returns = DATA.yearly_table.map(d => d.real);
@@ -671,12 +868,12 @@ Chart.defaults.font.family = "-apple-system, BlinkMacSystemFont, 'Segoe UI', 'Pi
       }}
     }}
   }});
-}})();
+}});
 
 // ============================================================
 // CHART 2: Funnel
 // ============================================================
-(function() {{
+onSection('s2', ['analysis'], function() {{
   const container = document.getElementById('funnelContainer');
   const windows = [1, 3, 5, 10, 15, 20, 30];
   const rangeData = DATA.range_by_window;
@@ -699,7 +896,7 @@ Chart.defaults.font.family = "-apple-system, BlinkMacSystemFont, 'Segoe UI', 'Pi
   }});
   html += '</div><div style="text-align:center;margin-top:6px;font-size:0.75rem;color:#4a5568">黄色圆点 = 均值 · 柱高 = 波动范围</div>';
   container.innerHTML = html;
-}})();
+}}, {{ charts: false }});
 
 // ============================================================
 // CHART 3: Rolling CAGR
@@ -708,7 +905,8 @@ let rollingChart = null;
 let activeWindow = 10;
 const rollingWindows = [1, 3, 5, 10, 15, 20, 30];
 
-(function() {{
+onSection('s3', ['analysis'], function() {{
+  rollingChart = null;    // 重建 section 时旧实例已随 section 销毁
   const container = document.getElementById('rollingTabs');
   rollingWindows.forEach(w => {{
     const btn = document.createElement('button');
@@ -723,7 +921,7 @@ const rollingWindows = [1, 3, 5, 10, 15, 20, 30];
     container.appendChild(btn);
   }});
   updateRollingChart();
-}})();
+}});
 
 function updateRollingChart() {{
   const ctx = document.getElementById('rollingChart').getContext('2d');
@@ -760,7 +958,7 @@ function updateRollingChart() {{
 // ============================================================
 // CHART 4: Hold to 2024
 // ============================================================
-(function() {{
+onSection('s4', ['analysis'], function() {{
   const ctx = document.getElementById('holdChart').getContext('2d');
   const d = DATA.hold_to_end;
   new Chart(ctx, {{
@@ -788,12 +986,97 @@ function updateRollingChart() {{
       }}
     }}
   }});
-}})();
+}});
+
+// ============================================================
+// CHART 4B: (start, end) CAGR heatmap — O(1) lookup in the precomputed triangle
+// ============================================================
+onSection('s4b', ['cagr_triangle'], function() {{
+  const box = document.getElementById('heatmapBox');
+  if (!CAGR_TRI) {{
+    box.innerHTML = '<div class="desc">未找到 sp500_cagr_triangle.bin，请先运行 build_analysis.py</div>';
+    return;
+  }}
+  const meta = CAGR_TRI.meta;
+  const n = meta.n, years = meta.years;
+  const raw = Uint8Array.from(atob(CAGR_TRI.b64), c => c.charCodeAt(0));
+  const all = new Float32Array(raw.buffer);
+  const blocks = {{}};
+  meta.blocks.forEach((name, k) => {{ blocks[name] = all.subarray(k * meta.block_size, (k + 1) * meta.block_size); }});
+  // row i = start index, j = i..n-1 = end index (inclusive)
+  const offset = (i, j) => i * (2 * n - i + 1) / 2 + (j - i);
+  const canvas = document.getElementById('cagrHeatmap');
+  const tip = document.getElementById('heatmapTip');
+  const pad = {{ left: 44, right: 12, top: 10, bottom: 28 }};
+  let active = 'real';
+
+  function color(v) {{
+    const t = Math.max(-1, Math.min(1, v / 15));
+    return t >= 0 ? `rgba(52,211,153,${{0.12 + 0.88 * t}})` : `rgba(248,113,113,${{0.12 - 0.88 * t}})`;
+  }}
+
+  function cellSize(w, h) {{
+    return {{ cw: (w - pad.left - pad.right) / n, ch: (h - pad.top - pad.bottom) / n }};
+  }}
+
+  function draw() {{
+    const w = box.clientWidth, h = box.clientHeight, dpr = window.devicePixelRatio || 1;
+    canvas.width = w * dpr; canvas.height = h * dpr;
+    canvas.style.width = w + 'px'; canvas.style.height = h + 'px';
+    const ctx = canvas.getContext('2d');
+    ctx.setTransform(dpr, 0, 0, dpr, 0, 0);
+    ctx.clearRect(0, 0, w, h);
+    const {{ cw, ch }} = cellSize(w, h);
+    const data = blocks[active];
+    for (let i = 0; i < n; i++) {{
+      for (let j = i; j < n; j++) {{
+        ctx.fillStyle = color(data[offset(i, j)]);
+        ctx.fillRect(pad.left + j * cw, pad.top + i * ch, Math.ceil(cw), Math.ceil(ch));
+      }}
+    }}
+    ctx.fillStyle = '#6b7a8d';
+    ctx.font = '10px sans-serif';
+    ctx.textAlign = 'center';
+    for (let j = 0; j < n; j += 10) ctx.fillText(years[j], pad.left + (j + 0.5) * cw, h - 10);
+    ctx.textAlign = 'right';
+    for (let i = 0; i < n; i += 10) ctx.fillText(years[i], pad.left - 6, pad.top + (i + 0.5) * ch + 3);
+  }}
+
+  canvas.addEventListener('mousemove', e => {{
+    const rect = canvas.getBoundingClientRect();
+    const {{ cw, ch }} = cellSize(rect.width, rect.height);
+    const j = Math.floor((e.clientX - rect.left - pad.left) / cw);
+    const i = Math.floor((e.clientY - rect.top - pad.top) / ch);
+    if (i < 0 || j >= n || j < i) {{ tip.style.display = 'none'; return; }}
+    const v = blocks[active][offset(i, j)];
+    tip.innerHTML = `${{years[i]}} → ${{years[j]}}（持有${{j - i + 1}}年）<br>${{active === 'real' ? '实际' : '名义'}}年化: ${{v > 0 ? '+' : ''}}${{v.toFixed(2)}}%`;
+    tip.style.display = 'block';
+    tip.style.left = (e.clientX - rect.left + 12) + 'px';
+    tip.style.top = (e.clientY - rect.top + 12) + 'px';
+  }});
+  canvas.addEventListener('mouseleave', () => {{ tip.style.display = 'none'; }});
+
+  const tabs = document.getElementById('heatmapTabs');
+  [['real', '实际'], ['nominal', '名义']].forEach(([key, label]) => {{
+    const btn = document.createElement('button');
+    btn.className = 'tab-btn' + (key === active ? ' active' : '');
+    btn.textContent = label;
+    btn.onclick = () => {{
+      active = key;
+      tabs.querySelectorAll('.tab-btn').forEach(b => b.classList.remove('active'));
+      btn.classList.add('active');
+      draw();
+    }};
+    tabs.appendChild(btn);
+  }});
+  window.addEventListener('resize', draw);
+  draw();
+}});
 
 // ============================================================
 // CHART 5: Cumulative (Log)
 // ============================================================
-(function() {{
+onSection('s5', ['analysis'], function() {{
   const ctx = document.getElementById('cumulativeChart').getContext('2d');
   new Chart(ctx, {{
     type: 'line',
@@ -817,12 +1100,12 @@ function updateRollingChart() {{
       }}
     }}
   }});
-}})();
+}});
 
 // ============================================================
 // CHART 6: Sector Evolution
 // ============================================================
-(function() {{
+onSection('s6', [], function() {{
   const ctx = document.getElementById('sectorChart').getContext('2d');
   const years = [1960,1965,1970,1975,1980,1985,1990,1995,2000,2005,2008,2010,2015,2020,2024];
   const sectors = {{
@@ -846,12 +1129,12 @@ function updateRollingChart() {{
       }}
     }}
   }});
-}})();
+}});
 
 // ============================================================
 // Top 10 Comparison
 // ============================================================
-(function() {{
+onSection('s8', [], function() {{
   const top2000 = [
     {{ name: 'General Electric', weight: 4.0, fate: '2024年拆分为3家', fateColor: '#fbbf24' }},
     {{ name: 'Exxon Mobil', weight: 3.0, fate: '仍在，权重~1.3%', fateColor: '#60a5fa' }},
@@ -886,12 +1169,12 @@ function updateRollingChart() {{
   top2024.forEach((c, i) => {{ h += `<tr><td style="text-align:left;font-size:0.82rem"><span style="color:#4a5568">${{i+1}}.</span> ${{c.name}}</td><td style="font-size:0.82rem;color:#34d399">${{c.weight}}%</td><td style="text-align:left;font-size:0.78rem;color:#6b7a8d">${{c.since}}</td></tr>`; }});
   h += '</tbody></table>';
   document.getElementById('top10_2024').innerHTML = h;
-}})();
+}}, {{ charts: false }});
 
 // ============================================================
 // Timeline
 // ============================================================
-(function() {{
+onSection('s7', [], function() {{
   const events = [
     {{ year:'1957', title:'S&P 500 创立', desc:'500家公司，工业/能源/公用事业为主', color:'#60a5fa' }},
     {{ year:'1976', title:'史上最大换血：60家替换', desc:'40家金融公司加入（Wells Fargo, Chase, BofA）', color:'#fbbf24' }},
@@ -911,12 +1194,12 @@ function updateRollingChart() {{
   }});
   html += '</div>';
   document.getElementById('turnoverTimeline').innerHTML = html;
-}})();
+}}, {{ charts: false }});
 
 // ============================================================
 // CHART 9: Annual Turnover Rate
 // ============================================================
-(function() {{
+onSection('s9', ['turnover'], function() {{
   const ctx = document.getElementById('turnoverChart').getContext('2d');
   new Chart(ctx, {{
     type: 'bar',
@@ -945,12 +1228,12 @@ function updateRollingChart() {{
       }}
     }}
   }});
-}})();
+}});
 
 // ============================================================
 // CHART 10: Duration Distribution
 // ============================================================
-(function() {{
+onSection('s10', ['duration'], function() {{
   const ctx = document.getElementById('durationChart').getContext('2d');
   new Chart(ctx, {{
     type: 'bar',
@@ -973,12 +1256,12 @@ function updateRollingChart() {{
       }}
     }}
   }});
-}})();
+}});
 
 // ============================================================
 // CHART 11: Current Sector Distribution (Doughnut)
 // ============================================================
-(function() {{
+onSection('s11', [], function() {{
   const ctx = document.getElementById('sectorPieChart').getContext('2d');
   const sectorData = [
     {{ name: 'Industrials', count: 80, color: '#fbbf24' }},
@@ -1007,19 +1290,19 @@ function updateRollingChart() {{
       }}
     }}
   }});
-}})();
+}});
 
 // ============================================================
 // Data Table
 // ============================================================
-(function() {{
+onSection('data', ['analysis'], function() {{
   const tbody = document.querySelector('#dataTable tbody');
   [...DATA.yearly_table].reverse().forEach(d => {{
     const tr = document.createElement('tr');
     tr.innerHTML = `<td>${{d.year}}</td><td class="${{d.nominal >= 0 ? 'pos' : 'neg'}}">${{d.nominal > 0 ? '+' : ''}}${{d.nominal.toFixed(2)}}%</td><td>${{d.inflation.toFixed(2)}}%</td><td class="${{d.real >= 0 ? 'pos' : 'neg'}}">${{d.real > 0 ? '+' : ''}}${{d.real.toFixed(2)}}%</td>`;
     tbody.appendChild(tr);
   }});
-}})();
+}}, {{ charts: false }});
 
 // ============================================================
 // DECOMPOSITION CHARTS (Part IV - 3-Level Analysis)
@@ -1028,7 +1311,7 @@ if (DECOMP) {{
 
 // CHART D1: Annual Return Decomposition (Stacked Bar)
 // Cap extreme values at ±100% for readability (earnings rebound years like 2003, 2009)
-(function() {{
+onSection('decomp1', ['decomp_aggregate'], function() {{
   const agg = DECOMP.aggregate;
   const CAP = 100;
   const cap = v => v == null ? 0 : Math.max(-CAP, Math.min(CAP, +(v * 100).toFixed(2)));
@@ -1036,7 +1319,7 @@ if (DECOMP) {{
   const rawEG = agg.map(d => raw(d.earnings_growth));
   const rawPE = agg.map(d => raw(d.pe_expansion));
   const ctx = document.getElementById('chartDecomp1').getContext('2d');
-  const chart = new Chart(ctx, {{
+  new Chart(ctx, {{
     type: 'bar',
     data: {{
       labels: agg.map(d => d.year),
@@ -1099,15 +1382,10 @@ if (DECOMP) {{
       }}
     }}
   }});
-  // Force all datasets visible (workaround for Chart.js off-screen init issue)
-  for (let i = 0; i < chart.data.datasets.length; i++) {{
-    chart.getDatasetMeta(i).hidden = null;
-  }}
-  chart.update('none');
-}})();
+}});
 
 // CHART D2a: Rolling Window Total Return (Line)
-(function() {{
+onSection('decomp2', ['decomp_rolling'], function() {{
   const r5 = DECOMP.rolling['5'] || [];
   const r10 = DECOMP.rolling['10'] || [];
   const r20 = DECOMP.rolling['20'] || [];
@@ -1135,10 +1413,10 @@ if (DECOMP) {{
       }}
     }}
   }});
-}})();
+}});
 
 // CHART D2b: Mean Reversion - Std Dev convergence (Bar)
-(function() {{
+onSection('decomp2', ['decomp_mean_reversion'], function() {{
   const mr = DECOMP.mean_reversion;
   const windows = ['5', '10', '20'];
   const ctx = document.getElementById('chartDecomp2b').getContext('2d');
@@ -1187,10 +1465,10 @@ if (DECOMP) {{
       <div style="font-size:0.78rem;color:#4a5568;margin-top:4px">Range: ${{s.min.toFixed(1)}}% ~ ${{s.max.toFixed(1)}}%</div>
     </div>`;
   }});
-}})();
+}});
 
 // CHART D2c: Return Decomposition by Holding Period (Stacked Bar)
-(function() {{
+onSection('decomp2', ['decomp_rolling', 'decomp_aggregate'], function() {{
   const rolling = DECOMP.rolling;
   // Compute average decomposition for each window
   function avg(arr, key) {{
@@ -1262,10 +1540,10 @@ if (DECOMP) {{
       }}
     }}
   }});
-}})();
+}});
 
 // CHART SHILLER20: 153-year 20yr rolling decomposition (Stacked Bar + Line)
-(function() {{
+onSection('shiller20', ['shiller'], function() {{
   if (!SHILLER || !SHILLER.rolling || !SHILLER.rolling['20']) return;
   const r20 = SHILLER.rolling['20'];
   const years = r20.map(d => d.end_year);
@@ -1276,7 +1554,7 @@ if (DECOMP) {{
   const pe = total.map((t, i) => +(t - eps[i] - div[i]).toFixed(2));
 
   const ctx = document.getElementById('chartShiller20').getContext('2d');
-  const chart = new Chart(ctx, {{
+  new Chart(ctx, {{
     type: 'bar',
     data: {{
       labels: years,
@@ -1414,15 +1692,10 @@ if (DECOMP) {{
       }}
     }}
   }});
-  // Force visibility workaround
-  for (let i = 0; i < chart.data.datasets.length; i++) {{
-    chart.getDatasetMeta(i).hidden = null;
-  }}
-  chart.update('none');
-}})();
+}});
 
 // CHART SHILLER-LOG: Cumulative growth on log scale with linear fits
-(function() {{
+onSection('shillerLog', ['shiller'], function() {{
   if (!SHILLER || !SHILLER.annual || !SHILLER.decomposition) return;
   const annual = SHILLER.annual;
   const decomp = SHILLER.decomposition;
@@ -1483,7 +1756,7 @@ if (DECOMP) {{
   const fitTotalLine = fitLine(fitTotal, years);
 
   const ctx = document.getElementById('chartShillerLog').getContext('2d');
-  const chart = new Chart(ctx, {{
+  new Chart(ctx, {{
     type: 'line',
     data: {{
       labels: years,
@@ -1535,10 +1808,6 @@ if (DECOMP) {{
       }}
     }}
   }});
-  for (let i = 0; i < chart.data.datasets.length; i++) {{
-    chart.getDatasetMeta(i).hidden = null;
-  }}
-  chart.update('none');
 
   // Stats cards
   const container = document.getElementById('shillerLogStats');
@@ -1555,10 +1824,10 @@ if (DECOMP) {{
       <div style="font-size:0.78rem;color:#4a5568;margin-top:4px">${{it.mult.toFixed(0)}}x in 153yr</div>
     </div>`;
   }});
-}})();
+}});
 
 // CHART SECTOR-DECOMP: Cumulative growth on log scale (switchable by sector)
-(function() {{
+onSection('sectorDecomp', ['decomp_aggregate', 'decomp_sectors'], function() {{
   if (!DECOMP) return;
   const agg = DECOMP.aggregate;
   const sectors = DECOMP.sectors;
@@ -1834,10 +2103,10 @@ if (DECOMP) {{
 
   select.addEventListener('change', () => renderSector(select.value));
   renderSector('ALL');
-}})();
+}});
 
 // CHART D3: Industry Contribution (Horizontal Bar, switchable by year)
-(function() {{
+onSection('decomp3', ['decomp_sectors'], function() {{
   const sectors = DECOMP.sectors;
   const select = document.getElementById('decompYearSelect');
   const years = [...new Set(sectors.map(s => s.year))].sort();
@@ -1884,10 +2153,10 @@ if (DECOMP) {{
 
   select.addEventListener('change', () => renderYear(+select.value));
   renderYear(2024);
-}})();
+}});
 
 // Verification Table
-(function() {{
+onSection('decomp4', ['decomp_verification'], function() {{
   const vdata = DECOMP.verification;
   const tbody = document.querySelector('#verifyTable tbody');
   vdata.forEach(v => {{
@@ -1911,17 +2180,24 @@ if (DECOMP) {{
   const ok = maxNi < 1 && maxMc < 1;
   el.innerHTML = `<span style="color:${{ok ? '#34d399' : '#f87171'}};font-weight:600">${{ok ? '✓ Verification Passed' : '✗ Check Required'}}</span>
     &nbsp;—&nbsp; Max earnings diff: $${{maxNi.toFixed(1)}}M, Max market cap diff: $${{maxMc.toFixed(1)}}M`;
-}})();
+}}, {{ charts: false }});
 
 }} // end if (DECOMP)
 
+startSections();
+
 </script>
 </body>
 </html>"""
 
-output_path = os.path.join(os.path.dirname(__file__), '..', 'report', 'sp500_mean_reversion.html')
-with open(output_path, 'w') as f:
-    f.write(html)
+with profiling.stage("写 HTML"):
+    output_path = os.path.join(REPORT_DIR, 'sp500_mean_reversion.html')
+    with open(output_path, 'w') as f:
+        f.write(html)
 print(f"Report written to: {output_path}")
 
 print(f"✅ 文件已生成: {len(html):,} bytes")
+if args.lazy:
+    total = sum(c['bytes'] for c in chunk_index.values())
+    packed = sum(c['gzip_bytes'] for c in chunk_index.values())
+    print(f"   数据块: {len(chunk_index)} 个，{total:,} bytes（gzip {packed:,} bytes）→ {CHUNK_DIR_NAME}/")
@@ -0,0 +1,73 @@
+"""
+滚动年化收益引擎：累计对数增长（前缀和）
+
+对 n 期收益率（百分比）预先算 L[k] = Σ_{t<k} log(1 + r_t)，
+任意区间 [i, j)（第 i 期到第 j-1 期）的年化收益只需一次相减：
+    CAGR(i, j) = exp((L[j] - L[i]) / (j - i) × 每年期数) - 1
+所有窗口、持有到期末序列都是整列向量运算，O(n) 而不是 O(n·w) / O(n²)。
+年度数据 periods_per_year = 1；月度 Shiller / CRSP 指数用 12。
+收益率也可以是二维 (路径数, n) 的批量序列（自助法模拟），前缀和沿最后一轴，
+cagr / rolling / hold_to_end 对每条路径同时计算。
+
+cagr_triangle 给出全部 (起, 止) 区间的上三角表（float32，按行压缩）：
+第 i 行为起点 i、终点 j = i..n-1（含两端，共 j-i+1 期），
+元素偏移 = triangle_offset(i, j, n) = i·(2n-i+1)/2 + (j-i)，总长 n·(n+1)/2。
+"""
+import numpy as np
+
+
+class CumulativeGrowth:
+    def __init__(self, returns_pct, periods_per_year=1):
+        r = np.asarray(returns_pct, dtype=np.float64) / 100
+        self.n = r.shape[-1]
+        self.periods_per_year = periods_per_year
+        self.log_growth = np.concatenate([np.zeros(r.shape[:-1] + (1,)), np.cumsum(np.log1p(r), axis=-1)],
+                                         axis=-1)
+
+    def cagr(self, start, end):
+        """区间 [start, end) 的年化收益（%）；start / end 可以是下标数组"""
+        start = np.asarray(start)
+        end = np.asarray(end)
+        periods = end - start
+        return np.expm1((self.log_growth[..., end] - self.log_growth[..., start]) / periods
+                        * self.periods_per_year) * 100
+
+    def growth(self, start, end):
+        """区间 [start, end) 的累计增长倍数"""
+        return np.exp(self.log_growth[..., np.asarray(end)] - self.log_growth[..., np.asarray(start)])
+
+    def rolling(self, window):
+        """所有长度为 window 的区间 [k, k + window)，k = 0..n-window 的年化收益（%）"""
+        if window > self.n:
+            return np.zeros(self.log_growth.shape[:-1] + (0,))
+        start = np.arange(self.n - window + 1)
+        return self.cagr(start, start + window)
+
+    def hold_to_end(self):
+        """从第 i 期持有到最后一期的年化收益（%），i = 0..n-1"""
+        start = np.arange(self.n)
+        return self.cagr(start, np.full(self.n, self.n))
+
+    def cagr_triangle(self):
+        """全部 (起, 止) 区间的年化收益（%），上三角按行压缩的 float32 数组"""
+        start, end = np.triu_indices(self.n)
+        return self.cagr(start, end + 1).astype(np.float32)
+
+
+def triangle_offset(i, j, n):
+    """上三角压缩布局中 (起点 i, 终点 j) 的偏移，i <= j"""
+    return i * (2 * n - i + 1) // 2 + (j - i)
+
+
+def range_stats(values):
+    """min / max / mean / 中位数（取排序后第 len//2 个）/ 样本数"""
+    v = np.sort(np.asarray(values, dtype=np.float64))
+    if len(v) == 0:
+        return None
+    return {
+        "min": float(v[0]),
+        "max": float(v[-1]),
+        "mean": float(v.sum() / len(v)),
+        "median": float(v[len(v) // 2]),
+        "count": int(len(v)),
+    }
@@ -0,0 +1,158 @@
+"""
+共享内存进程池：解析好的 CRSP / Compustat 列只放一份，工作进程零拷贝挂载
+
+ProcessPoolExecutor 直接传 NumPy 数组时，每个任务都要 pickle 一份数据给工作进程，
+内存随进程数成倍增长。SharedArrayPool 在开池前把列放进一块 multiprocessing.shared_memory
+（每列按 64 字节对齐依次排列），只把很小的描述符 {名称: (偏移, dtype, shape)} 交给
+工作进程的 initializer；工作进程挂载一次，任务函数用 shared_arrays.arrays() 取只读视图。
+np.memmap 列（面板存储、列式缓存）本身已经由操作系统页缓存共享，不再复制，描述符里
+只记文件路径和偏移，工作进程自己重新 memmap。
+
+    with SharedArrayPool({'ret': ret, 'date': date}, workers=4) as pool:
+        for part in pool.map(_summarize, [(0, 1000), (1000, 2000)]):
+            ...
+
+    def _summarize(start, end):
+        cols = shared_arrays.arrays()
+        ...
+
+workers <= 1 时不建共享内存也不开进程，任务在当前进程里直接对原数组运行，结果与多进程一致。
+退出 with 时关闭进程池并释放（unlink）共享内存段。
+"""
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+ALIGN = 64
+
+# 当前进程可见的列：主进程 inline 运行时是原数组，工作进程里是共享内存 / memmap 视图
+_arrays = None
+_segment = None
+
+
+def arrays():
+    """任务函数里取共享列 {名称: 只读 ndarray}"""
+    if _arrays is None:
+        raise RuntimeError("shared_arrays.arrays() 只能在 SharedArrayPool 的任务里调用")
+    return _arrays
+
+
+def _memmap_source(a):
+    """np.memmap 或其连续切片 / 视图 → (文件路径, 字节偏移)；不是文件映射时返回 None"""
+    # 切片也是 np.memmap，但 offset 沿用原映射的值；沿 base 链找到最初创建的那个 memmap
+    root, node = None, a
+    while isinstance(node, np.ndarray):
+        if isinstance(node, np.memmap):
+            root = node
+        node = node.base
+    if root is None or getattr(root, 'filename', None) is None or not a.flags.c_contiguous:
+        return None
+    delta = a.__array_interface__['data'][0] - root.__array_interface__['data'][0]
+    return root.filename, root.offset + delta
+
+
+def _attach(descriptor):
+    """按描述符挂载 → ({名称: 只读视图}, SharedMemory 或 None)"""
+    segment = None
+    if descriptor['segment'] is not None:
+        try:
+            segment = shared_memory.SharedMemory(name=descriptor['segment'], track=False)
+        except TypeError:   # Python < 3.13 没有 track 参数；fork / spawn 的子进程共用父进程的 resource tracker
+            segment = shared_memory.SharedMemory(name=descriptor['segment'])
+    views = {}
+    for name, (kind, where, offset, dtype, shape) in descriptor['arrays'].items():
+        dtype = np.dtype(dtype)
+        if int(np.prod(shape)) == 0:   # 空列不占共享内存（全是空列时根本没有段）
+            view = np.empty(shape, dtype=dtype)
+        elif kind == 'shm':
+            view = np.ndarray(shape, dtype=dtype, buffer=segment.buf, offset=offset)
+        else:
+            view = np.memmap(where, dtype=dtype, mode='r', offset=offset, shape=shape)
+        view.flags.writeable = False
+        views[name] = view
+    return views, segment
+
+
+def _init_worker(descriptor):
+    global _arrays, _segment
+    _arrays, _segment = _attach(descriptor)
+
+
+def _call(func, args):
+    return func(*args)
+
+
+class SharedArrayPool:
+    """
+    arrays: {名称: ndarray}（一维或多维，任意 dtype，不能是 object）
+    workers: 进程数；<= 1 时在当前进程里直接运行
+    """
+
+    def __init__(self, arrays, workers=1):
+        self.workers = workers
+        self.segment = None
+        self.pool = None
+        self._arrays = {name: np.asarray(a) for name, a in arrays.items()}
+        for name, a in self._arrays.items():
+            if a.dtype.hasobject:
+                raise TypeError(f"列 {name} 是 object dtype，不能放进共享内存")
+
+    def __enter__(self):
+        global _arrays
+        if self.workers <= 1:
+            _arrays = self._arrays
+            return self
+        self.descriptor = self._share()
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                        initargs=(self.descriptor,))
+        return self
+
+    def __exit__(self, *exc):
+        global _arrays
+        _arrays = None
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        if self.segment is not None:
+            self.segment.close()
+            self.segment.unlink()
+            self.segment = None
+        return False
+
+    def _share(self):
+        """把非 memmap 列复制进一块共享内存，返回描述符"""
+        layout, size = {}, 0
+        for name, a in self._arrays.items():
+            source = _memmap_source(a)
+            if source is not None:
+                layout[name] = ('file', source[0], source[1], a.dtype.str, a.shape)
+                continue
+            size = -(-size // ALIGN) * ALIGN
+            layout[name] = ('shm', None, size, a.dtype.str, a.shape)
+            size += a.nbytes
+        if size:
+            self.segment = shared_memory.SharedMemory(create=True, size=size)
+            for name, (kind, _, offset, _, _) in layout.items():
+                if kind == 'shm':
+                    a = self._arrays[name]
+                    np.ndarray(a.shape, dtype=a.dtype, buffer=self.segment.buf, offset=offset)[...] = a
+        return {'segment': self.segment.name if self.segment else None, 'arrays': layout}
+
+    @property
+    def shared_bytes(self):
+        return self.segment.size if self.segment is not None else 0
+
+    def map(self, func, tasks):
+        """tasks: 参数元组的序列 → 按顺序返回 func(*args) 的结果列表；func 必须是模块级函数"""
+        tasks = list(tasks)
+        if self.pool is None:
+            return [func(*args) for args in tasks]
+        return list(self.pool.map(_call, [func] * len(tasks), tasks))
+
+
+def split_ranges(n, parts):
+    """[0, n) 切成最多 parts 段连续区间 → [(start, end), ...]"""
+    parts = max(1, min(parts, n))
+    bounds = np.linspace(0, n, parts + 1).astype(np.int64).tolist()
+    return [(s, e) for s, e in zip(bounds[:-1], bounds[1:]) if e > s]
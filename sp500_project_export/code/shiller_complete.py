@@ -12,10 +12,14 @@ Cross-validation:
   - Overlapping period: 1985-2024
 """
 
+import argparse
 import json
 import math
 import os
 
+import profiling
+from decomposition_store import STORE_DIR, exists, load_decomposition
+
 DATA = os.path.join(os.path.dirname(__file__), '..', 'data')
 
 # ============================================================
@@ -220,13 +224,12 @@ def cross_validate_compustat(shiller_decomp):
       - Compustat 'year: Y' = return from Dec(Y-1) → Dec(Y) = calendar year Y
       - So: Shiller year Y+1 ≈ Compustat year Y (both measure CY Y)
     """
-    decomp_path = os.path.join(DATA, 'sp500_3level_decomposition.json')
-    if not os.path.exists(decomp_path):
-        print(f"  [SKIP] Compustat file not found: {decomp_path}")
+    if not exists():
+        print(f"  [SKIP] Compustat decomposition not found: {STORE_DIR}")
         return None
 
-    with open(decomp_path) as f:
-        comp_data = json.load(f)
+    # Only the aggregate section is parsed (companies etc. stay on disk)
+    comp_data = load_decomposition(['aggregate'])
 
     comp_by_year = {r['year']: r for r in comp_data['aggregate']}
     shiller_by_year = {d['year']: d for d in shiller_decomp}
@@ -425,18 +428,24 @@ def main():
         diff_pct = (derived - known_eps) / known_eps * 100
         print(f"  {y}: derived={derived:.2f}  known={known_eps:.2f}  diff={diff_pct:+.1f}%")
 
-    decomp = compute_decomposition(records)
+    with profiling.stage("decomposition"):
+        decomp = compute_decomposition(records)
     print(f"\nAnnual decomposition: {len(decomp)} years")
 
-    rolling = rolling_decomposition(decomp, windows=[5, 10, 20, 30, 50])
+    with profiling.stage("rolling"):
+        rolling = rolling_decomposition(decomp, windows=[5, 10, 20, 30, 50])
 
     print_full_period_stats(decomp, rolling)
 
     # Cross-validate with Compustat
-    cross_validate_compustat(decomp)
+    with profiling.stage("cross-validate"):
+        cross_validate_compustat(decomp)
 
-    save_output(records, decomp, rolling)
+    with profiling.stage("save"):
+        save_output(records, decomp, rolling)
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Shiller annual decomposition + Compustat cross-validation")
+    profiling.configure(profiling.add_arguments(parser).parse_args())
     main()
@@ -5,17 +5,20 @@ S&P 500 公司级别分析：用真实 CRSP/Compustat 数据计算
 - 与 Shiller 指数级数据对比
 - 验证 EPS 低估假说
 """
-import csv
+import argparse
 import os
 import json
 from collections import defaultdict
 
+from ccm_links import load_link_index
+from data_cache import read_csv_rows, resident
+import profiling
+from sp500_membership import load_membership
+
 DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'crsp_compustat')
 
 def load_csv(filename):
-    path = os.path.join(DATA_DIR, filename)
-    with open(path, 'r') as f:
-        return list(csv.DictReader(f))
+    return read_csv_rows(os.path.join(DATA_DIR, filename))
 
 def safe_float(val):
     try:
@@ -23,48 +26,6 @@ def safe_float(val):
     except ValueError:
         return None
 
-def build_permno_to_gvkey(ccm_rows):
-    """构建 PERMNO → GVKEY 映射（优先使用 Primary link）"""
-    mapping = {}  # permno -> [(gvkey, link_start, link_end, priority)]
-    for r in ccm_rows:
-        permno = r['LPERMNO']
-        gvkey = r['gvkey']
-        linkdt = r['LINKDT']
-        linkenddt = r['LINKENDDT'] if r['LINKENDDT'] != 'E' else '2099-12-31'
-        # P (Primary) > C (Secondary) > J/N
-        priority = {'P': 0, 'C': 1, 'J': 2, 'N': 3}.get(r['LINKPRIM'], 4)
-        if permno not in mapping:
-            mapping[permno] = []
-        mapping[permno].append((gvkey, linkdt, linkenddt, priority))
-
-    # 对每个 permno，按优先级排序
-    for permno in mapping:
-        mapping[permno].sort(key=lambda x: x[3])
-
-    return mapping
-
-def get_gvkey_for_permno_year(mapping, permno, year):
-    """给定 PERMNO 和年份，返回最佳匹配的 GVKEY"""
-    if permno not in mapping:
-        return None
-    year_str = f"{year}-06-30"  # 用年中作为参考点
-    for gvkey, linkdt, linkenddt, priority in mapping[permno]:
-        if linkdt <= year_str and linkenddt >= year_str:
-            return gvkey
-    # 如果没有精确匹配，返回优先级最高的
-    return mapping[permno][0][0] if mapping[permno] else None
-
-def build_sp500_by_year(sp500_rows):
-    """构建每年 S&P 500 成分股列表"""
-    yearly = defaultdict(set)
-    for r in sp500_rows:
-        permno = r['permno']
-        start_year = int(r['start'][:4])
-        end_year = int(r['ending'][:4])
-        for year in range(max(start_year, 1950), min(end_year, 2024) + 1):
-            yearly[year].add(permno)
-    return yearly
-
 def build_compustat_lookup(compustat_rows):
     """构建 (gvkey, year) → 财务数据 的查找表"""
     lookup = {}
@@ -84,20 +45,23 @@ def build_compustat_lookup(compustat_rows):
 
 def analyze():
     print("加载数据...")
-    sp500_rows = load_csv('sp500_constituents.csv')
-    ccm_rows = load_csv('ccm_link_table.csv')
-    compustat_rows = load_csv('compustat_annual.csv')
+    with profiling.stage("加载数据"):
+        compustat_rows = load_csv('compustat_annual.csv')
 
     print("构建映射...")
-    permno_to_gvkey = build_permno_to_gvkey(ccm_rows)
-    sp500_by_year = build_sp500_by_year(sp500_rows)
-    compustat_lookup = build_compustat_lookup(compustat_rows)
+    with profiling.stage("构建映射"):
+        link_index = load_link_index(os.path.join(DATA_DIR, 'ccm_link_table.csv'))
+        membership = load_membership(os.path.join(DATA_DIR, 'sp500_constituents.csv'))
+        sp500_by_year = membership.by_year(1950, 2024)
+        # 常驻模式下查找表随 compustat_annual.csv 一起缓存
+        compustat_lookup = resident('company_compustat_lookup', os.path.join(DATA_DIR, 'compustat_annual.csv'),
+                                    lambda: build_compustat_lookup(compustat_rows))
 
     print("计算年度聚合...")
     results = []
 
     for year in range(1950, 2025):
-        permnos = sp500_by_year.get(year, set())
+        permnos = sp500_by_year.get(year, [])
         if not permnos:
             continue
 
@@ -113,8 +77,7 @@ def analyze():
         gics_earnings = defaultdict(float)  # GICS 行业 → 盈利合计
         gics_market_cap = defaultdict(float)
 
-        for permno in permnos:
-            gvkey = get_gvkey_for_permno_year(permno_to_gvkey, permno, year)
+        for gvkey in link_index.gvkeys_for_year(permnos, year):
             if not gvkey:
                 continue
 
@@ -267,4 +230,6 @@ def analyze():
     print(f"  结果已保存到: sp500_company_analysis.json")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="S&P 500 公司级别聚合分析")
+    profiling.configure(profiling.add_arguments(parser).parse_args())
     analyze()
@@ -11,13 +11,31 @@ S&P 500 三层回报分解与均值回归验证
 数据来源：Compustat 年度财务 + CCM Link + S&P 500 成分股
 分析区间：1985-2024 (GICS 覆盖 >93%)
 """
-import csv
-import os
+import argparse
 import json
+import os
+import shutil
 from collections import defaultdict
 
+import numpy as np
+
+import ccm_links
+from ccm_links import load_link_index
+import compustat_cache
+from compustat_cache import fiscal_year, load_compustat
+from data_cache import (appended_to, cache_dir_for, read_csv_rows, read_manifest, replace_dir,
+                        write_manifest)
+from decomposition_store import write_decomposition
+from group_kernel import group_by
+import profiling
+import shared_arrays
+from shared_arrays import SharedArrayPool
+import sp500_membership
+from sp500_membership import load_membership
+
 DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'crsp_compustat')
 OUTPUT_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+STORE_DIR = os.path.join(OUTPUT_DIR, 'sp500_3level_decomposition')
 
 GICS_SECTORS = {
     '10': 'Energy', '15': 'Materials', '20': 'Industrials',
@@ -26,172 +44,168 @@ GICS_SECTORS = {
     '55': 'Utilities', '60': 'Real Estate',
 }
 
+GICS_CODES = [int(code) for code in GICS_SECTORS]
+
 START_YEAR = 1985
 END_YEAR = 2024
 
 # ── 数据加载工具 ──────────────────────────────────────────
 
-def safe_float(val):
-    try:
-        return float(val) if val and val.strip() else None
-    except ValueError:
-        return None
-
 def load_csv(filename):
-    with open(os.path.join(DATA_DIR, filename), 'r') as f:
-        return list(csv.DictReader(f))
-
-def build_permno_to_gvkey(ccm_rows):
-    mapping = {}
-    for r in ccm_rows:
-        permno = r['LPERMNO']
-        gvkey = r['gvkey']
-        linkdt = r['LINKDT']
-        linkenddt = r['LINKENDDT'] if r['LINKENDDT'] != 'E' else '2099-12-31'
-        priority = {'P': 0, 'C': 1, 'J': 2, 'N': 3}.get(r['LINKPRIM'], 4)
-        if permno not in mapping:
-            mapping[permno] = []
-        mapping[permno].append((gvkey, linkdt, linkenddt, priority))
-    for permno in mapping:
-        mapping[permno].sort(key=lambda x: x[3])
-    return mapping
-
-def get_gvkey(mapping, permno, year):
-    if permno not in mapping:
-        return None
-    year_str = f"{year}-06-30"
-    for gvkey, linkdt, linkenddt, _ in mapping[permno]:
-        if linkdt <= year_str and linkenddt >= year_str:
-            return gvkey
-    return mapping[permno][0][0] if mapping[permno] else None
-
-def build_sp500_by_year(sp500_rows):
-    yearly = defaultdict(set)
-    for r in sp500_rows:
-        permno = r['permno']
-        s = int(r['start'][:4])
-        e = int(r['ending'][:4])
-        for year in range(max(s, START_YEAR - 1), min(e, END_YEAR) + 1):
-            yearly[year].add(permno)
-    return yearly
-
-def build_compustat_lookup(rows):
-    lookup = {}
-    for r in rows:
-        gvkey = r['gvkey']
-        if not r['datadate']:
-            continue
-        year = int(r['datadate'][:4])
-        month = int(r['datadate'][5:7])
-        fy = year if month >= 6 else year - 1
-        key = (gvkey, fy)
-        if key not in lookup or r['datadate'] > lookup[key]['datadate']:
-            lookup[key] = r
-    return lookup
+    return read_csv_rows(os.path.join(DATA_DIR, filename))
 
 # ── Level 3: 公司级别记录 ────────────────────────────────
 
-def build_company_records(sp500_by_year, permno_to_gvkey, compustat_lookup, gvkey_to_name):
+RECORD_FIELDS = ('year', 'permno', 'gvkey', 'name', 'sector', 'sector_name',
+                 'ni', 'ni_prior', 'mktcap', 'mktcap_prior', 'total_div',
+                 'price_return', 'dividend_yield', 'pe', 'pe_prior')
+
+class CompanyTable:
+    """
+    公司级别记录的列式表（struct-of-arrays）
+    数值列为 float64，NaN 表示缺失；year 为 int32，sector_code 为 int16（'XX' = -1）；
+    permno/gvkey/name/sector/sector_name 为字符串列表
+    迭代 / row(i) 得到与原 list-of-dict 相同的行字典（NaN → None），供逐行代码使用
+    """
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns['year'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def row(self, i):
+        return {f: self._value(f, i) for f in RECORD_FIELDS}
+
+    def _value(self, field, i):
+        v = self.columns[field][i]
+        if isinstance(v, np.floating):
+            return float(v) if v == v else None
+        return int(v) if isinstance(v, np.integer) else v
+
+    def __iter__(self):
+        cols = [self.columns[f] for f in RECORD_FIELDS]
+        cols = [c.tolist() if isinstance(c, np.ndarray) else c for c in cols]
+        for values in zip(*cols):
+            yield {f: (None if v != v else v) for f, v in zip(RECORD_FIELDS, values)}
+
+def build_company_records(sp500_by_year, link_index, compustat, gvkey_to_name, years=None):
+    """
+    compustat: compustat_cache.CompustatAnnual 列式表
+    years: 只构建这些年（增量更新用，升序）；None = START_YEAR..END_YEAR
+    每年一次向量化：成分股 → GVKEY（链接索引）→ 当年 / 上年 Compustat 行号，再整列 gather 计算
+    """
     print("构建公司级别记录 (Level 3)...")
-    records = []
+    link_to_cs = compustat.gvkey_ids(link_index.gvkeys)   # 链接索引的 gvkey id → Compustat gvkey id
+    year_parts, permnos, gvkeys, curr_parts, prior_parts = [], [], [], [], []
 
-    for year in range(START_YEAR, END_YEAR + 1):
-        permnos = sp500_by_year.get(year, set())
-        for permno in permnos:
-            gvkey = get_gvkey(permno_to_gvkey, permno, year)
-            if not gvkey:
-                continue
-            curr = compustat_lookup.get((gvkey, year))
-            if not curr:
-                continue
-            prior = compustat_lookup.get((gvkey, year - 1))
-
-            ni = safe_float(curr['ni'])
-            csho = safe_float(curr['csho'])
-            prcc_f = safe_float(curr['prcc_f'])
-            epspx = safe_float(curr['epspx'])
-            dvpsx_f = safe_float(curr['dvpsx_f'])
-            gind = curr.get('gind', '').strip()
-            sector = gind[:2] if gind and len(gind) >= 2 and gind[:2] in GICS_SECTORS else 'XX'
-
-            ni_prior = safe_float(prior['ni']) if prior else None
-            csho_prior = safe_float(prior['csho']) if prior else None
-            prcc_f_prior = safe_float(prior['prcc_f']) if prior else None
-            epspx_prior = safe_float(prior['epspx']) if prior else None
-
-            mktcap = csho * prcc_f if csho and prcc_f and prcc_f > 0 else None
-            mktcap_prior = csho_prior * prcc_f_prior if csho_prior and prcc_f_prior and prcc_f_prior > 0 else None
-
-            price_ret = (prcc_f / prcc_f_prior - 1) if prcc_f and prcc_f_prior and prcc_f_prior > 0 else None
-
-            div_yield = None
-            total_div = None
-            if dvpsx_f is not None and csho is not None:
-                total_div = dvpsx_f * csho
-                if mktcap_prior and mktcap_prior > 0:
-                    div_yield = total_div / mktcap_prior
-
-            pe = prcc_f / epspx if prcc_f and epspx and epspx > 0 else None
-            pe_prior = prcc_f_prior / epspx_prior if prcc_f_prior and epspx_prior and epspx_prior > 0 else None
-
-            records.append({
-                'year': year,
-                'permno': permno,
-                'gvkey': gvkey,
-                'name': gvkey_to_name.get(gvkey, ''),
-                'sector': sector,
-                'sector_name': GICS_SECTORS.get(sector, 'Unknown'),
-                'ni': ni,
-                'ni_prior': ni_prior,
-                'mktcap': mktcap,
-                'mktcap_prior': mktcap_prior,
-                'total_div': total_div,
-                'price_return': price_ret,
-                'dividend_yield': div_yield,
-                'pe': pe,
-                'pe_prior': pe_prior,
-            })
+    for year in (range(START_YEAR, END_YEAR + 1) if years is None else years):
+        year_permnos = sp500_by_year.get(year, [])
+        if not year_permnos:
+            continue
+        ids = link_index.gvkey_ids_for_year(np.array([int(p) for p in year_permnos], dtype=np.int64), year)
+        cs_ids = np.where(ids >= 0, link_to_cs[np.maximum(ids, 0)], -1)
+        curr = compustat.rows_for(cs_ids, year)
+        keep = np.flatnonzero(curr >= 0)
+        year_parts.append(np.full(len(keep), year, dtype=np.int32))
+        permnos.extend(year_permnos[i] for i in keep.tolist())
+        gvkeys.extend(link_index.gvkeys[g] for g in ids[keep].tolist())
+        curr_parts.append(curr[keep])
+        prior_parts.append(compustat.rows_for(cs_ids[keep], year - 1))
+
+    curr_idx = np.concatenate(curr_parts) if curr_parts else np.zeros(0, dtype=np.int64)
+    prior_idx = np.concatenate(prior_parts) if prior_parts else np.zeros(0, dtype=np.int64)
+    has_prior = prior_idx >= 0
+    prior_safe = np.where(has_prior, prior_idx, 0)
+
+    def current(field):
+        return compustat[field][curr_idx]
+
+    def prior(field):
+        return np.where(has_prior, compustat[field][prior_safe], np.nan)
+
+    ni, csho, prcc_f, epspx, dvpsx_f = (current(f) for f in ('ni', 'csho', 'prcc_f', 'epspx', 'dvpsx_f'))
+    ni_prior, csho_prior, prcc_f_prior, epspx_prior = (prior(f) for f in ('ni', 'csho', 'prcc_f', 'epspx'))
+
+    # 与原逐行版本相同的真值判断："x and ..." 要求非缺失且非 0
+    def truthy(x):
+        return ~np.isnan(x) & (x != 0)
+
+    nan = np.full(len(curr_idx), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mktcap = np.where(truthy(csho) & (prcc_f > 0), csho * prcc_f, nan)
+        mktcap_prior = np.where(truthy(csho_prior) & (prcc_f_prior > 0), csho_prior * prcc_f_prior, nan)
+        price_ret = np.where(truthy(prcc_f) & (prcc_f_prior > 0), prcc_f / prcc_f_prior - 1, nan)
+        total_div = dvpsx_f * csho
+        div_yield = np.where(~np.isnan(total_div) & (mktcap_prior > 0), total_div / mktcap_prior, nan)
+        pe = np.where(truthy(prcc_f) & (epspx > 0), prcc_f / epspx, nan)
+        pe_prior = np.where(truthy(prcc_f_prior) & (epspx_prior > 0), prcc_f_prior / epspx_prior, nan)
+
+    sector_code = compustat.gsector[curr_idx]
+    sector_code = np.where(np.isin(sector_code, GICS_CODES), sector_code, -1).astype(np.int16)
+    sectors = [str(c) if c >= 0 else 'XX' for c in sector_code.tolist()]
+    table = CompanyTable({
+        'year': np.concatenate(year_parts) if year_parts else np.zeros(0, dtype=np.int32),
+        'permno': permnos,
+        'gvkey': gvkeys,
+        'name': [gvkey_to_name.get(g, '') for g in gvkeys],
+        'sector': sectors,
+        'sector_code': sector_code,
+        'sector_name': [GICS_SECTORS.get(s, 'Unknown') for s in sectors],
+        'ni': ni,
+        'ni_prior': ni_prior,
+        'mktcap': mktcap,
+        'mktcap_prior': mktcap_prior,
+        'total_div': total_div,
+        'price_return': price_ret,
+        'dividend_yield': div_yield,
+        'pe': pe,
+        'pe_prior': pe_prior,
+    })
 
-    print(f"  公司记录数: {len(records)} ({START_YEAR}-{END_YEAR})")
-    return records
+    span = f"{START_YEAR}-{END_YEAR}" if years is None else f"重算 {len(years)} 年"
+    print(f"  公司记录数: {len(table)} ({span})")
+    return table
 
 # ── Level 2: 行业汇总 ────────────────────────────────────
 
-def aggregate_to_sectors(company_records):
-    print("汇总到行业 (Level 2)...")
-    buckets = defaultdict(lambda: {
-        'ni': 0, 'ni_prior': 0, 'mktcap': 0, 'mktcap_prior': 0,
-        'dividends': 0, 'count': 0,
-        'ni_valid': 0, 'ni_prior_valid': 0,
-        'mktcap_valid': 0, 'mktcap_prior_valid': 0,
-    })
+ROLLUP_FIELDS = ('ni', 'ni_prior', 'mktcap', 'mktcap_prior', 'total_div')
+
+def rollup_companies(company_records):
+    """
+    三层汇总的共享中间结果：Level 3 列一次编码分组，
+    'sectors' = 按 (年, 行业) 的求和，'years' = 按年的求和（验证表的 Σ公司）；
+    aggregate_to_sectors 再补上 'sector_years' = 行业取整值按年的求和（总量与验证表的 Σ行业）
+    """
+    cols = {f: company_records[f] for f in ROLLUP_FIELDS}
+    sectors = group_by((company_records['year'], company_records['sector_code']), cols)
+    sectors.keys = [(year, str(code) if code >= 0 else 'XX') for year, code in sectors.keys]
+    return {
+        'sectors': sectors,
+        'years': group_by((company_records['year'],), cols),
+    }
 
-    for r in company_records:
-        key = (r['year'], r['sector'])
-        b = buckets[key]
-        b['count'] += 1
-        if r['ni'] is not None:
-            b['ni'] += r['ni']
-            b['ni_valid'] += 1
-        if r['ni_prior'] is not None:
-            b['ni_prior'] += r['ni_prior']
-            b['ni_prior_valid'] += 1
-        if r['mktcap'] is not None:
-            b['mktcap'] += r['mktcap']
-            b['mktcap_valid'] += 1
-        if r['mktcap_prior'] is not None:
-            b['mktcap_prior'] += r['mktcap_prior']
-            b['mktcap_prior_valid'] += 1
-        if r['total_div'] is not None:
-            b['dividends'] += r['total_div']
+def _group_value(groups, field, i):
+    """组内非缺失值之和；全缺失时为 int 0（与原 defaultdict 的初值一致）"""
+    return float(groups.sums[field][i]) if groups.valid[field][i] else 0
+
+def _rounded_column(values):
+    """行业取整值列：int 0（全缺失的组）记为 NaN，不参与求和"""
+    return np.array([v if isinstance(v, float) else np.nan for v in values], dtype=np.float64)
+
+def aggregate_to_sectors(rollup):
+    print("汇总到行业 (Level 2)...")
+    groups = rollup['sectors']
 
     sector_data = {}
-    for (year, sector), b in buckets.items():
-        mc = b['mktcap']
-        mc_p = b['mktcap_prior']
-        ni = b['ni']
-        ni_p = b['ni_prior']
-        div = b['dividends']
+    for i, (year, sector) in enumerate(groups.keys):
+        mc = _group_value(groups, 'mktcap', i)
+        mc_p = _group_value(groups, 'mktcap_prior', i)
+        ni = _group_value(groups, 'ni', i)
+        ni_p = _group_value(groups, 'ni_prior', i)
+        div = _group_value(groups, 'total_div', i)
 
         price_ret = (mc / mc_p - 1) if mc > 0 and mc_p > 0 else None
         div_yield = (div / mc_p) if mc_p > 0 and div > 0 else None
@@ -208,7 +222,7 @@ def aggregate_to_sectors(company_records):
             'year': year,
             'sector': sector,
             'sector_name': GICS_SECTORS.get(sector, 'Unknown'),
-            'count': b['count'],
+            'count': int(groups.count[i]),
             'ni': round(ni, 1),
             'ni_prior': round(ni_p, 1),
             'mktcap': round(mc, 1),
@@ -222,37 +236,31 @@ def aggregate_to_sectors(company_records):
             'pe_prior': pe_prior,
         }
 
+    sectors = list(sector_data.values())
+    rounded = {f: _rounded_column([sd[f] for sd in sectors])
+               for f in ('ni', 'ni_prior', 'mktcap', 'mktcap_prior', 'dividends')}
+    rollup['sector_years'] = group_by(([sd['year'] for sd in sectors],), rounded)
     return sector_data
 
 # ── Level 1: 总量汇总 ────────────────────────────────────
 
-def aggregate_to_total(sector_data):
+def aggregate_to_total(rollup):
     print("汇总到总量 (Level 1)...")
-    yearly = defaultdict(lambda: {
-        'ni': 0, 'ni_prior': 0, 'mktcap': 0, 'mktcap_prior': 0,
-        'dividends': 0, 'count': 0, 'sector_count': 0,
-    })
-
-    for (year, sector), sd in sector_data.items():
-        y = yearly[year]
-        y['ni'] += sd['ni']
-        y['ni_prior'] += sd['ni_prior']
-        y['mktcap'] += sd['mktcap']
-        y['mktcap_prior'] += sd['mktcap_prior']
-        y['dividends'] += sd['dividends']
-        y['count'] += sd['count']
-        y['sector_count'] += 1
+    groups = rollup['sector_years']
+    year_index = groups.index()
+    companies = rollup['years']
+    company_index = companies.index()
 
     agg_data = {}
     for year in range(START_YEAR, END_YEAR + 1):
-        y = yearly.get(year)
-        if not y:
+        i = year_index.get((year,))
+        if i is None:
             continue
-        mc = y['mktcap']
-        mc_p = y['mktcap_prior']
-        ni = y['ni']
-        ni_p = y['ni_prior']
-        div = y['dividends']
+        mc = _group_value(groups, 'mktcap', i)
+        mc_p = _group_value(groups, 'mktcap_prior', i)
+        ni = _group_value(groups, 'ni', i)
+        ni_p = _group_value(groups, 'ni_prior', i)
+        div = _group_value(groups, 'dividends', i)
 
         price_ret = (mc / mc_p - 1) if mc > 0 and mc_p > 0 else None
         div_yield = (div / mc_p) if mc_p > 0 and div > 0 else None
@@ -266,8 +274,8 @@ def aggregate_to_total(sector_data):
 
         agg_data[year] = {
             'year': year,
-            'count': y['count'],
-            'sector_count': y['sector_count'],
+            'count': int(companies.count[company_index[(year,)]]),
+            'sector_count': int(groups.count[i]),
             'ni': round(ni, 1),
             'ni_prior': round(ni_p, 1),
             'mktcap': round(mc, 1),
@@ -306,49 +314,48 @@ def compute_contributions(sector_data, agg_data):
 
 # ── 验证表 ────────────────────────────────────────────────
 
-def build_verification(company_records, sector_data, agg_data):
+def build_verification(rollup, sector_data, agg_data):
     print("构建验证表...")
-    # Σ公司
-    company_sums = defaultdict(lambda: {'ni': 0, 'mktcap': 0, 'dividends': 0})
-    for r in company_records:
-        cs = company_sums[r['year']]
-        if r['ni'] is not None:
-            cs['ni'] += r['ni']
-        if r['mktcap'] is not None:
-            cs['mktcap'] += r['mktcap']
-        if r['total_div'] is not None:
-            cs['dividends'] += r['total_div']
-
-    # Σ行业
-    sector_sums = defaultdict(lambda: {'ni': 0, 'mktcap': 0, 'dividends': 0, 'contrib_price': 0})
-    for (year, sector), sd in sector_data.items():
-        ss = sector_sums[year]
-        ss['ni'] += sd['ni']
-        ss['mktcap'] += sd['mktcap']
-        ss['dividends'] += sd['dividends']
-        if sd.get('contrib_price') is not None:
-            ss['contrib_price'] += sd['contrib_price']
+    # Σ公司 / Σ行业：共享中间结果里按年的两组求和
+    companies = rollup['years']
+    company_index = companies.index()
+    sectors = rollup['sector_years']
+    sector_index = sectors.index()
+    contrib = group_by(([sd['year'] for sd in sector_data.values()],),
+                       {'contrib_price': [np.nan if sd.get('contrib_price') is None else sd['contrib_price']
+                                          for sd in sector_data.values()]})
+    contrib_index = contrib.index()
+
+    def company_sum(year, field):
+        i = company_index.get((year,))
+        return 0 if i is None else _group_value(companies, field, i)
+
+    def sector_sum(year, field):
+        i = sector_index.get((year,))
+        return 0 if i is None else _group_value(sectors, field, i)
+
+    def contrib_sum(year):
+        i = contrib_index.get((year,))
+        return 0 if i is None else _group_value(contrib, 'contrib_price', i)
 
     verification = []
     for year in range(START_YEAR, END_YEAR + 1):
         agg = agg_data.get(year)
-        cs = company_sums.get(year, {})
-        ss = sector_sums.get(year, {})
         if not agg:
             continue
 
         v = {
             'year': year,
             'agg_ni': round(agg['ni'], 1),
-            'sum_company_ni': round(cs.get('ni', 0), 1),
-            'sum_sector_ni': round(ss.get('ni', 0), 1),
-            'diff_ni': round(agg['ni'] - cs.get('ni', 0), 1),
+            'sum_company_ni': round(company_sum(year, 'ni'), 1),
+            'sum_sector_ni': round(sector_sum(year, 'ni'), 1),
+            'diff_ni': round(agg['ni'] - company_sum(year, 'ni'), 1),
             'agg_mktcap': round(agg['mktcap'], 1),
-            'sum_company_mktcap': round(cs.get('mktcap', 0), 1),
-            'sum_sector_mktcap': round(ss.get('mktcap', 0), 1),
-            'diff_mktcap': round(agg['mktcap'] - cs.get('mktcap', 0), 1),
+            'sum_company_mktcap': round(company_sum(year, 'mktcap'), 1),
+            'sum_sector_mktcap': round(sector_sum(year, 'mktcap'), 1),
+            'diff_mktcap': round(agg['mktcap'] - company_sum(year, 'mktcap'), 1),
             'agg_price_return': agg.get('price_return'),
-            'sum_sector_contrib_price': ss.get('contrib_price', 0),
+            'sum_sector_contrib_price': contrib_sum(year),
         }
         if v['agg_price_return'] is not None:
             v['diff_return'] = round((v['agg_price_return'] - v['sum_sector_contrib_price']) * 10000, 2)  # bps
@@ -360,13 +367,19 @@ def build_verification(company_records, sector_data, agg_data):
 
 # ── 滚动窗口分解 ─────────────────────────────────────────
 
-def compute_rolling(agg_data, windows=(5, 10, 20)):
+def _window_touches(start_year, end_year, years):
+    return any(start_year <= y <= end_year for y in years)
+
+def compute_rolling(agg_data, windows=(5, 10, 20), touched=None):
+    """touched: 只算包含这些年份（含基准年）的窗口（增量更新用）；None = 全部"""
     print("计算滚动窗口分解...")
     rolling = {}
     for w in windows:
         results = []
         for end_year in range(START_YEAR + w - 1, END_YEAR + 1):
             start_year = end_year - w
+            if touched is not None and not _window_touches(start_year, end_year, touched):
+                continue
             # start_year 是窗口起始的前一年（作为基准）
             agg_start = agg_data.get(start_year)
             agg_end = agg_data.get(end_year)
@@ -437,97 +450,69 @@ def compute_mean_reversion(rolling):
 
 # ── Top Contributors ─────────────────────────────────────
 
-def find_top_contributors(company_records, n=10):
+TOP_COLUMNS = ('year', 'ni', 'ni_prior', 'pe', 'pe_prior', 'mktcap')
+
+def _top_rows(year, n):
+    """
+    工作进程任务：共享数值列上某一年的 Top n → (盈利变化行号, PE 变动行号)
+    argsort(kind='stable') 对 -|key| 排序，并列时保持记录顺序，与 list.sort(reverse=True) 一致
+    """
+    cols = shared_arrays.arrays()
+    rows = np.flatnonzero(cols['year'] == year)
+    ni, ni_prior = cols['ni'][rows], cols['ni_prior'][rows]
+    ok = ~np.isnan(ni) & ~np.isnan(ni_prior)
+    earn = rows[ok][np.argsort(-np.abs(ni[ok] - ni_prior[ok]), kind='stable')[:n]]
+
+    pe, pe_prior, mktcap = cols['pe'][rows], cols['pe_prior'][rows], cols['mktcap'][rows]
+    ok = ~np.isnan(pe) & ~np.isnan(pe_prior) & ~np.isnan(mktcap)
+    impact = np.abs((pe[ok] - pe_prior[ok]) * mktcap[ok])
+    pe_rows = rows[ok][np.argsort(-impact, kind='stable')[:n]]
+    return earn.tolist(), pe_rows.tolist()
+
+def find_top_contributors(company_records, n=10, workers=1, years=None):
+    """
+    每年盈利变化 / PE 变动（按市值影响）最大的 n 家公司；workers > 1 时按年分给多个进程
+    years: 只算这些年（增量更新用）；None = START_YEAR..END_YEAR
+    """
     print("找 Top Contributors...")
-    by_year = defaultdict(list)
-    for r in company_records:
-        by_year[r['year']].append(r)
+    years = list(range(START_YEAR, END_YEAR + 1) if years is None else years)
+    with SharedArrayPool({c: company_records[c] for c in TOP_COLUMNS}, workers) as pool:
+        picks = pool.map(_top_rows, [(year, n) for year in years])
 
     top = []
-    for year in range(START_YEAR, END_YEAR + 1):
-        recs = by_year.get(year, [])
-
-        # Top earnings change
+    for year, (earn_rows, pe_rows) in zip(years, picks):
         earn_changes = []
-        for r in recs:
-            if r['ni'] is not None and r['ni_prior'] is not None:
-                earn_changes.append({
-                    'name': r['name'], 'sector': r['sector_name'],
-                    'change': r['ni'] - r['ni_prior'],
-                    'ni': r['ni'], 'ni_prior': r['ni_prior'],
-                })
-        earn_changes.sort(key=lambda x: abs(x['change']), reverse=True)
+        for i in earn_rows:
+            r = company_records.row(i)
+            earn_changes.append({
+                'name': r['name'], 'sector': r['sector_name'],
+                'change': r['ni'] - r['ni_prior'],
+                'ni': r['ni'], 'ni_prior': r['ni_prior'],
+            })
 
         # Top PE movers (by market cap impact)
         pe_movers = []
-        for r in recs:
-            if r['pe'] is not None and r['pe_prior'] is not None and r['mktcap'] is not None:
-                pe_change = r['pe'] - r['pe_prior']
-                pe_movers.append({
-                    'name': r['name'], 'sector': r['sector_name'],
-                    'pe_change': pe_change,
-                    'pe': r['pe'], 'pe_prior': r['pe_prior'],
-                    'mktcap': r['mktcap'],
-                })
-        pe_movers.sort(key=lambda x: abs(x['pe_change'] * x['mktcap']), reverse=True)
+        for i in pe_rows:
+            r = company_records.row(i)
+            pe_movers.append({
+                'name': r['name'], 'sector': r['sector_name'],
+                'pe_change': r['pe'] - r['pe_prior'],
+                'pe': r['pe'], 'pe_prior': r['pe_prior'],
+                'mktcap': r['mktcap'],
+            })
 
         top.append({
             'year': year,
-            'top_earnings': earn_changes[:n],
-            'top_pe': pe_movers[:n],
+            'top_earnings': earn_changes,
+            'top_pe': pe_movers,
         })
 
     return top
 
-# ── 主流程 ────────────────────────────────────────────────
-
-def main():
-    print("=" * 80)
-    print("S&P 500 三层回报分解 (1985-2024)")
-    print("=" * 80)
-
-    # 加载数据
-    print("\n加载数据...")
-    sp500_rows = load_csv('sp500_constituents.csv')
-    ccm_rows = load_csv('ccm_link_table.csv')
-    compustat_rows = load_csv('compustat_annual.csv')
-
-    print("构建映射...")
-    permno_to_gvkey = build_permno_to_gvkey(ccm_rows)
-    sp500_by_year = build_sp500_by_year(sp500_rows)
-    compustat_lookup = build_compustat_lookup(compustat_rows)
-    gvkey_to_name = {}
-    for r in ccm_rows:
-        gvkey_to_name[r['gvkey']] = r['conm']
-
-    # Level 3: 公司
-    company_records = build_company_records(
-        sp500_by_year, permno_to_gvkey, compustat_lookup, gvkey_to_name)
-
-    # Level 2: 行业
-    sector_data = aggregate_to_sectors(company_records)
-
-    # Level 1: 总量
-    agg_data = aggregate_to_total(sector_data)
-
-    # 行业贡献
-    compute_contributions(sector_data, agg_data)
-
-    # 验证
-    verification = build_verification(company_records, sector_data, agg_data)
-
-    # 滚动窗口
-    rolling = compute_rolling(agg_data)
-
-    # 均值回归统计
-    mr_stats = compute_mean_reversion(rolling)
-
-    # Top Contributors
-    top_contrib = find_top_contributors(company_records)
-
-    # ── 输出 JSON ──
-    print("\n保存 JSON...")
+# ── 输出 JSON ────────────────────────────────────────────
 
+def save_output(company_records, sector_data, agg_data, verification, rolling, mr_stats, top_contrib,
+                compression=None):
     # 压缩公司记录（只保留有效字段，四舍五入）
     company_out = []
     for r in company_records:
@@ -577,11 +562,238 @@ def main():
         'top_contributors': top_contrib,
     }
 
-    path = os.path.join(OUTPUT_DIR, 'sp500_3level_decomposition.json')
-    with open(path, 'w') as f:
-        json.dump(output, f, indent=2, default=str)
-    fsize = os.path.getsize(path) / 1024 / 1024
-    print(f"  已保存: sp500_3level_decomposition.json ({fsize:.1f} MB)")
+    manifest = write_decomposition(output, STORE_DIR, compression)
+    sizes = ', '.join(f"{name} {s['bytes'] / 1024:.0f}KB" for name, s in manifest['sections'].items())
+    print(f"  已保存: {os.path.basename(STORE_DIR)}/ ({sizes})")
+    return STORE_DIR
+
+# ── 增量更新 ──────────────────────────────────────────────
+# 每次运行把全精度的中间结果（公司表、行业 / 总量字典、验证、滚动窗口、Top）存到
+# compustat_annual.csv 旁边的 .cache/sp500_decomposition/，manifest 记录当时三个输入的指纹。
+# --incremental 时：链接表和成分股没变、compustat_annual.csv 只在末尾追加了行，
+# 就只重算新增行涉及的财年 y 和 y+1（y+1 的上年数据来自 y）：这些年的公司记录、
+# (年, 行业) 桶、总量、验证、Top，以及包含这些年的滚动窗口；其余沿用上次的结果。
+# 各年的计算互不依赖，拼接后与全量重算逐位相同。
+
+STATE_NAME = 'sp500_decomposition'
+STATE_VERSION = 1
+TABLE_FIELDS = RECORD_FIELDS + ('sector_code',)
+INPUT_FILES = {
+    'compustat': ('compustat_annual.csv', compustat_cache.CACHE_NAME),
+    'ccm': ('ccm_link_table.csv', ccm_links.CACHE_NAME),
+    'constituents': ('sp500_constituents.csv', sp500_membership.CACHE_NAME),
+}
+
+def _state_dir():
+    return cache_dir_for(os.path.join(DATA_DIR, 'compustat_annual.csv'), STATE_NAME)
+
+def _input_sources():
+    """三个输入各自缓存 manifest 里的源文件指纹和行数（即本次实际用到的数据）"""
+    out = {}
+    for name, (filename, cache_name) in INPUT_FILES.items():
+        manifest = read_manifest(cache_dir_for(os.path.join(DATA_DIR, filename), cache_name))
+        out[name] = {'source': manifest['source'], 'rows': manifest.get('rows')}
+    return out
+
+def save_state(company_records, sector_data, agg_data, verification, rolling, top_contrib):
+    state_dir = _state_dir()
+    tmp_dir = state_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    np.savez(os.path.join(tmp_dir, 'companies.npz'),
+             **{f: np.asarray(company_records[f]) for f in TABLE_FIELDS})
+    with open(os.path.join(tmp_dir, 'results.json'), 'w') as f:
+        json.dump({
+            'sectors': list(sector_data.values()),
+            'aggregate': list(agg_data.values()),
+            'verification': verification,
+            'rolling': {str(w): v for w, v in rolling.items()},
+            'top_contributors': top_contrib,
+        }, f)
+    write_manifest(tmp_dir, {'version': STATE_VERSION, 'window': [START_YEAR, END_YEAR],
+                             'inputs': _input_sources()})
+    replace_dir(tmp_dir, state_dir)
+
+def load_state():
+    """上次运行的全精度中间结果；没有或版本 / 分析区间不符时返回 None"""
+    state_dir = _state_dir()
+    manifest = read_manifest(state_dir)
+    if manifest is None or manifest.get('version') != STATE_VERSION \
+            or manifest.get('window') != [START_YEAR, END_YEAR]:
+        return None
+    with np.load(os.path.join(state_dir, 'companies.npz')) as z:
+        columns = {f: (z[f] if z[f].dtype.kind in 'iuf' else z[f].tolist()) for f in TABLE_FIELDS}
+    with open(os.path.join(state_dir, 'results.json')) as f:
+        results = json.load(f)
+    return {
+        'manifest': manifest,
+        'companies': CompanyTable(columns),
+        'sectors': {(sd['year'], sd['sector']): sd for sd in results['sectors']},
+        'aggregate': {ad['year']: ad for ad in results['aggregate']},
+        'verification': results['verification'],
+        'rolling': {int(w): v for w, v in results['rolling'].items()},
+        'top_contributors': results['top_contributors'],
+    }
+
+def affected_years(state, compustat):
+    """
+    与上次运行相比需要重算的年份（升序，可能为空）；
+    链接表 / 成分股有变化或 Compustat 不是末尾追加时返回 None（需要全量重算）
+    """
+    before = state['manifest']['inputs']
+    now = _input_sources()
+
+    def same(name):
+        a, b = before[name]['source'], now[name]['source']
+        return a['size'] == b['size'] and a['hash'] == b['hash']
+
+    if not same('ccm') or not same('constituents'):
+        return None
+    if same('compustat'):
+        return []
+    if not appended_to(before['compustat']['source'], os.path.join(DATA_DIR, 'compustat_annual.csv')):
+        return None
+    datadate = compustat.datadate[before['compustat']['rows']:]
+    changed = np.unique(fiscal_year(datadate[datadate > 0])).tolist()
+    years = {y + d for y in changed for d in (0, 1)}
+    return sorted(y for y in years if START_YEAR <= y <= END_YEAR)
+
+def _splice_companies(old, part, years):
+    """旧公司表去掉 years 的行，换成重算的行，按年稳定排序（两边各自已按年有序）"""
+    keep = ~np.isin(old['year'], years)
+    order = np.argsort(np.concatenate([old['year'][keep], part['year']]), kind='stable')
+    columns = {}
+    for f in TABLE_FIELDS:
+        a, b = old[f], part[f]
+        if isinstance(a, np.ndarray):
+            columns[f] = np.concatenate([a[keep], b])[order]
+        else:
+            merged = [v for v, k in zip(a, keep.tolist()) if k] + list(b)
+            columns[f] = [merged[i] for i in order.tolist()]
+    return CompanyTable(columns)
+
+def _splice_by_year(old, new, years, year_of):
+    """按年拼接：years 里的年份取 new，其余取 old；年份升序，同一年内保持原顺序"""
+    years = set(years)
+    merged = defaultdict(list)
+    for item in old:
+        if year_of(item) not in years:
+            merged[year_of(item)].append(item)
+    for item in new:
+        merged[year_of(item)].append(item)
+    return [item for year in sorted(merged) for item in merged[year]]
+
+def update_incremental(state, years, sp500_by_year, link_index, compustat, gvkey_to_name, workers=1):
+    """只重算 years 涉及的部分，与 state 拼接 → 与全量流程相同的结果元组"""
+    if years:
+        print(f"增量更新: 重算 {years[0]}-{years[-1]} 中的 {len(years)} 年")
+    elif state['manifest']['inputs']['compustat']['source']['hash'] != _input_sources()['compustat']['source']['hash']:
+        print(f"增量更新: 新增的 Compustat 行都在分析窗口 {START_YEAR}-{END_YEAR} 之外，结果不变")
+    else:
+        print("增量更新: 输入未变化")
+    part = build_company_records(sp500_by_year, link_index, compustat, gvkey_to_name, years=years)
+    company_records = _splice_companies(state['companies'], part, years)
+
+    rollup = rollup_companies(part)
+    sector_part = aggregate_to_sectors(rollup)
+    agg_part = aggregate_to_total(rollup)
+    agg_data = {ad['year']: ad for ad in _splice_by_year(
+        state['aggregate'].values(), agg_part.values(), years, lambda ad: ad['year'])}
+    compute_contributions(sector_part, agg_data)
+    sector_data = {(sd['year'], sd['sector']): sd for sd in _splice_by_year(
+        state['sectors'].values(), sector_part.values(), years, lambda sd: sd['year'])}
+    verification = _splice_by_year(state['verification'], build_verification(rollup, sector_part, agg_part),
+                                   years, lambda v: v['year'])
+
+    touched = compute_rolling(agg_data, touched=years)
+    rolling = {}
+    for w, results in state['rolling'].items():
+        kept = [r for r in results if not _window_touches(r['start'] - 1, r['end'], years)]
+        rolling[w] = sorted(kept + touched[w], key=lambda r: r['end'])
+    mr_stats = compute_mean_reversion(rolling)
+
+    top_part = find_top_contributors(company_records, workers=workers, years=years)
+    top_contrib = _splice_by_year(state['top_contributors'], top_part, years, lambda t: t['year'])
+    return company_records, sector_data, agg_data, verification, rolling, mr_stats, top_contrib
+
+# ── 主流程 ────────────────────────────────────────────────
+
+def run_full(sp500_by_year, link_index, compustat, gvkey_to_name, workers=1):
+    """全量流程 → (公司表, 行业, 总量, 验证, 滚动窗口, 均值回归, Top)"""
+    # Level 3: 公司
+    with profiling.stage("公司记录"):
+        company_records = build_company_records(
+            sp500_by_year, link_index, compustat, gvkey_to_name)
+
+    # Level 2: 行业
+    with profiling.stage("汇总到行业"):
+        rollup = rollup_companies(company_records)
+        sector_data = aggregate_to_sectors(rollup)
+
+    # Level 1: 总量
+    with profiling.stage("汇总到总量"):
+        agg_data = aggregate_to_total(rollup)
+
+    # 行业贡献
+    with profiling.stage("行业贡献"):
+        compute_contributions(sector_data, agg_data)
+
+    # 验证
+    with profiling.stage("验证"):
+        verification = build_verification(rollup, sector_data, agg_data)
+
+    # 滚动窗口
+    with profiling.stage("滚动窗口"):
+        rolling = compute_rolling(agg_data)
+
+    # 均值回归统计
+    with profiling.stage("均值回归"):
+        mr_stats = compute_mean_reversion(rolling)
+
+    # Top Contributors
+    with profiling.stage("Top Contributors"):
+        top_contrib = find_top_contributors(company_records, workers=workers)
+
+    return company_records, sector_data, agg_data, verification, rolling, mr_stats, top_contrib
+
+def main(compression=None, workers=1, incremental=False):
+    print("=" * 80)
+    print("S&P 500 三层回报分解 (1985-2024)")
+    print("=" * 80)
+
+    # 加载数据
+    print("\n加载数据...")
+    with profiling.stage("加载数据"):
+        ccm_rows = load_csv('ccm_link_table.csv')
+
+    print("构建映射...")
+    with profiling.stage("构建映射"):
+        link_index = load_link_index(os.path.join(DATA_DIR, 'ccm_link_table.csv'))
+        membership = load_membership(os.path.join(DATA_DIR, 'sp500_constituents.csv'))
+        sp500_by_year = membership.by_year(START_YEAR - 1, END_YEAR)
+        compustat = load_compustat(os.path.join(DATA_DIR, 'compustat_annual.csv'))
+        gvkey_to_name = {}
+        for r in ccm_rows:
+            gvkey_to_name[r['gvkey']] = r['conm']
+
+    state = load_state() if incremental else None
+    years = affected_years(state, compustat) if state is not None else None
+    if years is None:
+        if incremental:
+            print("\n没有可用的增量状态，或链接表 / 成分股有变化、Compustat 不是末尾追加：全量重算")
+        results = run_full(sp500_by_year, link_index, compustat, gvkey_to_name, workers)
+    else:
+        with profiling.stage("增量更新"):
+            results = update_incremental(state, years, sp500_by_year, link_index, compustat,
+                                         gvkey_to_name, workers)
+    company_records, sector_data, agg_data, verification, rolling, mr_stats, top_contrib = results
+
+    # ── 输出 JSON ──
+    print("\n保存 JSON...")
+    with profiling.stage("保存 JSON"):
+        save_output(company_records, sector_data, agg_data, verification, rolling, mr_stats, top_contrib,
+                    compression)
+        save_state(company_records, sector_data, agg_data, verification, rolling, top_contrib)
 
     # ── 打印摘要 ──
     print("\n" + "=" * 80)
@@ -609,4 +821,12 @@ def main():
               f"范围 [{s['min']:.2f}%, {s['max']:.2f}%]")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="S&P 500 三层回报分解")
+    parser.add_argument('--compress', choices=('gzip', 'br'), default=None, help="分段文件压缩方式（默认不压缩）")
+    parser.add_argument('--workers', type=int, default=1, help="Top Contributors 按年并行的进程数（共享内存）")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Compustat 只追加了新行时只重算受影响的年份（需要上次运行留下的状态）")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.configure(args)
+    main(compression=args.compress, workers=args.workers, incremental=args.incremental)
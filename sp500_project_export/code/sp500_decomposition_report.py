@@ -1,13 +1,10 @@
 """
 三层分解报表输出：读取 JSON，打印格式化表格
 """
-import json
-import os
+from decomposition_store import load_decomposition
 
-DATA_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'sp500_3level_decomposition.json')
-
-with open(DATA_PATH) as f:
-    D = json.load(f)
+# 报表不用 companies 段，不读
+D = load_decomposition(['aggregate', 'sectors', 'verification', 'rolling', 'mean_reversion', 'top_contributors'])
 
 agg = {r['year']: r for r in D['aggregate']}
 sectors_by_year = {}
@@ -9,11 +9,17 @@ S&P 500 GICS 行业分析：
 数据：CRSP/Compustat 公司级别数据 (1962-2024)
 GICS 覆盖率：1980+ >90%，主要分析聚焦 1980-2024
 """
-import csv
+import argparse
 import os
 import json
 from collections import defaultdict
 
+from ccm_links import load_link_index
+from data_cache import read_csv_rows, resident
+from pe_permutation import permutation_test
+import profiling
+from sp500_membership import load_membership
+
 DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'crsp_compustat')
 
 GICS_SECTORS = {
@@ -37,43 +43,7 @@ def safe_float(val):
         return None
 
 def load_csv(filename):
-    path = os.path.join(DATA_DIR, filename)
-    with open(path, 'r') as f:
-        return list(csv.DictReader(f))
-
-def build_permno_to_gvkey(ccm_rows):
-    mapping = {}
-    for r in ccm_rows:
-        permno = r['LPERMNO']
-        gvkey = r['gvkey']
-        linkdt = r['LINKDT']
-        linkenddt = r['LINKENDDT'] if r['LINKENDDT'] != 'E' else '2099-12-31'
-        priority = {'P': 0, 'C': 1, 'J': 2, 'N': 3}.get(r['LINKPRIM'], 4)
-        if permno not in mapping:
-            mapping[permno] = []
-        mapping[permno].append((gvkey, linkdt, linkenddt, priority))
-    for permno in mapping:
-        mapping[permno].sort(key=lambda x: x[3])
-    return mapping
-
-def get_gvkey(mapping, permno, year):
-    if permno not in mapping:
-        return None
-    year_str = f"{year}-06-30"
-    for gvkey, linkdt, linkenddt, _ in mapping[permno]:
-        if linkdt <= year_str and linkenddt >= year_str:
-            return gvkey
-    return mapping[permno][0][0] if mapping[permno] else None
-
-def build_sp500_by_year(sp500_rows):
-    yearly = defaultdict(set)
-    for r in sp500_rows:
-        permno = r['permno']
-        start_year = int(r['start'][:4])
-        end_year = int(r['ending'][:4])
-        for year in range(max(start_year, 1962), min(end_year, 2024) + 1):
-            yearly[year].add(permno)
-    return yearly
+    return read_csv_rows(os.path.join(DATA_DIR, filename))
 
 def build_compustat_lookup(compustat_rows):
     lookup = {}
@@ -89,16 +59,19 @@ def build_compustat_lookup(compustat_rows):
             lookup[key] = r
     return lookup
 
-def analyze():
+def analyze(permutations=0, workers=1):
     print("加载数据...")
-    sp500_rows = load_csv('sp500_constituents.csv')
-    ccm_rows = load_csv('ccm_link_table.csv')
-    compustat_rows = load_csv('compustat_annual.csv')
+    with profiling.stage("加载数据"):
+        compustat_rows = load_csv('compustat_annual.csv')
 
     print("构建映射...")
-    permno_to_gvkey = build_permno_to_gvkey(ccm_rows)
-    sp500_by_year = build_sp500_by_year(sp500_rows)
-    compustat_lookup = build_compustat_lookup(compustat_rows)
+    with profiling.stage("构建映射"):
+        link_index = load_link_index(os.path.join(DATA_DIR, 'ccm_link_table.csv'))
+        membership = load_membership(os.path.join(DATA_DIR, 'sp500_constituents.csv'))
+        sp500_by_year = membership.by_year(1962, 2024)
+        # 常驻模式下查找表随 compustat_annual.csv 一起缓存
+        compustat_lookup = resident('industry_compustat_lookup', os.path.join(DATA_DIR, 'compustat_annual.csv'),
+                                    lambda: build_compustat_lookup(compustat_rows))
 
     print("计算行业年度数据...")
 
@@ -106,7 +79,7 @@ def analyze():
     industry_data = {}
 
     for year in range(1962, 2025):
-        permnos = sp500_by_year.get(year, set())
+        permnos = sp500_by_year.get(year, [])
         if not permnos:
             continue
 
@@ -116,8 +89,7 @@ def analyze():
         })
         no_gics_count = 0
 
-        for permno in permnos:
-            gvkey = get_gvkey(permno_to_gvkey, permno, year)
+        for gvkey in link_index.gvkeys_for_year(permnos, year):
             if not gvkey:
                 continue
             data = compustat_lookup.get((gvkey, year))
@@ -316,6 +288,17 @@ def analyze():
         print(f"{name:<16} {mean_pe:>7.1f} {std_pe:>7.1f} {min_pe:>7.1f} {max_pe:>7.1f} "
               f"{current_pe:>7.1f} {deviation:>+7.1f}σ {revert_pct:>6.0f}%")
 
+    # 置换检验：打乱各行业 PE 历史，回归概率是否显著高于无时间结构时的水平
+    if permutations > 0 and sector_stats:
+        print(f"\n  置换检验（每个行业 {permutations:,} 次排列，单侧 p 值）")
+        print(f"  {'Sector':<16} {'回归概率':>8} {'排列均值':>8} {'p 值':>8}")
+        tests = permutation_test({code: [pe for _, pe in sector_pe_history[code]] for code in sector_stats},
+                                 permutations=permutations, workers=workers)
+        for sector_code, t in tests.items():
+            sig = ' *' if t['p_value'] < 0.05 else ''
+            print(f"  {sector_stats[sector_code]['name']:<16} {t['revert_pct']:>7.0f}% "
+                  f"{t['null_mean']:>7.0f}% {t['p_value']:>8.4f}{sig}")
+
     # =========================================
     # 5. 行业盈利增长贡献分解
     # =========================================
@@ -594,4 +577,10 @@ def analyze():
     print(f"\n  行业数据已保存到: sp500_industry_analysis.json")
 
 if __name__ == "__main__":
-    analyze()
+    parser = argparse.ArgumentParser(description="S&P 500 GICS 行业分析")
+    parser.add_argument('--permutations', type=int, default=0, help="第 4 步回归概率的置换检验次数（0 = 不做）")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="置换检验的进程数（默认 CPU 数；结果与进程数无关）")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.configure(args)
+    analyze(permutations=args.permutations, workers=args.workers)
@@ -0,0 +1,154 @@
+"""
+S&P 500 成分股稠密位图：(PERMNO, 月份) → 是否成分股
+
+由 sp500_constituents.csv 构建，所有脚本共用同一套成员语义：
+  - start / ending 取到月（YYYY-MM），区间两端包含
+  - ending 为空或 'na' 视为仍在指数中（开放到位图末月）
+  - 按年取成分股 = 该年任一月份在区间内（与原 build_sp500_by_year 的年份展开一致）
+位图按行 = PERMNO（升序），列 = 自 1925-01 起的月份序号，按位压缩（np.packbits），
+单点查询是一次取字节 + 移位，一整块 CRSP 行的成员掩码是一次向量化 gather。
+位图以 sp500_constituents.csv 的指纹为键缓存在 .cache/sp500_membership/。
+"""
+import csv
+import os
+
+import numpy as np
+
+from data_cache import (DATA_DIR, cache_dir_for, file_fingerprint, is_fresh, replace_dir, resident,
+                        write_manifest)
+import profiling
+
+CONSTITUENTS_PATH = os.path.join(DATA_DIR, 'sp500_constituents.csv')
+
+CACHE_NAME = 'sp500_membership'
+CACHE_VERSION = 1
+
+BASE_YEAR = 1925
+LAST_YEAR = 2099
+N_MONTHS = (LAST_YEAR - BASE_YEAR + 1) * 12
+OPEN_END = LAST_YEAR * 100 + 12
+
+
+def month_index(yyyymm):
+    """YYYYMM（标量或数组）→ 自 BASE_YEAR-01 起的月份序号"""
+    yyyymm = np.asarray(yyyymm, dtype=np.int64)
+    return (yyyymm // 100 - BASE_YEAR) * 12 + yyyymm % 100 - 1
+
+
+def _parse_ym(s, default):
+    s = s.strip()
+    if s == '' or s.lower() == 'na':
+        return default
+    return int(s[:4]) * 100 + int(s[5:7])
+
+
+def build_membership(csv_path=CONSTITUENTS_PATH):
+    intervals = []
+    with open(csv_path, 'r') as f:
+        for r in csv.DictReader(f):
+            intervals.append((int(r['permno']), _parse_ym(r['start'], 0), _parse_ym(r['ending'], OPEN_END)))
+
+    permnos = np.array(sorted({p for p, _, _ in intervals}), dtype=np.int32)
+    row = dict(zip(permnos.tolist(), range(len(permnos))))
+    dense = np.zeros((len(permnos), N_MONTHS), dtype=bool)
+    for permno, start_ym, end_ym in intervals:
+        lo = max(int(month_index(start_ym)), 0)
+        hi = min(int(month_index(end_ym)), N_MONTHS - 1)
+        if lo <= hi:
+            dense[row[permno], lo:hi + 1] = True
+
+    cache_dir = cache_dir_for(csv_path, CACHE_NAME)
+    tmp_dir = cache_dir + '.tmp'
+    os.makedirs(tmp_dir, exist_ok=True)
+    np.savez(os.path.join(tmp_dir, 'membership.npz'),
+             permnos=permnos, bits=np.packbits(dense, axis=1))
+    write_manifest(tmp_dir, {'version': CACHE_VERSION, 'source': file_fingerprint(csv_path),
+                             'base_year': BASE_YEAR, 'months': N_MONTHS,
+                             'intervals': len(intervals)})
+    replace_dir(tmp_dir, cache_dir)
+    return cache_dir
+
+
+class Membership:
+    def __init__(self, cache_dir):
+        with np.load(os.path.join(cache_dir, 'membership.npz')) as z:
+            self.permnos = z['permnos']
+            self.bits = z['bits']
+        self._row = dict(zip(self.permnos.tolist(), range(len(self.permnos))))
+
+    def __len__(self):
+        return len(self.permnos)
+
+    def rows_for(self, permnos):
+        """PERMNO 数组 → 位图行号数组（从未入选的为 -1）"""
+        permnos = np.asarray(permnos, dtype=np.int64)
+        if len(self.permnos) == 0:
+            return np.full(permnos.shape, -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.permnos, permnos), len(self.permnos) - 1)
+        return np.where(self.permnos[pos] == permnos, pos, -1)
+
+    def contains(self, permno, yyyymm):
+        """单点查询：permno 在 yyyymm 当月是否为成分股"""
+        i = self._row.get(int(permno))
+        m = int(month_index(yyyymm))
+        if i is None or not 0 <= m < N_MONTHS:
+            return False
+        return bool(self.bits[i, m >> 3] >> (7 - (m & 7)) & 1)
+
+    def mask(self, permnos, yyyymm):
+        """向量化：permnos 与 yyyymm（数组或标量，可广播）→ 布尔掩码"""
+        rows = self.rows_for(permnos)
+        m = month_index(yyyymm)
+        rows, m = np.broadcast_arrays(rows, m)
+        valid = (rows >= 0) & (m >= 0) & (m < N_MONTHS)
+        r = np.where(valid, rows, 0)
+        c = np.where(valid, m, 0)
+        hit = (self.bits[r, c >> 3] >> (7 - (c & 7))) & 1
+        return valid & (hit == 1)
+
+    def members_in_month(self, yyyymm):
+        """某月的全部成分股 PERMNO（升序 int 数组）"""
+        m = int(month_index(yyyymm))
+        if not 0 <= m < N_MONTHS:
+            return self.permnos[:0]
+        hit = (self.bits[:, m >> 3] >> (7 - (m & 7))) & 1
+        return self.permnos[hit == 1]
+
+    def year_matrix(self, first_year, last_year):
+        """(PERMNO, 年) 布尔矩阵：该年任一月份为成分股"""
+        lo = int(month_index(first_year * 100 + 1))
+        hi = int(month_index(last_year * 100 + 12)) + 1
+        months = np.unpackbits(self.bits[:, lo >> 3:(hi + 7) >> 3], axis=1)
+        months = months[:, lo & 7:(lo & 7) + hi - lo]
+        return months.reshape(len(self.permnos), -1, 12).any(axis=2)
+
+    def members_in_year(self, year):
+        return self.permnos[self.year_matrix(year, year)[:, 0]]
+
+    def by_year(self, first_year, last_year):
+        """
+        {年: [PERMNO 字符串, ...]}（PERMNO 升序），替代原各脚本的 build_sp500_by_year；
+        没有成分股的年份不出现
+        """
+        matrix = self.year_matrix(first_year, last_year)
+        permnos = [str(p) for p in self.permnos.tolist()]
+        yearly = {}
+        for k, year in enumerate(range(first_year, last_year + 1)):
+            rows = np.flatnonzero(matrix[:, k]).tolist()
+            if rows:
+                yearly[year] = [permnos[i] for i in rows]
+        return yearly
+
+
+@profiling.profiled("加载成分股")
+def load_membership(csv_path=CONSTITUENTS_PATH):
+    def load():
+        cache_dir = cache_dir_for(csv_path, CACHE_NAME)
+        if not is_fresh(cache_dir, csv_path, CACHE_VERSION):
+            build_membership(csv_path)
+        return Membership(cache_dir)
+    return resident(CACHE_NAME, csv_path, load)
+
+
+if __name__ == "__main__":
+    build_membership()
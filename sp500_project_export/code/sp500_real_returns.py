@@ -5,10 +5,18 @@
 
 修正：使用年初市值作权重（避免 winner bias）
 """
-import csv
+import argparse
 import os
 import json
-from collections import defaultdict
+
+import numpy as np
+
+from crsp_panel import load_panel
+from crsp_scan import CrspConsumer
+import profiling
+import shared_arrays
+from shared_arrays import SharedArrayPool, split_ranges
+from sp500_membership import load_membership
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'crsp_compustat')
 
@@ -21,127 +29,175 @@ def safe_float(val):
     return None
 
 def load_sp500_constituents():
-    """加载 S&P 500 成分股列表"""
-    path = os.path.join(DATA_DIR, 'sp500_constituents.csv')
-    yearly = defaultdict(set)
-    with open(path, 'r') as f:
-        for r in csv.DictReader(f):
-            permno = r['permno']
-            start_year = int(r['start'][:4])
-            end_year = int(r['ending'][:4])
-            for year in range(max(start_year, 1962), min(end_year, 2024) + 1):
-                yearly[year].add(permno)
-    return yearly
-
-def compute_annual_returns(sp500_by_year):
+    """加载 S&P 500 成分股列表：{年: [PERMNO, ...]}（共享成员位图）"""
+    return load_membership(os.path.join(DATA_DIR, 'sp500_constituents.csv')).by_year(1962, 2024)
+
+def _first_mktcap(months, prc, shrout, month):
+    """该年第一条指定月份记录的市值（PRC 或 SHROUT 缺失时为 None）"""
+    hit = np.flatnonzero(months == month)
+    if len(hit) == 0:
+        return None
+    i = hit[0]
+    if prc[i] != prc[i] or shrout[i] != shrout[i]:
+        return None
+    return float(prc[i] * shrout[i])
+
+def summarize_company_years(hist, first_year=1961, last_year=2024):
+    """
+    一家公司的 CRSP 历史（按日期排序的 memmap 切片）→ 每年汇总
+    {year: (annual_ret 或 None, 1月市值, 12月市值)}
+    annual_ret 为月度回报连乘（含退市回报），有效月份 < 6 时为 None
+    """
+    dates = np.asarray(hist['date'])
+    lo, hi = np.searchsorted(dates, [first_year * 100, (last_year + 1) * 100])
+    if lo >= hi:
+        return {}
+    dates = dates[lo:hi]
+    years = dates // 100
+    months = dates % 100
+    ret = hist['RET'][lo:hi]
+    prc = np.abs(hist['PRC'][lo:hi])
+    shrout = hist['SHROUT'][lo:hi]
+    dlret = hist['DLRET'][lo:hi]
+
+    out = {}
+    bounds = np.flatnonzero(np.diff(years)) + 1
+    for s, e in zip(np.r_[0, bounds].tolist(), np.r_[bounds, len(years)].tolist()):
+        # 计算年度回报：连乘月度回报
+        cumulative = 1.0
+        valid_months = 0
+        for r in ret[s:e].tolist():
+            if r == r:
+                cumulative *= (1.0 + r)
+                valid_months += 1
+
+        # 处理退市回报
+        last_dlret = float(dlret[e - 1])
+        if last_dlret == last_dlret:
+            cumulative *= (1.0 + last_dlret)
+
+        annual_ret = cumulative - 1.0 if valid_months >= 6 else None
+        out[int(years[s])] = (
+            annual_ret,
+            _first_mktcap(months[s:e], prc[s:e], shrout[s:e], 1),
+            _first_mktcap(months[s:e], prc[s:e], shrout[s:e], 12),
+        )
+    return out
+
+SUMMARY_COLUMNS = ('date', 'RET', 'PRC', 'SHROUT', 'DLRET')
+
+def _summarize_range(starts, ends):
+    """工作进程任务：共享列上的一段公司（各自的 [start, end) 行区间）→ [每家公司的 {year: 汇总}]"""
+    cols = shared_arrays.arrays()
+    return [summarize_company_years({c: cols[c][s:e] for c in SUMMARY_COLUMNS})
+            for s, e in zip(starts, ends)]
+
+def summarize_companies(columns, keys, starts, ends, workers=1):
+    """
+    按公司连续存放的列（面板 memmap 或扫描结果）逐公司汇总
+    keys[i] 的历史是各列的 [starts[i], ends[i]) 行；→ {(key, year): (annual_ret, 1月市值, 12月市值)}
+    workers > 1 时列放进共享内存（memmap 列直接按文件共享），按公司区间分给多个进程
+    """
+    starts, ends = list(starts), list(ends)
+    tasks = [(starts[a:b], ends[a:b]) for a, b in split_ranges(len(keys), max(1, workers) * 4)]
+    company_years = {}
+    with SharedArrayPool({c: columns[c] for c in SUMMARY_COLUMNS}, workers) as pool:
+        i = 0
+        for part in pool.map(_summarize_range, tasks):
+            for summaries in part:
+                for year, summary in summaries.items():
+                    company_years[(keys[i], year)] = summary
+                i += 1
+    return company_years
+
+class MonthlyReturnsConsumer(CrspConsumer):
+    """
+    CRSP 扫描消费者：收集 S&P 500 成分股 1961-2024 的月度记录，
+    扫描结束后按 (PERMNO, date) 排序，逐公司汇总成 company_years
+    """
+    name = 'monthly_returns'
+    columns = ('PERMNO', 'date', 'RET', 'PRC', 'SHROUT', 'DLRET')
+
+    def __init__(self, sp500_by_year, workers=1):
+        self.workers = workers
+        permnos = set()
+        for year_permnos in sp500_by_year.values():
+            permnos.update(year_permnos)
+        self.permnos = np.array(sorted(int(p) for p in permnos), dtype=np.int32)
+        self.parts = {c: [] for c in self.columns}
+
+    def map_chunk(self, chunk):
+        year = chunk['date'] // 100
+        keep = np.isin(chunk['PERMNO'], self.permnos) & (year >= 1961) & (year <= 2024)
+        idx = np.nonzero(keep)[0]
+        return {c: np.asarray(chunk[c][idx]) for c in self.columns}
+
+    def reduce(self, partial):
+        for c in self.columns:
+            self.parts[c].append(partial[c])
+
+    def finish(self):
+        if not self.parts['PERMNO']:
+            return {}
+        cols = {c: np.concatenate(parts) for c, parts in self.parts.items()}
+        order = np.lexsort((cols['date'], cols['PERMNO']))
+        cols = {c: a[order] for c, a in cols.items()}
+        permnos, starts = np.unique(cols['PERMNO'], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        keys = [str(p) for p in permnos.tolist()]
+        return summarize_companies(cols, keys, starts.tolist(), ends.tolist(), self.workers)
+
+@profiling.profiled("年度回报")
+def compute_annual_returns(sp500_by_year, company_years=None, workers=1):
     """
     用 CRSP 月度数据计算每年 S&P 500 市值加权回报
     使用年初（上年末）市值作权重
+    company_years: 共享扫描（crsp_scan.refresh_all）已算好的逐公司年度汇总；
+                   为 None 时从 CRSP 面板存储逐公司切片计算
+    workers: 逐公司汇总的进程数（面板 memmap 列由各进程共享映射，不复制）
     """
-    print("加载 CRSP 月度数据 (515万行)...")
-    crsp_path = os.path.join(DATA_DIR, 'crsp_monthly.csv')
-
-    all_sp500_permnos = set()
-    for year, permnos in sp500_by_year.items():
-        all_sp500_permnos.update(permnos)
-
-    # 读取 CRSP 数据
-    # 存储结构: monthly_data[(permno, year)] = [(month, ret, prc, shrout, dlret)]
-    monthly_data = defaultdict(list)
-    row_count = 0
-
-    with open(crsp_path, 'r') as f:
-        for r in csv.DictReader(f):
-            row_count += 1
-            if row_count % 1000000 == 0:
-                print(f"  已处理 {row_count/1000000:.0f}M 行...")
-
-            permno = r['PERMNO']
-            if permno not in all_sp500_permnos:
-                continue
-
-            date = r['date']
-            if not date:
-                continue
-            year = int(date[:4])
-            month = int(date[5:7])
-
-            if year < 1961 or year > 2024:  # 需要上一年12月数据
-                continue
-
-            ret = safe_float(r['RET'])
-            prc = safe_float(r['PRC'])
-            shrout = safe_float(r['SHROUT'])
-            dlret = safe_float(r['DLRET'])
-
-            if prc is not None:
-                prc = abs(prc)
-
-            monthly_data[(permno, year)].append({
-                'month': month,
-                'ret': ret,
-                'prc': prc,
-                'shrout': shrout,
-                'dlret': dlret,
-            })
-
-    print(f"  总行数: {row_count}")
-
-    # 构建年末市值查找表（用于作为下一年的权重）
-    # year_end_mktcap[(permno, year)] = 12月的市值
-    year_end_mktcap = {}
-    for (permno, year), months in monthly_data.items():
-        # 找12月数据
-        dec_data = [m for m in months if m['month'] == 12]
-        if dec_data:
-            m = dec_data[0]
-            if m['prc'] is not None and m['shrout'] is not None:
-                year_end_mktcap[(permno, year)] = m['prc'] * m['shrout']
+    if company_years is None:
+        print("加载 CRSP 面板数据 (515万行)...")
+        crsp_path = os.path.join(DATA_DIR, 'crsp_monthly.csv')
+        panel = load_panel(crsp_path)
+        print(f"  总行数: {panel.rows}")
+
+        all_sp500_permnos = set()
+        for year, permnos in sp500_by_year.items():
+            all_sp500_permnos.update(permnos)
+
+        # 逐公司从面板切片汇总（需要上一年12月数据，从1961年开始）
+        # company_years[(permno, year)] = (annual_ret, jan_mktcap, dec_mktcap)
+        keys = list(all_sp500_permnos)
+        ranges = [panel.row_range(permno) for permno in keys]
+        company_years = summarize_companies(panel.columns, keys, [s for s, _ in ranges],
+                                            [e for _, e in ranges], workers)
+
+    # 年末市值查找表（用于作为下一年的权重）
+    year_end_mktcap = {key: s[2] for key, s in company_years.items() if s[2] is not None}
 
     print("\n计算年度市值加权回报（年初市值权重）...")
     yearly_results = {}
 
     for year in range(1962, 2025):
-        permnos = sp500_by_year.get(year, set())
+        permnos = sp500_by_year.get(year, [])
         if not permnos:
             continue
 
         stock_returns = []
 
         for permno in permnos:
-            months = monthly_data.get((permno, year), [])
-            if not months:
+            summary = company_years.get((permno, year))
+            if summary is None or summary[0] is None:
                 continue
-
-            months.sort(key=lambda x: x['month'])
-
-            # 计算年度回报：连乘月度回报
-            cumulative = 1.0
-            valid_months = 0
-            for m in months:
-                ret = m['ret']
-                if ret is not None:
-                    cumulative *= (1.0 + ret)
-                    valid_months += 1
-
-            # 处理退市回报
-            last_month = months[-1]
-            if last_month['dlret'] is not None:
-                cumulative *= (1.0 + last_month['dlret'])
-
-            if valid_months < 6:
-                continue
-
-            annual_ret = cumulative - 1.0
+            annual_ret, jan_mktcap, _ = summary
 
             # 用上年末（年初）市值作权重
             beg_mktcap = year_end_mktcap.get((permno, year - 1))
 
             # 如果没有上年末数据，用当年1月数据
             if beg_mktcap is None:
-                jan_data = [m for m in months if m['month'] == 1]
-                if jan_data and jan_data[0]['prc'] is not None and jan_data[0]['shrout'] is not None:
-                    beg_mktcap = jan_data[0]['prc'] * jan_data[0]['shrout']
+                beg_mktcap = jan_mktcap
 
             if beg_mktcap is not None and beg_mktcap > 0:
                 stock_returns.append((permno, annual_ret, beg_mktcap))
@@ -180,9 +236,10 @@ def load_company_analysis():
         data = json.load(f)
     return {r['year']: r for r in data}
 
-def main():
-    sp500_by_year = load_sp500_constituents()
-    yearly_returns = compute_annual_returns(sp500_by_year)
+def main(company_years=None, workers=1):
+    with profiling.stage("加载成分股"):
+        sp500_by_year = load_sp500_constituents()
+    yearly_returns = compute_annual_returns(sp500_by_year, company_years, workers)
     company_data = load_company_analysis()
 
     print("\n" + "=" * 100)
@@ -392,4 +449,8 @@ def main():
 """)
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="CRSP 真实年度回报 vs Compustat 盈利增长")
+    parser.add_argument('--workers', type=int, default=1, help="逐公司汇总的进程数（共享内存）")
+    args = profiling.add_arguments(parser).parse_args()
+    profiling.configure(args)
+    main(workers=args.workers)
@@ -0,0 +1,391 @@
+"""
+合成 CRSP / Compustat / CCM / S&P 500 成分股数据（无 WRDS 时用于压测和回归验证）
+
+输出与 data/crsp_compustat/ 下四个文件同名同列：
+  crsp_monthly.csv       PERMNO, date, SHRCD, EXCHCD, SICCD, PRC, RET, SHROUT, DLRET
+  compustat_annual.csv   gvkey, datadate, fyear, conm, ni, csho, prcc_f, epspx, epsfx, dvpsx_f,
+                         revt, seq, at, bkvlps, gind, gsubind
+  ccm_link_table.csv     gvkey, LPERMNO, LINKDT, LINKENDDT, LINKPRIM, LINKTYPE, conm
+  sp500_constituents.csv permno, start, ending
+scale = 1 时 crsp_monthly 约 515 万行（与真实数据同量级），其余文件按 PERMNO 数同比放大；
+scale 可取 0.01（快速测试）到 100（约 5 亿行）。
+
+模拟的真实数据特征：
+  - 上市时间分布（1925 年末首批、1962 年后 AMEX、1972 年后 NASDAQ 大量上市），存续期服从指数分布，
+    未到 2024-12 结束的公司在最后一个月给出 DLRET（数值、字母代码或空）
+  - 首月 RET 为空，少量 'C' / 'B' 代码，负 PRC（买卖价均值），SHROUT 偶有拆股跳变，各字段少量缺失
+  - Compustat 财年结束月份不同（1-5 月结束的归入上一财年），prcc_f / csho 取自同一条 CRSP 价格路径；
+    少量同财年重复行（较早的 datadate，检验“取最晚”去重），GICS 缺失与非法代码
+  - CCM：主链接 LC/P 或 LC/C，部分中途断开再恢复（链接缺口）、部分换 GVKEY（LU），少量次级 J/LN 链接
+  - 成分股：按规模排名逐年维护 500 × scale 个席位，退市即剔除，排名跌出 1.5 倍席位的概率剔除
+
+PERMNO 元数据先整体生成（每个 PERMNO 几个数），之后按 PERMNO 分批生成 CRSP / Compustat / CCM 行并
+立即写出，每批不超过 batch_rows 行，内存与总规模无关。相同 (scale, seed, batch_rows) 输出逐字节一致。
+
+python code/synthetic_data.py --scale 1 [--out DIR] [--seed 1]
+"""
+import argparse
+import calendar
+import os
+import time
+
+import numpy as np
+
+OUT_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'synthetic')
+
+PERMNOS_1X = 40000        # scale = 1 时的 PERMNO 数（crsp_monthly 约 515 万行）
+INDEX_SIZE_1X = 500
+BATCH_ROWS = 200000
+
+BASE_YEAR = 1925
+LAST_YEAR = 2024
+N_MONTHS = (LAST_YEAR - BASE_YEAR + 1) * 12
+CRSP_FIRST_MONTH = 11     # 1925-12
+COMPUSTAT_FIRST_YEAR = 1950
+INDEX_FIRST_YEAR = 1957
+
+CRSP_COLUMNS = ['PERMNO', 'date', 'SHRCD', 'EXCHCD', 'SICCD', 'PRC', 'RET', 'SHROUT', 'DLRET']
+COMPUSTAT_COLUMNS = ['gvkey', 'datadate', 'fyear', 'conm', 'ni', 'csho', 'prcc_f', 'epspx', 'epsfx',
+                     'dvpsx_f', 'revt', 'seq', 'at', 'bkvlps', 'gind', 'gsubind']
+CCM_COLUMNS = ['gvkey', 'LPERMNO', 'LINKDT', 'LINKENDDT', 'LINKPRIM', 'LINKTYPE', 'conm']
+CONSTITUENT_COLUMNS = ['permno', 'start', 'ending']
+
+# (SIC 代码, 对应 GICS 行业) —— 各大类挑几个典型代码
+SIC_GICS = [
+    (1311, '101020'), (2911, '101020'), (1000, '151040'), (2800, '151010'), (2621, '151050'),
+    (3561, '201060'), (3720, '201010'), (4512, '203020'), (5311, '255030'), (3711, '251020'),
+    (5812, '253010'), (2011, '302020'), (2080, '302010'), (5411, '301010'), (2834, '352020'),
+    (8062, '351020'), (3841, '351010'), (6021, '401010'), (6211, '402030'), (6311, '403010'),
+    (3571, '452020'), (3674, '453010'), (7372, '451030'), (4813, '501010'), (4911, '551010'),
+    (4924, '551020'), (6798, '601010'),
+]
+
+
+def _month_strings():
+    start, end = [], []
+    for m in range(N_MONTHS):
+        y, mo = BASE_YEAR + m // 12, m % 12 + 1
+        start.append(f'{y}-{mo:02d}-01')
+        end.append(f'{y}-{mo:02d}-{calendar.monthrange(y, mo)[1]:02d}')
+    return np.array(start), np.array(end)
+
+
+MONTH_START, MONTH_END = _month_strings()
+
+
+def _fmt(values, fmt, missing=None):
+    """数组 → 字符串列表，missing 为 True 的位置写空串"""
+    out = [fmt % v for v in values.tolist()]
+    if missing is not None:
+        for i in np.flatnonzero(missing).tolist():
+            out[i] = ''
+    return out
+
+
+def _write_rows(f, columns):
+    if len(columns[0]):
+        f.write('\n'.join(map(','.join, zip(*columns))))
+        f.write('\n')
+
+
+class Universe:
+    """每个 PERMNO 的元数据：存续区间、规模、行业、Compustat / CCM 链接形态"""
+
+    def __init__(self, scale, rng):
+        n = max(int(round(PERMNOS_1X * scale)), 10)
+        self.n = n
+        self.permno = 10000 + np.arange(n, dtype=np.int64)
+
+        # 上市月份：1925 年末首批 + 按年份加权（1962 年后 AMEX、1972 年后 NASDAQ）
+        years = np.arange(BASE_YEAR + 1, LAST_YEAR + 1)
+        weight = np.where(years >= 1972, 2.0, np.where(years >= 1962, 1.0, 0.25))
+        first_year = rng.choice(years, size=n, p=weight / weight.sum())
+        start = (first_year - BASE_YEAR) * 12 + rng.integers(0, 12, n)
+        start[rng.random(n) < 0.02] = CRSP_FIRST_MONTH
+        life = np.maximum(rng.exponential(160, n).astype(np.int64), 1)
+        self.start = start
+        self.end = np.minimum(start + life - 1, N_MONTHS - 1)
+        self.delisted = start + life - 1 < N_MONTHS - 1
+
+        self.log_size = rng.normal(5.0, 1.8, n)               # 初始市值（百万美元）的对数
+        self.price0 = np.exp(rng.normal(3.0, 0.8, n))
+        self.vol = rng.uniform(0.05, 0.14, n)
+        self.shrcd = np.where(rng.random(n) < 0.8, 10, 11)
+        self.exchcd = rng.choice([1, 2, 3], size=n, p=[0.35, 0.15, 0.5])
+        industry = rng.integers(0, len(SIC_GICS), n)
+        self.sic = np.array([SIC_GICS[i][0] for i in range(len(SIC_GICS))])[industry]
+        self.sic_missing = rng.random(n) < 0.01
+        gind = np.array([g for _, g in SIC_GICS])[industry].astype(object)
+        gind[rng.random(n) < 0.08] = ''
+        gind[rng.random(n) < 0.01] = '991010'                 # 不在 GICS 表里的代码
+        self.gind = gind
+        self.fye = rng.choice([12, 9, 6, 3], size=n, p=[0.7, 0.1, 0.1, 0.1])
+        self.payout = np.where(rng.random(n) < 0.4, 0.0, rng.uniform(0.2, 0.6, n))
+
+        # Compustat 覆盖与 CCM 链接形态
+        end_year = BASE_YEAR + self.end // 12
+        self.linked = (rng.random(n) < 0.8) & (end_year >= COMPUSTAT_FIRST_YEAR)
+        n_linked = int(self.linked.sum())
+        self.gvkey1 = np.full(n, -1, dtype=np.int64)
+        self.gvkey1[self.linked] = 1000 + np.arange(n_linked)
+        self.switch = np.full(n, -1, dtype=np.int64)         # 换 GVKEY 的月份
+        long_lived = self.linked & (self.end - self.start > 60)
+        switch = long_lived & (rng.random(n) < 0.06)
+        self.switch[switch] = self.start[switch] + 24 + rng.integers(0, 1 << 30, int(switch.sum())) % (
+            self.end[switch] - self.start[switch] - 47)
+        self.gvkey2 = np.full(n, -1, dtype=np.int64)
+        self.gvkey2[switch] = 1000 + n_linked + np.arange(int(switch.sum()))
+        self.gap = np.full(n, -1, dtype=np.int64)            # 链接缺口起始月（持续 12-35 个月）
+        gap = long_lived & ~switch & (rng.random(n) < 0.08)
+        self.gap[gap] = self.start[gap] + 12 + rng.integers(0, 1 << 30, int(gap.sum())) % (
+            self.end[gap] - self.start[gap] - 48)
+        self.gap_len = rng.integers(12, 36, n)
+        self.linkprim = np.where(rng.random(n) < 0.9, 'P', 'C')
+        self.secondary = self.linked & (rng.random(n) < 0.03)
+        self.gvkey_width = max(6, len(str(1000 + n_linked + int(switch.sum()))))
+
+    def gvkey_str(self, ids):
+        return [f'{g:0{self.gvkey_width}d}' for g in ids.tolist()]
+
+    def crsp_rows(self):
+        return self.end - self.start + 1
+
+
+def simulate_constituents(u, scale, rng):
+    """逐年按规模排名维护指数席位 → [(permno, start, ending), ...]"""
+    seats = max(int(round(INDEX_SIZE_1X * scale)), 5)
+    member = np.zeros(u.n, dtype=bool)
+    opened = np.full(u.n, -1, dtype=np.int64)
+    intervals = []
+
+    def close(idx, month):
+        for i, m in zip(idx.tolist(), np.broadcast_to(month, idx.shape).tolist()):
+            if m >= opened[i]:
+                intervals.append((int(u.permno[i]), MONTH_START[opened[i]], MONTH_END[m]))
+        opened[idx] = -1
+
+    for year in range(INDEX_FIRST_YEAR, LAST_YEAR + 1):
+        lo, hi = (year - BASE_YEAR) * 12, (year - BASE_YEAR) * 12 + 11
+        alive = (u.start <= lo + 6) & (u.end >= lo + 6)
+        # 退市的成分股在退市月剔除
+        gone = np.flatnonzero(member & (u.end < hi))
+        close(gone, u.end[gone])
+        member[gone] = False
+
+        score = np.where(alive, u.log_size + rng.normal(0, 0.6, u.n), -np.inf)
+        n_alive = int(alive.sum())
+        if n_alive == 0:
+            continue
+        cut = min(int(seats * 1.5), n_alive)
+        top = np.zeros(u.n, dtype=bool)
+        top[np.argpartition(-score, cut - 1)[:cut]] = True
+        dropped = np.flatnonzero(member & alive & ~top & (rng.random(u.n) < 0.5))
+        month = lo + rng.integers(0, 12, len(dropped))
+        close(dropped, month)
+        member[dropped] = False
+
+        need = seats - int((member & alive).sum())
+        if need > 0:
+            candidates = np.flatnonzero(alive & ~member & (u.end > lo + 6))
+            order = candidates[np.argsort(-score[candidates], kind='stable')][:need]
+            opened[order] = np.maximum(lo + rng.integers(0, 12, len(order)), u.start[order])
+            member[order] = True
+
+    still = np.flatnonzero(member)
+    close(still, np.minimum(u.end[still], N_MONTHS - 1))
+    intervals.sort()
+    return intervals
+
+
+def generate_batch(u, a, b, rng):
+    """PERMNO 下标 [a, b) → (crsp 列, compustat 列, ccm 列)"""
+    idx = np.arange(a, b)
+    lens = u.crsp_rows()[idx]
+    total = int(lens.sum())
+    pid = np.repeat(idx, lens)
+    first = np.cumsum(lens) - lens
+    offset = np.arange(total) - np.repeat(first, lens)
+    month = u.start[pid] + offset
+    is_first = offset == 0
+    is_last = offset == np.repeat(lens - 1, lens)
+
+    # ── CRSP 月度 ──
+    ret = np.clip(rng.normal(0.009, u.vol[pid]), -0.9, 3.0)
+    ret[is_first] = 0.0
+    log_ret = np.log1p(ret)
+    cum = np.cumsum(log_ret)
+    log_price = np.log(u.price0[pid]) + cum - np.repeat(cum[first], lens)
+    price = np.exp(log_price)
+    split_log = np.cumsum(np.where(rng.random(total) < 0.003, np.log(2.0), 0.0))
+    split_cum = np.exp(split_log - np.repeat(split_log[first], lens))
+    shares0 = np.exp(u.log_size) * 1000 / u.price0          # 千股
+    shrout = np.maximum(np.round(shares0[pid] * split_cum), 1)
+    price_shown = price / split_cum
+    bid_ask = rng.random(total) < 0.03
+
+    r = rng.random(total)
+    ret_str = _fmt(ret, '%.6f', is_first | (r < 0.005))
+    for i in np.flatnonzero(~is_first & (r >= 0.005) & (r < 0.009)).tolist():
+        ret_str[i] = 'C' if r[i] < 0.008 else 'B'
+    dl = is_last & u.delisted[pid]
+    r_dl = rng.random(total)
+    dlret = np.clip(rng.normal(-0.05, 0.25, total), -1.0, 2.0)
+    dlret_str = _fmt(dlret, '%.6f', ~dl | (r_dl >= 0.8))
+    for i in np.flatnonzero(dl & (r_dl >= 0.8) & (r_dl < 0.9)).tolist():
+        dlret_str[i] = 'ASTP'[i % 4]
+    sic_str = _fmt(u.sic[pid], '%d')
+    for i in np.flatnonzero(u.sic_missing[pid]).tolist():
+        sic_str[i] = 'Z'
+    crsp = [
+        _fmt(u.permno[pid], '%d'),
+        MONTH_END[month].tolist(),
+        _fmt(u.shrcd[pid], '%d'),
+        _fmt(u.exchcd[pid], '%d'),
+        sic_str,
+        _fmt(np.where(bid_ask, -price_shown, price_shown), '%.4f', rng.random(total) < 0.005),
+        ret_str,
+        _fmt(shrout, '%d', rng.random(total) < 0.005),
+        dlret_str,
+    ]
+
+    # ── Compustat 年度：每个财年取财年结束月的 CRSP 价格与股数 ──
+    linked = idx[u.linked[idx]]
+    fy_rows = []
+    for i in linked.tolist():
+        fye = int(u.fye[i])
+        y0 = max(COMPUSTAT_FIRST_YEAR, BASE_YEAR + int(u.start[i]) // 12)
+        y1 = min(LAST_YEAR, BASE_YEAR + int(u.end[i]) // 12)
+        fy = np.arange(y0, y1 + 1)
+        dd_year = fy if fye >= 6 else fy + 1
+        md = (dd_year - BASE_YEAR) * 12 + fye - 1
+        keep = (md >= u.start[i]) & (md <= u.end[i])
+        fy_rows.append((np.full(int(keep.sum()), i), fy[keep], md[keep]))
+    if fy_rows:
+        ci = np.concatenate([r[0] for r in fy_rows])
+        fyear = np.concatenate([r[1] for r in fy_rows])
+        md = np.concatenate([r[2] for r in fy_rows])
+    else:
+        ci = fyear = md = np.zeros(0, dtype=np.int64)
+    # 同财年重复行：较早的 datadate（12 月 → 9 月，财年不变）
+    dup = (u.fye[ci] == 12) & (rng.random(len(ci)) < 0.01)
+    order = np.argsort(np.concatenate([np.arange(len(ci)), np.flatnonzero(dup)]), kind='stable')
+    ci = np.concatenate([ci, ci[dup]])[order]
+    fyear = np.concatenate([fyear, fyear[dup]])[order]
+    md = np.concatenate([md, md[dup] - 3])[order]
+    md = np.maximum(md, u.start[ci])
+
+    n_cs = len(ci)
+    row = first[ci - a] + md - u.start[ci]
+    prcc = price_shown[row]
+    csho = shrout[row] / 1000
+    mcap = prcc * csho
+    ni = mcap * rng.normal(0.06, 0.05, n_cs)
+    revt = mcap * np.exp(rng.normal(0.0, 0.7, n_cs))
+    at = revt * np.exp(rng.normal(0.3, 0.5, n_cs))
+    seq = at * rng.uniform(0.15, 0.6, n_cs)
+    eps = ni / csho
+    dvps = u.payout[ci] * np.maximum(eps, 0)
+    gvkey = np.where((u.gvkey2[ci] >= 0) & (md >= u.switch[ci]), u.gvkey2[ci], u.gvkey1[ci])
+    gvkey_str = u.gvkey_str(gvkey)
+    gind = u.gind[ci].tolist()
+
+    def miss(p=0.03):
+        return rng.random(n_cs) < p
+
+    compustat = [
+        gvkey_str,
+        MONTH_END[md].tolist(),
+        _fmt(fyear, '%d'),
+        [f'SYNTH {g} CORP' for g in gvkey_str],
+        _fmt(ni, '%.3f', miss()),
+        _fmt(csho, '%.3f', miss()),
+        _fmt(prcc, '%.3f', miss()),
+        _fmt(eps, '%.2f', miss()),
+        _fmt(eps * 0.97, '%.2f', miss()),
+        _fmt(dvps, '%.3f', miss(0.1)),
+        _fmt(revt, '%.3f', miss()),
+        _fmt(seq, '%.3f', miss()),
+        _fmt(at, '%.3f', miss()),
+        _fmt(seq / csho, '%.3f', miss()),
+        gind,
+        [g + '10' if g else '' for g in gind],
+    ]
+
+    # ── CCM 链接 ──
+    ccm = [[] for _ in CCM_COLUMNS]
+
+    def link(gv, i, lo, hi, prim, kind):
+        g = u.gvkey_str(np.array([gv]))[0]
+        open_end = hi >= N_MONTHS - 1 and not u.delisted[i]
+        for col, v in zip(ccm, (g, str(int(u.permno[i])), MONTH_START[lo], 'E' if open_end else MONTH_END[hi],
+                                prim, kind, f'SYNTH {g} CORP')):
+            col.append(v)
+
+    for i in linked.tolist():
+        lo, hi, prim = int(u.start[i]), int(u.end[i]), str(u.linkprim[i])
+        g1 = int(u.gvkey1[i])
+        if u.gvkey2[i] >= 0:
+            link(g1, i, lo, int(u.switch[i]) - 1, prim, 'LC')
+            link(int(u.gvkey2[i]), i, int(u.switch[i]), hi, 'P', 'LU')
+        elif u.gap[i] >= 0:
+            link(g1, i, lo, int(u.gap[i]) - 1, prim, 'LC')
+            link(g1, i, min(int(u.gap[i] + u.gap_len[i]), hi), hi, prim, 'LC')
+        else:
+            link(g1, i, lo, hi, prim, 'LC')
+        if u.secondary[i]:
+            link(g1, i, lo, hi, 'J', 'LN')
+    return crsp, compustat, ccm
+
+
+def generate(out_dir=OUT_DIR, scale=1.0, seed=1, batch_rows=BATCH_ROWS):
+    t0 = time.time()
+    rng = np.random.default_rng(seed)
+    u = Universe(scale, rng)
+    intervals = simulate_constituents(u, scale, rng)
+    os.makedirs(out_dir, exist_ok=True)
+    print(f"合成数据 scale={scale}: {u.n:,} 个 PERMNO, {int(u.linked.sum()):,} 个有 Compustat, "
+          f"预计 CRSP {int(u.crsp_rows().sum()):,} 行 → {out_dir}")
+
+    with open(os.path.join(out_dir, 'sp500_constituents.csv'), 'w') as f:
+        f.write(','.join(CONSTITUENT_COLUMNS) + '\n')
+        _write_rows(f, [[str(p) for p, _, _ in intervals], [s for _, s, _ in intervals],
+                        [e for _, _, e in intervals]])
+
+    paths = {name: os.path.join(out_dir, name) for name in
+             ('crsp_monthly.csv', 'compustat_annual.csv', 'ccm_link_table.csv')}
+    files = {name: open(path, 'w') for name, path in paths.items()}
+    counts = dict.fromkeys(files, 0)
+    try:
+        files['crsp_monthly.csv'].write(','.join(CRSP_COLUMNS) + '\n')
+        files['compustat_annual.csv'].write(','.join(COMPUSTAT_COLUMNS) + '\n')
+        files['ccm_link_table.csv'].write(','.join(CCM_COLUMNS) + '\n')
+        cum_rows = np.cumsum(u.crsp_rows())
+        a = 0
+        while a < u.n:
+            target = (cum_rows[a - 1] if a else 0) + batch_rows
+            b = max(int(np.searchsorted(cum_rows, target, side='right')), a + 1)
+            batch = generate_batch(u, a, b, rng)
+            for name, cols in zip(files, batch):
+                _write_rows(files[name], cols)
+                counts[name] += len(cols[0])
+            a = b
+            print(f"  PERMNO {a:,}/{u.n:,}, CRSP {counts['crsp_monthly.csv']:,} 行 ({time.time() - t0:.1f}s)")
+    finally:
+        for f in files.values():
+            f.close()
+
+    counts['sp500_constituents.csv'] = len(intervals)
+    for name, rows in counts.items():
+        print(f"  {name}: {rows:,} 行")
+    print(f"完成 ({time.time() - t0:.1f}s)")
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="合成 CRSP/Compustat/CCM/成分股数据")
+    parser.add_argument('--scale', type=float, default=1.0, help="相对真实数据的规模（0.01 ~ 100）")
+    parser.add_argument('--out', default=OUT_DIR, help="输出目录")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--batch-rows', type=int, default=BATCH_ROWS, help="每批 CRSP 行数上限（控制内存）")
+    args = parser.parse_args()
+    generate(args.out, args.scale, args.seed, args.batch_rows)
@@ -0,0 +1,178 @@
+"""
+方差比检验（Lo-MacKinlay 1988）：所有持有期 k = 2..50 一次向量化算出
+
+对对数收益 x_t（t = 1..T），随机游走下 k 期收益的方差应为 1 期方差的 k 倍：
+    VR(k) = σ²_c(k) / σ²_a
+    σ²_a    = Σ (x_t - μ)² / (T - 1)
+    σ²_c(k) = Σ_{t=k..T} (S_t - S_{t-k} - kμ)² / m，m = k(T-k+1)(1-k/T)（重叠、无偏）
+VR(k) < 1 即均值回归。检验统计量：
+    同方差 z(k)   = (VR - 1) / sqrt(2(2k-1)(k-1) / (3kT))
+    异方差稳健 z*(k) = sqrt(T)(VR - 1) / sqrt(θ(k))，θ(k) = Σ_{j<k} [2(k-j)/k]² δ(j)，
+    δ(j) = T Σ_t (x_t-μ)²(x_{t-j}-μ)² / [Σ_t (x_t-μ)²]²
+S 是 rolling_returns.CumulativeGrowth 的累计对数增长前缀和，所有 k 共用同一个数组：
+k 期重叠收益是一个 (k, t) 的广播相减，δ(j) 是一个 (j, t) 的滞后乘积矩阵，θ 是一次矩阵乘法。
+
+数据：
+  - sp500_data 年度实际总回报（1928-2024）
+  - shiller_complete.json 年度分解的名义总回报（1872-2025）
+  - CRSP 月度指数回报（data/crsp_compustat/crsp_index_monthly.csv，CRSP MSI 格式，
+    日期列 date / DATE / caldt，回报列优先 sprtrn，其次 vwretd）；文件不存在时跳过
+
+python code/variance_ratio.py [--max-k 50]
+"""
+import argparse
+import csv
+import json
+import math
+import os
+
+import numpy as np
+
+from mean_reversion_mc import shiller_total_returns, sp500_real_returns
+import profiling
+from rolling_returns import CumulativeGrowth
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+CRSP_INDEX_PATH = os.path.join(DATA_DIR, 'crsp_compustat', 'crsp_index_monthly.csv')
+OUTPUT_PATH = os.path.join(DATA_DIR, 'variance_ratio.json')
+
+MAX_K = 50
+DATE_COLUMNS = ('date', 'DATE', 'caldt')
+RETURN_COLUMNS = ('sprtrn', 'vwretd')
+
+
+def variance_ratios(returns_pct, max_k=MAX_K):
+    """
+    收益率（%）→ {k, vr, z, z_robust, p, p_robust} 各为长度 K 的数组，k = 2..min(max_k, T-1)
+    """
+    growth = CumulativeGrowth(returns_pct)
+    s = growth.log_growth                      # s[t] = x_1 + ... + x_t，s[0] = 0
+    n = growth.n
+    mu = s[-1] / n
+    dev = np.diff(s) - mu
+    e = dev * dev
+    var_a = e.sum() / (n - 1)
+    ks = np.arange(2, min(max_k, n - 1) + 1)
+
+    # k 期重叠收益：一次广播出 (k, t) 矩阵，t < k 的位置屏蔽
+    t = np.arange(n + 1)
+    lag = t - ks[:, None]
+    overlap = s[t] - s[np.maximum(lag, 0)] - ks[:, None] * mu
+    m = ks * (n - ks + 1) * (1 - ks / n)
+    var_c = np.where(lag >= 0, overlap * overlap, 0.0).sum(axis=1) / m
+    vr = var_c / var_a
+    z = (vr - 1) / np.sqrt(2 * (2 * ks - 1) * (ks - 1) / (3 * ks * n))
+
+    # δ(j)，j = 1..K-1：(j, t) 的滞后乘积矩阵
+    js = np.arange(1, ks[-1]) if len(ks) else np.zeros(0, dtype=np.int64)
+    lag = np.arange(n) - js[:, None]
+    products = np.where(lag >= 0, e * e[np.maximum(lag, 0)], 0.0)
+    delta = n * products.sum(axis=1) / e.sum() ** 2
+    # θ(k) = Σ_{j<k} [2(k-j)/k]² δ(j)
+    weight = np.clip(2 * (ks[:, None] - js) / ks[:, None], 0, None) ** 2
+    theta = weight @ delta
+    z_robust = np.sqrt(n) * (vr - 1) / np.sqrt(theta)
+
+    return {
+        'k': ks, 'vr': vr, 'z': z, 'z_robust': z_robust,
+        'p': normal_p(z), 'p_robust': normal_p(z_robust),
+    }
+
+
+def normal_p(z):
+    """双侧正态 p 值"""
+    return np.array([math.erfc(abs(v) / math.sqrt(2)) for v in np.asarray(z, dtype=np.float64)])
+
+
+def load_crsp_index_returns(path=CRSP_INDEX_PATH):
+    """CRSP 月度指数回报（小数）→ (YYYYMM 列表, 收益率 %)；文件不存在或缺列时返回 None"""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        reader = csv.DictReader(f)
+        date_col = next((c for c in DATE_COLUMNS if c in reader.fieldnames), None)
+        ret_col = next((c for c in RETURN_COLUMNS if c in reader.fieldnames), None)
+        if date_col is None or ret_col is None:
+            return None
+        months, returns = [], []
+        for r in reader:
+            d = r[date_col].replace('-', '').replace('/', '')
+            ret = r[ret_col].strip()
+            if len(d) < 6 or not ret:
+                continue
+            try:
+                returns.append(float(ret) * 100)
+            except ValueError:
+                continue
+            months.append(int(d[:6]))
+    if not months:
+        return None
+    order = np.argsort(months, kind='stable')
+    return [months[i] for i in order], np.array(returns)[order]
+
+
+def to_json(result):
+    return [
+        {'k': int(k), 'vr': round(float(vr), 4), 'z': round(float(z), 3),
+         'z_robust': round(float(zr), 3), 'p': round(float(p), 4), 'p_robust': round(float(pr), 4)}
+        for k, vr, z, zr, p, pr in zip(result['k'], result['vr'], result['z'], result['z_robust'],
+                                       result['p'], result['p_robust'])
+    ]
+
+
+def print_result(title, result, every=1):
+    print(f"\n{title}")
+    print(f"{'k':>4} {'VR(k)':>8} {'z':>8} {'z*':>8} {'p*':>8}")
+    for i in range(0, len(result['k']), every):
+        flag = ' *' if result['p_robust'][i] < 0.05 else ''
+        print(f"{result['k'][i]:>4} {result['vr'][i]:>8.3f} {result['z'][i]:>8.2f} "
+              f"{result['z_robust'][i]:>8.2f} {result['p_robust'][i]:>8.4f}{flag}")
+    if len(result['k']):
+        i = int(np.argmin(result['vr']))
+        print(f"  最小 VR: k={result['k'][i]}, VR={result['vr'][i]:.3f}, z*={result['z_robust'][i]:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lo-MacKinlay 方差比检验（k = 2..max_k）")
+    parser.add_argument('--max-k', type=int, default=MAX_K)
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.configure(args)
+
+    series = {'sp500_real': ('sp500_data 实际总回报', '年度', sp500_real_returns())}
+    shiller = shiller_total_returns()
+    if shiller is not None:
+        series['shiller_total'] = ('Shiller 名义总回报（价格 + 股息率）', '年度', shiller)
+    crsp = load_crsp_index_returns()
+    if crsp is not None:
+        series['crsp_index_monthly'] = ('CRSP 月度指数回报', '月度', crsp)
+    else:
+        print(f"未找到 CRSP 月度指数回报（{os.path.basename(CRSP_INDEX_PATH)}），跳过")
+
+    output = {
+        'metadata': {
+            'method': 'Lo-MacKinlay (1988) 重叠方差比，对数收益',
+            'max_k': args.max_k,
+            'z': '同方差渐近 z',
+            'z_robust': '异方差稳健 z*',
+            'p': '双侧正态 p 值',
+        },
+        'series': {},
+    }
+    for key, (label, freq, (periods, returns)) in series.items():
+        with profiling.stage(f"variance_ratios {key}"):
+            result = variance_ratios(returns, args.max_k)
+        print_result(f"{label}（{freq}, {periods[0]}-{periods[-1]}, T={len(returns)}）", result, every=4)
+        output['series'][key] = {
+            'source': label, 'frequency': freq,
+            'period': f"{periods[0]}-{periods[-1]}", 'observations': len(returns),
+            'horizons': to_json(result),
+        }
+
+    with open(OUTPUT_PATH, 'w') as f:
+        json.dump(output, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存到: {os.path.basename(OUTPUT_PATH)}")
+
+
+if __name__ == "__main__":
+    main()